@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+'''
+A local, anonymous, read-only ftp server to stand in for NCBI's
+when benchmarking against a synthetic mirror (synthetic_mirror.py)
+
+Point microbedb.config at it with:
+
+    ncbi_ftp: '127.0.0.1'
+    ncbi_ftp_port: <port>
+    ncbi_rootdir: '/genomes/refseq/bacteria/'
+
+Requires pyftpdlib.
+'''
+
+import sys, argparse, os, logging, threading
+
+try:
+    from pyftpdlib.authorizers import DummyAuthorizer
+    from pyftpdlib.handlers import FTPHandler
+    from pyftpdlib.servers import FTPServer
+except ImportError:
+    FTPServer = None
+
+class local_ftp():
+
+    def __init__(self, root, host='127.0.0.1', port=0):
+
+        if FTPServer is None:
+            raise Exception("pyftpdlib is needed to serve a local mirror, install it with: pip install pyftpdlib")
+
+        self.root = os.path.abspath(root)
+
+        authorizer = DummyAuthorizer()
+        authorizer.add_anonymous(self.root)
+
+        class mirror_handler(FTPHandler):
+            pass
+        mirror_handler.authorizer = authorizer
+
+        # pyftpdlib logs every command to stderr unless logging is
+        # already set up, we only care about problems
+        ftp_logger = logging.getLogger('pyftpdlib')
+        if not ftp_logger.handlers:
+            ftp_logger.addHandler(logging.StreamHandler())
+        ftp_logger.setLevel(logging.WARNING)
+
+        self.server = FTPServer((host, port), mirror_handler)
+        self.host, self.port = self.server.address[:2]
+        self.thread = None
+
+    def __str__(self):
+        return "local_ftp(): {} on {}:{}".format(self.root, self.host, self.port)
+
+    '''
+    Serve in a background thread, returns the port
+    '''
+    def start(self):
+
+        self.thread = threading.Thread(target=self.server.serve_forever, kwargs={'handle_exit': False}, name="ftp")
+        self.thread.daemon = True
+        self.thread.start()
+
+        return self.port
+
+    def stop(self):
+
+        self.server.close_all()
+
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+def main():
+    parser = argParser()
+    opts = parser.parse_args()
+
+    ftp = local_ftp(opts.root, port=opts.port)
+    print "Serving {} on {}:{}".format(ftp.root, ftp.host, ftp.port)
+
+    try:
+        ftp.server.serve_forever()
+    except KeyboardInterrupt:
+        ftp.server.close_all()
+
+def argParser():
+
+    parser = argparse.ArgumentParser(description='Serve a synthetic NCBI mirror over ftp')
+    parser.add_argument('-r','--root', dest='root', help='Root of the mirror', required=True)
+    parser.add_argument('-p','--port', dest='port', type=int, default=2121, help='Port to listen on', required=False)
+
+    return parser
+
+if __name__ == "__main__":
+
+    main()
@@ -0,0 +1,331 @@
+#!/usr/bin/env python
+
+'''
+Microbenchmarks for the genbank handling MicrobeDB spends its
+CPU on:
+
+    separate_genbank    - fileutils.separate_genbank for the last replicon in the file
+    find_extensions     - fileutils.find_extensions once per replicon, as parse_replicons does
+    create_from_genbank - Replicon.create_from_genbank for every record, into a scratch SQLite database
+    find_replicon_type  - replicon.find_replicon_type for every record
+    write_faa           - Replicon.write_faa for the last replicon in the file
+
+Each function is run on generated genomes (synthetic_mirror.py) of
+every combination of replicon and feature counts given, by default
+1, 10, 100 and 1000 replicons with 5000 and 50000 features in total.
+The inputs are generated once and kept in the work directory.
+
+Every case runs in its own process so its peak memory can be
+measured, the time kept is the best of the repeats.  Peak memory
+is the process' maximum resident set size (and the peak traced by
+tracemalloc where the Python has it), along with how much the
+case grew it.  Results are written as JSON under benchmarks/results
+and two results can be compared with --compare.
+'''
+
+import sys, argparse, os, json, time, resource, multiprocessing, platform, logging
+from datetime import datetime
+
+MYPATH = os.path.abspath(os.path.dirname(__file__))
+PARENTPATH = os.path.abspath(os.path.dirname(MYPATH))
+sys.path.append(os.path.join(PARENTPATH, 'lib'))
+sys.path.append(MYPATH)
+import microbedb.config_singleton
+from synthetic_mirror import make_records, protein_records
+from run_benchmarks import git_commit, RESULTS_DIR
+from Bio import SeqIO
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+FUNCTIONS = ['separate_genbank', 'find_extensions', 'create_from_genbank', 'find_replicon_type', 'write_faa']
+
+# What parse_replicons leaves per replicon in a genome's directory
+REPLICON_EXTENSIONS = ['.gbk', '.fna', '.faa', '.ffn', '.ptt']
+
+ASSEMBLY = 'GCF_000000001.1'
+ASM_NAME = 'ASM1v1'
+PREFIX = '{}_{}'.format(ASSEMBLY, ASM_NAME)
+
+class genome_input():
+
+    def __init__(self, workdir, replicons, features, seed=1):
+
+        self.replicons = replicons
+        self.features = features
+        self.seed = seed
+
+        # A gene and CDS feature per gene
+        self.genes = max(1, features / (2 * replicons))
+
+        self.path = os.path.join(workdir, 'inputs', 'r{}_f{}_s{}'.format(replicons, features, seed))
+        self.gbff_file = os.path.join(self.path, PREFIX + '_genomic.gbff')
+        self.fna_file = os.path.join(self.path, PREFIX + '_genomic.fna')
+        self.faa_file = os.path.join(self.path, PREFIX + '_protein.faa')
+
+    def __str__(self):
+        return "{} replicons, {} features".format(self.replicons, self.features)
+
+    '''
+    Write the genome's genbank, fasta and protein files and the
+    per replicon files, unless they're already there
+    '''
+    def generate(self):
+
+        if os.path.exists(self.faa_file):
+            return
+
+        import random
+
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+
+        records = make_records(random.Random(self.seed), 'Synthetica benchmarkii strain B1',
+                               genes=self.genes, replicons=self.replicons)
+
+        SeqIO.write(records, self.gbff_file, 'genbank')
+        SeqIO.write(records, self.fna_file, 'fasta')
+
+        for record in records:
+            for ext in REPLICON_EXTENSIONS:
+                with open(os.path.join(self.path, record.name + ext), 'w') as outfile:
+                    outfile.write(">\n")
+
+        # Written last, so a half made input is made again
+        SeqIO.write(protein_records(records), self.faa_file, 'fasta')
+
+    def accnums(self):
+        return ['NZ_CP{:06d}'.format(i + 1) for i in range(self.replicons)]
+
+#
+# Set up for a function (untimed), returns the callable to time
+#
+def prepare(function, genome, workdir):
+
+    if function == 'separate_genbank':
+        from microbedb.fileutils import separate_genbank
+
+        outdir = scratch_dir(workdir, 'separate')
+        accnum = genome.accnums()[-1]
+
+        return lambda: separate_genbank(genome.gbff_file, genome.fna_file, accnum, outdir)
+
+    if function == 'find_extensions':
+        from microbedb.fileutils import find_extensions
+
+        accnums = genome.accnums()
+
+        def run():
+            for accnum in accnums:
+                find_extensions(genome.path, accnum)
+
+        return run
+
+    records = list(SeqIO.parse(genome.gbff_file, 'genbank'))
+
+    if function == 'find_replicon_type':
+        from microbedb.models.replicon import find_replicon_type
+
+        def run():
+            for record in records:
+                find_replicon_type(record)
+
+        return run
+
+    init_database(workdir)
+    from microbedb.models import GenomeProject, Replicon, Version, fetch_session
+
+    session = fetch_session()
+    version = Version(dl_directory=genome.path)
+    session.add(version)
+    session.commit()
+
+    gp = GenomeProject(assembly_accession=ASSEMBLY, asm_name=ASM_NAME, version_id=version.version_id,
+                       gpv_directory=genome.path, filename=PREFIX)
+    session.add(gp)
+    session.commit()
+
+    if function == 'create_from_genbank':
+
+        def run():
+            for record in records:
+                Replicon.create_from_genbank(gp, record)
+
+        return run
+
+    if function == 'write_faa':
+        rep = Replicon.create_from_genbank(gp, records[-1])
+
+        # write_faa finds the genome's files from the replicon's
+        # file_name, as the genome's filename prefix
+        rep.file_name = PREFIX
+        faa_file = os.path.join(scratch_dir(workdir, 'faa'), rep.rep_accnum + '.faa')
+
+        return lambda: rep.write_faa(faa_file)
+
+    raise Exception("Unknown function {}".format(function))
+
+def scratch_dir(workdir, name):
+
+    path = os.path.join(workdir, 'scratch', '{}_{}'.format(name, os.getpid()))
+    if not os.path.exists(path):
+        os.makedirs(path)
+
+    return path
+
+#
+# Point MicrobeDB at a scratch SQLite database for this process
+#
+def init_database(workdir):
+
+    config_file = os.path.join(scratch_dir(workdir, 'db'), 'microbedb.config')
+    with open(config_file, 'w') as outfile:
+        outfile.write("db_url: {}\n".format(json.dumps('sqlite:///' + os.path.join(os.path.dirname(config_file), 'microbedb.sqlite'))))
+        outfile.write("basedir: {}\n".format(json.dumps(os.path.dirname(config_file) + '/')))
+
+    microbedb.config_singleton.initConfig(config_file)
+
+'''
+Time one function on one input, run in its own process,
+puts the result on the queue
+'''
+def run_case(function, genome, workdir, repeat, queue):
+
+    try:
+        call = prepare(function, genome, workdir)
+
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if tracemalloc:
+            tracemalloc.start()
+
+        times = []
+        for i in range(repeat):
+            start = time.time()
+            call()
+            times.append(time.time() - start)
+
+        result = {'function': function,
+                  'replicons': genome.replicons,
+                  'features': genome.features,
+                  'seconds': round(min(times), 6),
+                  'times': [round(t, 6) for t in times],
+                  'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+        result['rss_growth_kb'] = result['peak_rss_kb'] - rss_before
+
+        if tracemalloc:
+            result['traced_peak_kb'] = tracemalloc.get_traced_memory()[1] / 1024
+            tracemalloc.stop()
+
+        queue.put(result)
+
+    except Exception as e:
+        queue.put({'function': function, 'replicons': genome.replicons, 'features': genome.features, 'error': str(e)})
+
+def run_isolated(function, genome, workdir, repeat):
+
+    queue = multiprocessing.Queue()
+    p = multiprocessing.Process(target=run_case, args=(function, genome, workdir, repeat, queue))
+    p.start()
+    result = queue.get()
+    p.join()
+
+    return result
+
+'''
+Print the times of two results side by side
+'''
+def compare(old_file, new_file):
+
+    with open(old_file, 'r') as infile:
+        old = json.load(infile)
+    with open(new_file, 'r') as infile:
+        new = json.load(infile)
+
+    print "{:<20} {:>9} {:>9} {:>12} {:>12} {:>8}".format('function', 'replicons', 'features', old['commit'], new['commit'], 'change')
+
+    old_times = dict(((c['function'], c['replicons'], c['features']), c.get('seconds')) for c in old['cases'])
+    for case in new['cases']:
+        before = old_times.get((case['function'], case['replicons'], case['features']))
+        after = case.get('seconds')
+
+        change = "{:+.1f}%".format((after - before) / before * 100) if before and after is not None else 'n/a'
+        print "{:<20} {:>9} {:>9} {:>12} {:>12} {:>8}".format(case['function'], case['replicons'], case['features'], before, after, change)
+
+def main():
+    parser = argParser()
+    opts = parser.parse_args()
+
+    if opts.compare:
+        compare(*opts.compare)
+        return
+
+    # Only problems, logging every replicon would swamp the timings
+    logging.basicConfig(level=logging.WARNING)
+
+    workdir = os.path.abspath(opts.workdir)
+
+    cases = []
+    for replicons in opts.replicons:
+        for features in opts.features:
+            genome = genome_input(workdir, replicons, features, seed=opts.seed)
+
+            start = time.time()
+            genome.generate()
+            print "Input {} ready in {:.2f}s".format(genome, time.time() - start)
+
+            for function in opts.functions:
+                result = run_isolated(function, genome, workdir, opts.repeat)
+
+                if 'error' in result:
+                    print "{:<20} {}: failed, {}".format(function, genome, result['error'])
+                else:
+                    print "{:<20} {}: {:.6f}s, peak rss {} KB (+{} KB)".format(function, genome, result['seconds'], result['peak_rss_kb'], result['rss_growth_kb'])
+
+                cases.append(result)
+
+    sha, dirty = git_commit()
+    created = datetime.now()
+    results = {'commit': sha,
+               'dirty': dirty,
+               'label': opts.label,
+               'created': created.strftime("%Y-%m-%d %H:%M:%S"),
+               'python': platform.python_version(),
+               'platform': platform.platform(),
+               'repeat': opts.repeat,
+               'cases': cases}
+
+    results_file = opts.output
+    if not results_file:
+        if not os.path.exists(RESULTS_DIR):
+            os.makedirs(RESULTS_DIR)
+
+        results_file = os.path.join(RESULTS_DIR, "microbench_{}_{}{}.json".format(created.strftime("%Y%m%d_%H%M%S"), sha, '_dirty' if dirty else ''))
+
+    with open(results_file, 'w') as outfile:
+        json.dump(results, outfile, indent=1)
+
+    print "Wrote results to {}".format(results_file)
+
+    if any('error' in c for c in cases):
+        sys.exit(1)
+
+def argParser():
+
+    parser = argparse.ArgumentParser(description='Microbenchmark MicrobeDB\'s genbank handling')
+    parser.add_argument('-w','--workdir', dest='workdir', default=os.path.join(MYPATH, 'work'), help='Directory for the generated inputs (default: benchmarks/work)', required=False)
+    parser.add_argument('--replicons', dest='replicons', type=int, nargs='+', default=[1, 10, 100, 1000], help='Replicon counts to test (default: 1 10 100 1000)', required=False)
+    parser.add_argument('--features', dest='features', type=int, nargs='+', default=[5000, 50000], help='Total feature counts to test (default: 5000 50000)', required=False)
+    parser.add_argument('-f','--functions', dest='functions', nargs='+', choices=FUNCTIONS, default=FUNCTIONS, help='Functions to benchmark (default: all)', required=False)
+    parser.add_argument('-r','--repeat', dest='repeat', type=int, default=3, help='Runs of each case, the best is kept (default: 3)', required=False)
+    parser.add_argument('--seed', dest='seed', type=int, default=1, help='Random seed for the inputs', required=False)
+    parser.add_argument('-l','--label', dest='label', default=None, help='A note stored with the results', required=False)
+    parser.add_argument('-o','--output', dest='output', default=None, help='Results file (default: benchmarks/results/microbench_<time>_<commit>.json)', required=False)
+    parser.add_argument('--compare', dest='compare', nargs=2, metavar=('OLD', 'NEW'), help='Compare two results files rather than running', required=False)
+
+    return parser
+
+if __name__ == "__main__":
+
+    main()
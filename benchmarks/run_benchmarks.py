@@ -0,0 +1,315 @@
+#!/usr/bin/env python
+
+'''
+End to end benchmarks for MicrobeDB updates
+
+Generates a synthetic NCBI mirror (synthetic_mirror.py), serves
+it over a local ftp server (ftp_server.py) and times the update
+and delete scripts against a fresh SQLite database:
+
+    initial_sync     - bin/update_microbedb.py creating the first version
+    resync_unchanged - a second version when nothing has changed
+    resync_changed   - a third version after a fraction of the genomes change
+    delete_version   - bin/delete_version.py removing the first version
+
+Each scenario runs as its own process, so its time includes
+startup.  The results, with the per stage metrics of each sync,
+are stored as JSON under benchmarks/results named by time and
+git commit, and two results can be compared with --compare.
+'''
+
+import sys, argparse, os, json, shutil, subprocess, tempfile, time, platform, sqlite3
+from datetime import datetime
+
+MYPATH = os.path.abspath(os.path.dirname(__file__))
+PARENTPATH = os.path.abspath(os.path.dirname(MYPATH))
+sys.path.append(MYPATH)
+from synthetic_mirror import synthetic_mirror
+from ftp_server import local_ftp
+
+UPDATE_SCRIPT = os.path.join(PARENTPATH, 'bin', 'update_microbedb.py')
+DELETE_SCRIPT = os.path.join(PARENTPATH, 'bin', 'delete_version.py')
+RESULTS_DIR = os.path.join(MYPATH, 'results')
+
+LOGGING_CONFIG = {'version': 1,
+                  'disable_existing_loggers': False,
+                  'formatters': {'simple': {'format': '%(asctime)s - %(name)s - %(levelname)s - %(message)s'}},
+                  'handlers': {'console': {'class': 'logging.StreamHandler',
+                                           'level': 'INFO',
+                                           'formatter': 'simple',
+                                           'stream': 'ext://sys.stdout'}},
+                  'root': {'level': 'INFO', 'handlers': ['console']}}
+
+class benchmark_run():
+
+    def __init__(self, workdir, mirror, changed=0.05, pipeline=False):
+
+        self.workdir = os.path.abspath(workdir)
+        self.mirror = mirror
+        self.changed = changed
+        self.pipeline = pipeline
+
+        self.db_file = os.path.join(self.workdir, 'microbedb.sqlite')
+        self.basedir = os.path.join(self.workdir, 'data')
+        self.config_file = os.path.join(self.workdir, 'microbedb.config')
+        self.log_dir = os.path.join(self.workdir, 'logs')
+
+    def __str__(self):
+        return "benchmark_run(): {}, {}".format(self.workdir, self.mirror)
+
+    '''
+    Run every scenario in order against a fresh database,
+    returns the list of scenario results
+    '''
+    def run(self, port):
+
+        for path in [self.basedir, self.log_dir]:
+            if os.path.exists(path):
+                shutil.rmtree(path)
+            os.makedirs(path)
+
+        if os.path.exists(self.db_file):
+            os.unlink(self.db_file)
+
+        self.write_config(port)
+
+        sync_args = ['--pipeline'] if self.pipeline else []
+
+        scenarios = []
+        scenarios.append(self.sync('initial_sync', sync_args))
+        scenarios.append(self.sync('resync_unchanged', sync_args))
+
+        changed = self.mirror.mutate(self.changed)
+        scenarios.append(self.sync('resync_changed', sync_args))
+        scenarios[-1]['changed_genomes'] = len(changed)
+
+        scenarios.append(self.timed('delete_version', [DELETE_SCRIPT, '-c', self.config_file, '-m', '1', '--force', '--removefiles']))
+        scenarios[-1]['remaining_genomes'] = self.count_genomes()
+
+        return scenarios
+
+    #
+    # A MicrobeDB config for the scratch database and
+    # directories, fetching from the local ftp server
+    #
+    def write_config(self, port):
+
+        logger_cfg = os.path.join(self.workdir, 'logging.json')
+        with open(logger_cfg, 'w') as outfile:
+            json.dump(LOGGING_CONFIG, outfile, indent=1)
+
+        settings = [('ncbi_ftp', '127.0.0.1'),
+                    ('ncbi_ftp_port', port),
+                    ('ncbi_rootdir', '/genomes/refseq/bacteria/'),
+                    ('db_url', 'sqlite:///' + self.db_file),
+                    ('basedir', self.basedir + '/'),
+                    ('logger_cfg', logger_cfg),
+                    ('taxdump_dir', self.mirror.taxdump_dir)]
+
+        with open(self.config_file, 'w') as outfile:
+            for key, value in settings:
+                outfile.write("{}: {}\n".format(key, json.dumps(value)))
+
+    #
+    # Time an update, keeping its per stage metrics
+    #
+    def sync(self, name, args):
+
+        metrics_file = os.path.join(self.log_dir, name + '_metrics.json')
+        result = self.timed(name, [UPDATE_SCRIPT, '-c', self.config_file, '--metrics', metrics_file] + args)
+
+        if os.path.exists(metrics_file):
+            with open(metrics_file, 'r') as infile:
+                result['stages'] = json.load(infile)['stages']
+
+        result['genomes'] = self.count_genomes(latest=True)
+
+        return result
+
+    #
+    # Run a script, with its output to the scenario's log,
+    # and time it
+    #
+    def timed(self, name, command):
+
+        log_file = os.path.join(self.log_dir, name + '.log')
+        print "Running {}".format(name)
+
+        with open(log_file, 'w') as log:
+            start = time.time()
+            returncode = subprocess.call([sys.executable] + command, stdout=log, stderr=subprocess.STDOUT)
+            seconds = time.time() - start
+
+        if returncode:
+            print "{} failed ({}), see {}".format(name, returncode, log_file)
+
+        print "{}: {:.2f}s".format(name, seconds)
+
+        return {'name': name,
+                'seconds': round(seconds, 3),
+                'returncode': returncode,
+                'log': log_file}
+
+    #
+    # Genomes in the latest version, or in the whole database
+    #
+    def count_genomes(self, latest=False):
+
+        conn = sqlite3.connect(self.db_file)
+        try:
+            if latest:
+                query = "SELECT COUNT(*) FROM genomeproject WHERE version_id = (SELECT MAX(version_id) FROM version)"
+            else:
+                query = "SELECT COUNT(*) FROM genomeproject"
+
+            return conn.execute(query).fetchone()[0]
+
+        except sqlite3.Error:
+            return None
+
+        finally:
+            conn.close()
+
+'''
+The commit being benchmarked, and if the tree has
+uncommitted changes
+'''
+def git_commit():
+
+    try:
+        sha = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=PARENTPATH).strip()
+        dirty = subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=PARENTPATH).strip() != ''
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown', False
+
+    return sha, dirty
+
+'''
+Collapse repeated runs of the scenarios to the best (lowest)
+time of each, keeping every time
+'''
+def summarize(runs):
+
+    summary = []
+    for i, scenario in enumerate(runs[0]):
+        times = [run[i]['seconds'] for run in runs]
+        best = min(range(len(runs)), key=lambda r: runs[r][i]['seconds'])
+
+        result = dict(runs[best][i])
+        result['times'] = times
+        summary.append(result)
+
+    return summary
+
+'''
+Print the scenario times of two results side by side
+'''
+def compare(old_file, new_file):
+
+    with open(old_file, 'r') as infile:
+        old = json.load(infile)
+    with open(new_file, 'r') as infile:
+        new = json.load(infile)
+
+    print "{:<20} {:>12} {:>12} {:>8}".format('scenario', old['commit'], new['commit'], 'change')
+
+    old_times = dict((s['name'], s['seconds']) for s in old['scenarios'])
+    for scenario in new['scenarios']:
+        before = old_times.get(scenario['name'])
+        after = scenario['seconds']
+
+        change = "{:+.1f}%".format((after - before) / before * 100) if before else 'n/a'
+        print "{:<20} {:>12} {:>12} {:>8}".format(scenario['name'], before, after, change)
+
+    if old['params'] != new['params']:
+        print "Warning, the results were run with different parameters: {} vs {}".format(old['params'], new['params'])
+
+def main():
+    parser = argParser()
+    opts = parser.parse_args()
+
+    if opts.compare:
+        compare(*opts.compare)
+        return
+
+    workdir = opts.workdir or tempfile.mkdtemp(prefix='microbedb_bench_')
+    params = {'species': opts.species,
+              'genomes': opts.genomes,
+              'replicons': opts.replicons,
+              'genes': opts.genes,
+              'changed': opts.changed,
+              'pipeline': opts.pipeline,
+              'repeat': opts.repeat}
+
+    print "Benchmarking in {} with {}".format(workdir, params)
+
+    mirror = synthetic_mirror(os.path.join(workdir, 'mirror'), species=opts.species, genomes=opts.genomes,
+                              replicons=opts.replicons, genes=opts.genes, seed=opts.seed)
+
+    start = time.time()
+    mirror.generate()
+    print "Generated mirror in {:.2f}s".format(time.time() - start)
+
+    ftp = local_ftp(mirror.root)
+    port = ftp.start()
+
+    runs = []
+    try:
+        bench = benchmark_run(workdir, mirror, changed=opts.changed, pipeline=opts.pipeline)
+        for i in range(opts.repeat):
+            runs.append(bench.run(port))
+
+    finally:
+        ftp.stop()
+
+    sha, dirty = git_commit()
+    created = datetime.now()
+    results = {'commit': sha,
+               'dirty': dirty,
+               'label': opts.label,
+               'created': created.strftime("%Y-%m-%d %H:%M:%S"),
+               'python': platform.python_version(),
+               'platform': platform.platform(),
+               'params': params,
+               'scenarios': summarize(runs)}
+
+    results_file = opts.output
+    if not results_file:
+        if not os.path.exists(RESULTS_DIR):
+            os.makedirs(RESULTS_DIR)
+
+        results_file = os.path.join(RESULTS_DIR, "{}_{}{}.json".format(created.strftime("%Y%m%d_%H%M%S"), sha, '_dirty' if dirty else ''))
+
+    with open(results_file, 'w') as outfile:
+        json.dump(results, outfile, indent=1)
+
+    print "Wrote results to {}".format(results_file)
+
+    if not opts.workdir and not opts.keep:
+        shutil.rmtree(workdir)
+
+    if any(s['returncode'] for s in results['scenarios']):
+        sys.exit(1)
+
+def argParser():
+
+    parser = argparse.ArgumentParser(description='Benchmark MicrobeDB updates against a synthetic NCBI mirror')
+    parser.add_argument('-w','--workdir', dest='workdir', help='Directory for the mirror, database and flat files (default: a temporary directory)', required=False)
+    parser.add_argument('-s','--species', dest='species', type=int, default=10, help='Number of species directories (default: 10)', required=False)
+    parser.add_argument('-g','--genomes', dest='genomes', type=int, default=2, help='Genomes per species (default: 2)', required=False)
+    parser.add_argument('--replicons', dest='replicons', type=int, default=2, help='Replicons per genome (default: 2)', required=False)
+    parser.add_argument('--genes', dest='genes', type=int, default=200, help='Genes per replicon (default: 200)', required=False)
+    parser.add_argument('--changed', dest='changed', type=float, default=0.05, help='Fraction of genomes changed before the last resync (default: 0.05)', required=False)
+    parser.add_argument('--seed', dest='seed', type=int, default=1, help='Random seed for the mirror', required=False)
+    parser.add_argument('-p','--pipeline', action='store_true', default=False, dest='pipeline', help='Run the syncs with update_microbedb.py --pipeline', required=False)
+    parser.add_argument('-r','--repeat', dest='repeat', type=int, default=1, help='Run the scenarios this many times and keep the best time of each', required=False)
+    parser.add_argument('-l','--label', dest='label', default=None, help='A note stored with the results', required=False)
+    parser.add_argument('-o','--output', dest='output', default=None, help='Results file (default: benchmarks/results/<time>_<commit>.json)', required=False)
+    parser.add_argument('-k','--keep', action='store_true', default=False, dest='keep', help='Keep the temporary directory', required=False)
+    parser.add_argument('--compare', dest='compare', nargs=2, metavar=('OLD', 'NEW'), help='Compare two results files rather than running', required=False)
+
+    return parser
+
+if __name__ == "__main__":
+
+    main()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+
+'''
+Cold start times of MicrobeDB's command line scripts
+
+Each script in bin/ is run with --help, which does all of its
+imports and nothing else, in a fresh interpreter and timed, the
+best of the repeats is kept.  A second run of each script records
+how many modules it imported and which of the heavy optional
+packages (Biopython, requests, pyarrow...) were loaded, so a
+script pulling in something it doesn't need shows up.
+
+Results are written as JSON under benchmarks/results and two
+results can be compared with --compare.
+'''
+
+import sys, argparse, os, json, time, subprocess, platform
+from datetime import datetime
+
+MYPATH = os.path.abspath(os.path.dirname(__file__))
+PARENTPATH = os.path.abspath(os.path.dirname(MYPATH))
+sys.path.append(MYPATH)
+from run_benchmarks import git_commit, RESULTS_DIR
+
+BIN_DIR = os.path.join(PARENTPATH, 'bin')
+
+# Packages worth knowing about when a script loads them
+HEAVY_PACKAGES = ['Bio', 'requests', 'xml.etree', 'sqlalchemy', 'pyarrow', 'numpy', 'ftplib']
+
+# Run inside the child interpreter, runs the script as __main__
+# then prints what was imported after its help
+MODULE_PROBE = '''
+import sys, json
+path = sys.argv[1]
+sys.argv = [path, '--help']
+try:
+    execfile(path, {'__name__': '__main__', '__file__': path})
+except SystemExit:
+    pass
+sys.stdout.write("\\n" + json.dumps(sorted(name for name, module in sys.modules.items() if module)) + "\\n")
+'''
+
+def scripts():
+    return sorted(f for f in os.listdir(BIN_DIR) if f.endswith('.py'))
+
+'''
+Time one script's --help in a fresh interpreter,
+returns the seconds or None if it failed
+'''
+def time_start(script):
+
+    with open(os.devnull, 'w') as devnull:
+        start = time.time()
+        returncode = subprocess.call([sys.executable, os.path.join(BIN_DIR, script), '--help'], stdout=devnull, stderr=devnull)
+        seconds = time.time() - start
+
+    return seconds if returncode == 0 else None
+
+'''
+The modules a script imports before it gets to
+parsing its arguments
+'''
+def imported_modules(script):
+
+    output = subprocess.check_output([sys.executable, '-c', MODULE_PROBE, os.path.join(BIN_DIR, script)])
+
+    return json.loads(output.strip().split("\n")[-1])
+
+def heavy_packages(modules):
+    return [p for p in HEAVY_PACKAGES if any(m == p or m.startswith(p + '.') for m in modules)]
+
+'''
+Print the start times of two results side by side
+'''
+def compare(old_file, new_file):
+
+    with open(old_file, 'r') as infile:
+        old = json.load(infile)
+    with open(new_file, 'r') as infile:
+        new = json.load(infile)
+
+    print "{:<24} {:>12} {:>12} {:>8}".format('script', old['commit'], new['commit'], 'change')
+
+    old_cases = dict((c['script'], c) for c in old['cases'])
+    for case in new['cases']:
+        before = old_cases.get(case['script'], {}).get('seconds')
+        after = case.get('seconds')
+
+        change = "{:+.1f}%".format((after - before) / before * 100) if before and after is not None else 'n/a'
+        print "{:<24} {:>12} {:>12} {:>8}".format(case['script'], before, after, change)
+
+        gained = set(case.get('heavy', [])) - set(old_cases.get(case['script'], {}).get('heavy', []))
+        if gained:
+            print "{:<24} now imports {}".format('', ", ".join(sorted(gained)))
+
+def main():
+    parser = argParser()
+    opts = parser.parse_args()
+
+    if opts.compare:
+        compare(*opts.compare)
+        return
+
+    cases = []
+    for script in opts.scripts or scripts():
+        times = [time_start(script) for i in range(opts.repeat)]
+
+        if None in times:
+            print "{:<24} failed".format(script)
+            cases.append({'script': script, 'error': 'exited with an error'})
+            continue
+
+        modules = imported_modules(script)
+        result = {'script': script,
+                  'seconds': round(min(times), 4),
+                  'times': [round(t, 4) for t in times],
+                  'modules': len(modules),
+                  'heavy': heavy_packages(modules)}
+
+        print "{:<24} {:.3f}s, {} modules, {}".format(script, result['seconds'], result['modules'], ", ".join(result['heavy']) or 'nothing heavy')
+
+        cases.append(result)
+
+    sha, dirty = git_commit()
+    created = datetime.now()
+    results = {'commit': sha,
+               'dirty': dirty,
+               'label': opts.label,
+               'created': created.strftime("%Y-%m-%d %H:%M:%S"),
+               'python': platform.python_version(),
+               'platform': platform.platform(),
+               'repeat': opts.repeat,
+               'cases': cases}
+
+    results_file = opts.output
+    if not results_file:
+        if not os.path.exists(RESULTS_DIR):
+            os.makedirs(RESULTS_DIR)
+
+        results_file = os.path.join(RESULTS_DIR, "startup_{}_{}{}.json".format(created.strftime("%Y%m%d_%H%M%S"), sha, '_dirty' if dirty else ''))
+
+    with open(results_file, 'w') as outfile:
+        json.dump(results, outfile, indent=1)
+
+    print "Wrote results to {}".format(results_file)
+
+    if any('error' in c for c in cases):
+        sys.exit(1)
+
+def argParser():
+
+    parser = argparse.ArgumentParser(description='Time the cold start of MicrobeDB\'s scripts')
+    parser.add_argument('-s','--scripts', dest='scripts', nargs='+', help='Scripts in bin/ to time (default: all)', required=False)
+    parser.add_argument('-r','--repeat', dest='repeat', type=int, default=5, help='Runs of each script, the best is kept (default: 5)', required=False)
+    parser.add_argument('-l','--label', dest='label', default=None, help='A note stored with the results', required=False)
+    parser.add_argument('-o','--output', dest='output', default=None, help='Results file (default: benchmarks/results/startup_<time>_<commit>.json)', required=False)
+    parser.add_argument('--compare', dest='compare', nargs=2, metavar=('OLD', 'NEW'), help='Compare two results files rather than running', required=False)
+
+    return parser
+
+if __name__ == "__main__":
+
+    main()
@@ -0,0 +1,394 @@
+#!/usr/bin/env python
+
+'''
+Generate a synthetic copy of NCBI's bacteria ftp tree for
+benchmarking MicrobeDB without talking to NCBI.
+
+The tree looks like NCBI's:
+
+    genomes/refseq/bacteria/<species>/assembly_summary.txt
+    genomes/all/<accession>_<asm_name>/md5checksums.txt
+    genomes/all/<accession>_<asm_name>/<accession>_<asm_name>_genomic.gbff.gz
+    genomes/all/<accession>_<asm_name>/<accession>_<asm_name>_genomic.fna.gz
+    genomes/all/<accession>_<asm_name>/<accession>_<asm_name>_protein.faa.gz
+
+along with a taxdump (nodes.dmp, names.dmp, merged.dmp) covering
+every taxid in the summaries, so taxonomy can be looked up offline
+(taxdump_dir), and a mirror.json manifest describing what was made.
+
+Genomes are random but reproducible from the seed, each with
+the requested number of replicons (the first a chromosome, the
+rest plasmids) and genes (a gene and CDS feature each).
+'''
+
+import sys, argparse, os, gzip, hashlib, json, random
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+from Bio.SeqFeature import SeqFeature, FeatureLocation
+from Bio.Alphabet import generic_dna, generic_protein
+from Bio import SeqIO
+
+ROOTDIR = 'genomes/refseq/bacteria'
+ALLDIR = 'genomes/all'
+
+AMINO_ACIDS = 'ACDEFGHIKLMNPQRSTVWY'
+
+# Bases per gene, plus some space between them
+GENE_LENGTH = 303
+GENE_SPACING = 60
+
+# The lineage every synthetic species hangs off
+LINEAGE = [(131567, 1, 'no rank', 'cellular organisms'),
+           (2, 131567, 'superkingdom', 'Bacteria'),
+           (1239, 2, 'phylum', 'Firmicutes'),
+           (91061, 1239, 'class', 'Bacilli'),
+           (1385, 91061, 'order', 'Bacillales'),
+           (186817, 1385, 'family', 'Bacillaceae')]
+
+FIRST_GENUS_TAXID = 5000000
+FIRST_SPECIES_TAXID = 6000000
+FIRST_STRAIN_TAXID = 7000000
+
+'''
+Make the genbank records for one synthetic genome, replicons
+records with genes genes (a gene and CDS feature) each
+'''
+def make_records(rng, organism, genes=100, replicons=1, first_accnum=1, first_protein=1):
+
+    records = []
+    protein = first_protein
+
+    for rep in range(replicons):
+        accnum = 'NZ_CP{:06d}'.format(first_accnum + rep)
+        seq = random_dna(rng, genes * (GENE_LENGTH + GENE_SPACING) + GENE_SPACING)
+
+        if rep == 0:
+            description = '{} chromosome, complete genome'.format(organism)
+        else:
+            description = '{} plasmid p{}, complete sequence'.format(organism, rep)
+
+        record = SeqRecord(Seq(seq, generic_dna), id=accnum + '.1', name=accnum, description=description)
+        record.annotations['organism'] = organism
+        record.annotations['source'] = organism
+        record.annotations['taxonomy'] = ['Bacteria'] + [name for taxid, parent, rank, name in LINEAGE[2:]]
+        record.annotations['data_file_division'] = 'BCT'
+        record.annotations['molecule_type'] = 'DNA'
+        record.annotations['topology'] = 'circular'
+
+        record.features.append(SeqFeature(FeatureLocation(0, len(seq)), type='source', strand=1,
+                                          qualifiers={'organism': [organism], 'mol_type': ['genomic DNA']}))
+
+        for gene in range(genes):
+            start = GENE_SPACING + gene * (GENE_LENGTH + GENE_SPACING)
+            location = FeatureLocation(start, start + GENE_LENGTH)
+            strand = 1 if gene % 2 else -1
+            locus_tag = 'SYN{:06d}_{:05d}'.format(first_accnum + rep, gene + 1)
+
+            record.features.append(SeqFeature(location, type='gene', strand=strand,
+                                              qualifiers={'locus_tag': [locus_tag]}))
+            record.features.append(SeqFeature(location, type='CDS', strand=strand,
+                                              qualifiers={'locus_tag': [locus_tag],
+                                                          'product': ['hypothetical protein'],
+                                                          'protein_id': ['WP_{:09d}.1'.format(protein)],
+                                                          'transl_table': ['11'],
+                                                          'translation': [random_protein(rng, GENE_LENGTH / 3 - 1)]}))
+            protein += 1
+
+        records.append(record)
+
+    return records
+
+'''
+The protein records (as in NCBI's _protein.faa) for a genome's
+genbank records
+'''
+def protein_records(records):
+
+    proteins = []
+    for record in records:
+        for feature in record.features:
+            if feature.type != 'CDS':
+                continue
+
+            proteins.append(SeqRecord(Seq(feature.qualifiers['translation'][0], generic_protein),
+                                      id=feature.qualifiers['protein_id'][0], name='',
+                                      description='{} [{}]'.format(feature.qualifiers['product'][0], record.annotations['organism'])))
+
+    return proteins
+
+#
+# Random sequence is built from slices of a small random pool,
+# picking every base with rng.choice is too slow for whole genomes
+#
+def random_dna(rng, length):
+
+    pool = ''.join(rng.choice('ACGT') for i in range(4096))
+
+    chunks = []
+    remaining = length
+    while remaining > 0:
+        start = rng.randint(0, 2048)
+        chunk = pool[start:start + min(remaining, 2048)]
+        chunks.append(chunk)
+        remaining -= len(chunk)
+
+    return ''.join(chunks)
+
+def random_protein(rng, length):
+    return 'M' + ''.join(rng.choice(AMINO_ACIDS) for i in range(length - 1))
+
+class synthetic_mirror():
+
+    def __init__(self, root, species=10, genomes=2, replicons=2, genes=100, seed=1):
+
+        self.root = os.path.abspath(root)
+        self.species = species
+        self.genomes = genomes
+        self.replicons = replicons
+        self.genes = genes
+        self.seed = seed
+        self.manifest = None
+
+    def __str__(self):
+        return "synthetic_mirror(): {}, species: {}, genomes: {}, replicons: {}, genes: {}".format(self.root, self.species, self.genomes, self.replicons, self.genes)
+
+    @property
+    def taxdump_dir(self):
+        return os.path.join(self.root, 'taxdump')
+
+    @property
+    def manifest_file(self):
+        return os.path.join(self.root, 'mirror.json')
+
+    '''
+    Write the whole mirror, the summaries, genomes and
+    taxdump, returns the manifest
+    '''
+    def generate(self):
+
+        genomes = []
+        for s in range(self.species):
+            species_name = 'Synthetica species{}'.format(s + 1)
+            genome_name = species_name.replace(' ', '_')
+
+            for g in range(self.genomes):
+                n = s * self.genomes + g + 1
+                genomes.append({'genome_name': genome_name,
+                                'species': species_name,
+                                'organism': '{} strain S{}'.format(species_name, n),
+                                'strain': 'S{}'.format(n),
+                                'assembly_accession': 'GCF_{:09d}.1'.format(n),
+                                'asm_name': 'ASM{}v1'.format(n),
+                                'taxid': FIRST_STRAIN_TAXID + n,
+                                'species_taxid': FIRST_SPECIES_TAXID + s + 1,
+                                'genus_taxid': FIRST_GENUS_TAXID + s + 1,
+                                'first_accnum': (n - 1) * self.replicons + 1,
+                                'first_protein': (n - 1) * self.replicons * self.genes + 1,
+                                'revision': 0})
+
+        self.manifest = {'species': self.species,
+                         'genomes_per_species': self.genomes,
+                         'replicons': self.replicons,
+                         'genes': self.genes,
+                         'seed': self.seed,
+                         'genomes': genomes}
+
+        for genome in genomes:
+            self.write_genome(genome)
+
+        self.write_summaries()
+        self.write_taxdump()
+        self.write_manifest()
+
+        return self.manifest
+
+    '''
+    Regenerate a fraction of the genomes with new sequence, so
+    their checksums change as they would for a re-annotation,
+    returns the accessions changed
+    '''
+    def mutate(self, fraction=0.05, seed=None):
+
+        self.load_manifest()
+
+        rng = random.Random(seed if seed is not None else self.seed + 1)
+        genomes = self.manifest['genomes']
+        count = max(1, int(round(len(genomes) * fraction)))
+
+        changed = []
+        for genome in rng.sample(genomes, count):
+            genome['revision'] += 1
+            self.write_genome(genome)
+            changed.append(genome['assembly_accession'])
+
+        self.write_manifest()
+
+        return changed
+
+    def load_manifest(self):
+
+        if self.manifest:
+            return self.manifest
+
+        with open(self.manifest_file, 'r') as infile:
+            self.manifest = json.load(infile)
+
+        self.replicons = self.manifest['replicons']
+        self.genes = self.manifest['genes']
+        self.seed = self.manifest['seed']
+
+        return self.manifest
+
+    def write_manifest(self):
+
+        with open(self.manifest_file, 'w') as outfile:
+            json.dump(self.manifest, outfile, indent=1)
+
+    #
+    # Write the gzipped genbank, fasta and protein files for a
+    # genome and their md5checksums.txt
+    #
+    def write_genome(self, genome):
+
+        rng = random.Random('{}:{}:{}'.format(self.seed, genome['assembly_accession'], genome['revision']))
+        records = make_records(rng, genome['organism'], genes=self.genes, replicons=self.replicons,
+                               first_accnum=genome['first_accnum'], first_protein=genome['first_protein'])
+
+        prefix = '{}_{}'.format(genome['assembly_accession'], genome['asm_name'])
+        path = os.path.join(self.root, ALLDIR, prefix)
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+        checksums = []
+        for suffix, fmt, recs in [('_genomic.gbff.gz', 'genbank', records),
+                                  ('_genomic.fna.gz', 'fasta', records),
+                                  ('_protein.faa.gz', 'fasta', protein_records(records))]:
+            filename = prefix + suffix
+
+            # Fixed mtime so unchanged genomes keep the same checksum
+            # when the mirror is regenerated
+            with open(os.path.join(path, filename), 'wb') as raw:
+                with gzip.GzipFile(filename=filename[:-3], mode='wb', fileobj=raw, mtime=0) as outfile:
+                    SeqIO.write(recs, outfile, fmt)
+
+            checksums.append("{}  ./{}".format(md5sum(os.path.join(path, filename)), filename))
+
+        with open(os.path.join(path, 'md5checksums.txt'), 'w') as outfile:
+            outfile.write("\n".join(checksums) + "\n")
+
+    #
+    # One assembly_summary.txt per species directory
+    #
+    def write_summaries(self):
+
+        header = ['assembly_accession', 'bioproject', 'biosample', 'wgs_master', 'refseq_category', 'taxid',
+                  'species_taxid', 'organism_name', 'infraspecific_name', 'isolate', 'version_status',
+                  'assembly_level', 'release_type', 'genome_rep', 'seq_rel_date', 'asm_name', 'submitter',
+                  'gbrs_paired_asm', 'paired_asm_comp', 'ftp_path']
+
+        summaries = dict()
+        for genome in self.manifest['genomes']:
+            prefix = '{}_{}'.format(genome['assembly_accession'], genome['asm_name'])
+
+            fields = [genome['assembly_accession'],
+                      'PRJNA{}'.format(genome['taxid']),
+                      'SAMN{}'.format(genome['taxid']),
+                      '',
+                      'representative genome',
+                      str(genome['taxid']),
+                      str(genome['species_taxid']),
+                      genome['species'],
+                      'strain={}'.format(genome['strain']),
+                      '',
+                      'latest',
+                      'Complete Genome',
+                      'Major',
+                      'Full',
+                      '2015/06/01',
+                      genome['asm_name'],
+                      'MicrobeDB benchmarks',
+                      'na',
+                      'na',
+                      'ftp://localhost/{}/{}'.format(ALLDIR, prefix)]
+
+            summaries.setdefault(genome['genome_name'], []).append("\t".join(fields))
+
+        for genome_name, lines in summaries.items():
+            path = os.path.join(self.root, ROOTDIR, genome_name)
+            if not os.path.exists(path):
+                os.makedirs(path)
+
+            with open(os.path.join(path, 'assembly_summary.txt'), 'w') as outfile:
+                outfile.write("# " + "\t".join(header) + "\n")
+                outfile.write("\n".join(lines) + "\n")
+
+    #
+    # A taxdump holding the fixed lineage plus a genus,
+    # species and strain node for each genome
+    #
+    def write_taxdump(self):
+
+        nodes = [(1, 1, 'no rank', 'root')] + LINEAGE
+
+        seen = set()
+        for genome in self.manifest['genomes']:
+            if genome['species_taxid'] not in seen:
+                seen.add(genome['species_taxid'])
+                nodes.append((genome['genus_taxid'], LINEAGE[-1][0], 'genus', genome['species'].split()[0] + str(genome['species_taxid'])))
+                nodes.append((genome['species_taxid'], genome['genus_taxid'], 'species', genome['species']))
+
+            nodes.append((genome['taxid'], genome['species_taxid'], 'no rank', genome['organism']))
+
+        if not os.path.exists(self.taxdump_dir):
+            os.makedirs(self.taxdump_dir)
+
+        with open(os.path.join(self.taxdump_dir, 'nodes.dmp'), 'w') as outfile:
+            for taxid, parent, rank, name in nodes:
+                outfile.write("{}\t|\t{}\t|\t{}\t|\t\t|\n".format(taxid, parent, rank))
+
+        with open(os.path.join(self.taxdump_dir, 'names.dmp'), 'w') as outfile:
+            for taxid, parent, rank, name in nodes:
+                outfile.write("{}\t|\t{}\t|\t\t|\tscientific name\t|\n".format(taxid, name))
+
+        open(os.path.join(self.taxdump_dir, 'merged.dmp'), 'w').close()
+
+def md5sum(filename):
+
+    md5 = hashlib.md5()
+    with open(filename, 'rb') as infile:
+        for block in iter(lambda: infile.read(1024 * 1024), b''):
+            md5.update(block)
+
+    return md5.hexdigest()
+
+def main():
+    parser = argParser()
+    opts = parser.parse_args()
+
+    mirror = synthetic_mirror(opts.root, species=opts.species, genomes=opts.genomes,
+                              replicons=opts.replicons, genes=opts.genes, seed=opts.seed)
+
+    if opts.mutate:
+        changed = mirror.mutate(opts.mutate)
+        print "Changed {} genomes: {}".format(len(changed), " ".join(changed))
+        return
+
+    manifest = mirror.generate()
+    print "Generated {} genomes in {} species under {}".format(len(manifest['genomes']), opts.species, mirror.root)
+
+def argParser():
+
+    parser = argparse.ArgumentParser(description='Generate a synthetic NCBI mirror for benchmarking')
+    parser.add_argument('-r','--root', dest='root', help='Directory to write the mirror to', required=True)
+    parser.add_argument('-s','--species', dest='species', type=int, default=10, help='Number of species directories', required=False)
+    parser.add_argument('-g','--genomes', dest='genomes', type=int, default=2, help='Genomes per species', required=False)
+    parser.add_argument('--replicons', dest='replicons', type=int, default=2, help='Replicons per genome', required=False)
+    parser.add_argument('--genes', dest='genes', type=int, default=100, help='Genes per replicon', required=False)
+    parser.add_argument('--seed', dest='seed', type=int, default=1, help='Random seed', required=False)
+    parser.add_argument('--mutate', dest='mutate', type=float, help='Regenerate this fraction of an existing mirror\'s genomes', required=False)
+
+    return parser
+
+if __name__ == "__main__":
+
+    main()
@@ -8,8 +8,8 @@ sys.path.append(os.path.join(PARENTPATH, 'lib'))
 import microbedb.config_singleton
 from microbedb.logger_singleton import initLogger
 from microbedb.models import *
-from microbedb.ncbi import ncbi_fetcher
 from microbedb.prompt import query_yes_no
+import microbedb.profiling
 
 def main():
     parser = argParser()
@@ -43,12 +43,19 @@ def main():
 
     print "Removing GenomeProject, files too: {}".format(remove_files)
 
+    profiles = microbedb.profiling.configure_from_options(opts, os.path.join(cfg.basedir, "profile_delete_genome_{}".format(opts.gpv)))
+
     try:
-        GenomeProject.remove_gp(opts.gpv, remove_files=remove_files)
+        with microbedb.profiling.profiled(opts.gpv, 'remove_gp'):
+            GenomeProject.remove_gp(opts.gpv, remove_files=remove_files)
 
     except Exception as e:
         print "Error removing gpv_id {}: ".format(opts.gpv) + str(e)
 
+    finally:
+        if profiles:
+            profiles.write_report()
+
 def argParser():
 
     parser = argparse.ArgumentParser(description='Remove a specific GenomeProject')
@@ -57,6 +64,7 @@ def argParser():
     parser.add_argument('--removefiles', action='store_true', default=False, dest='removefiles', help='Remove the flat files associated with the genome project', required=False)
     parser.add_argument('--force', action='store_true', default=False, dest='force', help='Force removal without prompt', required=False)
     parser.add_argument('-v','--verbose', action='store_true', default=False, dest='verbose', help='Verbose output', required=False)
+    microbedb.profiling.add_arguments(parser)
 
     return parser
 
@@ -8,8 +8,8 @@ sys.path.append(os.path.join(PARENTPATH, 'lib'))
 import microbedb.config_singleton
 from microbedb.logger_singleton import initLogger
 from microbedb.models import *
-from microbedb.ncbi import ncbi_fetcher
 from microbedb.prompt import query_yes_no
+import microbedb.profiling
 
 def main():
     parser = argParser()
@@ -43,19 +43,29 @@ def main():
 
     print "Removing version, files too: {}".format(remove_files)
 
+    # The version's directory may be about to go, profile
+    # to the base directory instead
+    profiles = microbedb.profiling.configure_from_options(opts, os.path.join(cfg.basedir, "profile_delete_version_{}".format(opts.version)))
+
     try:
         session = fetch_session()
 
         version = Version.fetch(opts.version)
 
         for gp in session.query(GenomeProject).filter(GenomeProject.version_id == version):
+            with microbedb.profiling.profiled(gp.gpv_id, 'remove_gp'):
                 GenomeProject.remove_gp(gp.gpv_id, remove_files=remove_files)
 
-        Version.remove_version(version, remove_files=remove_files)
+        with microbedb.profiling.profiled(version, 'remove_version'):
+            Version.remove_version(version, remove_files=remove_files)
 
     except Exception as e:
         print "Error removing version {}: ".format(opts.version) + str(e)
 
+    finally:
+        if profiles:
+            profiles.write_report()
+
 
 def argParser():
 
@@ -65,6 +75,7 @@ def argParser():
     parser.add_argument('--removefiles', action='store_true', default=False, dest='removefiles', help='Remove the flat files associated with the version', required=False)
     parser.add_argument('--force', action='store_true', default=False, dest='force', help='Force removal without prompt', required=False)
     parser.add_argument('-v','--verbose', action='store_true', default=False, dest='verbose', help='Verbose output', required=False)
+    microbedb.profiling.add_arguments(parser)
 
     return parser
 
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+
+'''
+Report which genomes were added, removed, re-annotated
+or cloned between two versions of MicrobeDB.
+
+The report is written as JSON, to stdout unless an
+output file is given.
+'''
+
+import sys, argparse, os, logging, json
+
+# Setup lib paths
+PARENTPATH = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
+sys.path.append(os.path.join(PARENTPATH, 'lib'))
+import microbedb.config_singleton
+from microbedb.logger_singleton import initLogger
+from microbedb.version_diff import diff_versions
+
+def main():
+    parser = argParser()
+    opts = parser.parse_args()
+
+    cfg = microbedb.config_singleton.initConfig(opts.config)
+
+    initLogger(default_path=cfg.logger_cfg)
+    logger = logging.getLogger(__name__)
+
+    try:
+        report = diff_versions(opts.old_version, opts.new_version)
+
+        if opts.summary:
+            for change in ['added', 'removed', 'reannotated', 'cloned']:
+                del report[change]
+
+        if opts.output:
+            with open(opts.output, 'w') as outfile:
+                json.dump(report, outfile, separators=(',', ':'))
+        else:
+            json.dump(report, sys.stdout, separators=(',', ':'))
+            sys.stdout.write("\n")
+
+    except Exception as e:
+        print "Error comparing versions {} and {}: ".format(opts.old_version, opts.new_version) + str(e)
+        sys.exit(1)
+
+def argParser():
+
+    parser = argparse.ArgumentParser(description='Compare two versions of MicrobeDB')
+    parser.add_argument('-c','--config', dest='config', help='Config file', required=True)
+    parser.add_argument('-o','--old', dest='old_version', default='current', help='The older version to compare (default: current)', required=False)
+    parser.add_argument('-n','--new', dest='new_version', default='latest', help='The newer version to compare (default: latest)', required=False)
+    parser.add_argument('-f','--file', dest='output', default=None, help='Write the report to this file rather than stdout', required=False)
+    parser.add_argument('-s','--summary', action='store_true', default=False, dest='summary', help='Only report the counts of each type of change', required=False)
+
+    return parser
+
+if __name__ == "__main__":
+
+    main()
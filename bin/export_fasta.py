@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+
+'''
+Export the protein (.faa), gene (.ffn) or genome (.fna)
+fasta of every replicon in a version as one file, e.g.
+to build a BLAST or DIAMOND database.
+
+Replicons can be limited to a rep_type and/or the
+genomes of a taxon, see microbedb.fasta_export.
+'''
+
+import sys, argparse, os, logging, json
+
+# Setup lib paths
+PARENTPATH = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
+sys.path.append(os.path.join(PARENTPATH, 'lib'))
+import microbedb.config_singleton
+from microbedb.logger_singleton import initLogger
+from microbedb.fasta_export import export_fasta, fasta_types
+
+def main():
+    parser = argParser()
+    opts = parser.parse_args()
+
+    cfg = microbedb.config_singleton.initConfig(opts.config)
+
+    initLogger(default_path=cfg.logger_cfg)
+    logger = logging.getLogger(__name__)
+
+    if opts.rank and opts.taxon is None:
+        parser.error("--rank needs a --taxon")
+
+    try:
+        report = export_fasta(opts.output, fasta_type=opts.type, version=opts.version,
+                              rep_type=opts.rep_type, taxon=opts.taxon, rank=opts.rank,
+                              workers=opts.workers, read_ahead=opts.read_ahead)
+
+    except Exception as e:
+        logger.exception("Error exporting fasta")
+        sys.stderr.write("Error exporting {} fasta from version {}: {}\n".format(opts.type, opts.version, e))
+        sys.exit(1)
+
+    if opts.report:
+        with open(opts.report, 'w') as outfile:
+            json.dump(report, outfile, indent=2, sort_keys=True)
+
+    # The fasta may be going to stdout
+    sys.stderr.write("Exported {replicons} replicons, {records} records, {bytes} bytes in {seconds}s ({mb_per_second} MB/s); {skipped} without a .{fasta_type}, {missing} missing, {errors} errors\n".format(**report))
+
+    if report['missing'] or report['errors']:
+        sys.exit(1)
+
+def argParser():
+
+    parser = argparse.ArgumentParser(description='Export a MicrobeDB version\'s replicon fasta files as one file')
+    parser.add_argument('-c','--config', dest='config', help='Config file', required=True)
+    parser.add_argument('-o','--output', dest='output', help='File to write, - for stdout', required=True)
+    parser.add_argument('-t','--type', dest='type', choices=fasta_types, default='faa', help='Which fasta to export, proteins (faa), genes (ffn) or genomes (fna) (default: faa)', required=False)
+    parser.add_argument('-m','--mversion', dest='version', default='current', help='The version of MicrobeDB to export (default: current)', required=False)
+    parser.add_argument('--rep-type', dest='rep_type', default=None, help='Only replicons of this type, e.g. chromosome, plasmid', required=False)
+    parser.add_argument('--taxon', dest='taxon', default=None, help='Only genomes of this taxid, or name with --rank', required=False)
+    parser.add_argument('--rank', dest='rank', default=None, help='Taxonomic rank of --taxon: superkingdom, phylum, class, order, family, genus or species', required=False)
+    parser.add_argument('-w','--workers', dest='workers', type=int, default=8, help='Threads reading files ahead of the writer (default: 8)', required=False)
+    parser.add_argument('--read-ahead', dest='read_ahead', type=int, default=32, help='Most files held in memory ahead of the writer (default: 32)', required=False)
+    parser.add_argument('-r','--report', dest='report', default=None, help='Also write the report as json to this file', required=False)
+
+    return parser
+
+if __name__ == "__main__":
+
+    main()
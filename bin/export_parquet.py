@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+
+'''
+Export a version of MicrobeDB to Parquet files
+for analytics.
+
+One file is written per table (genomeproject,
+genomeproject_meta, replicon and taxonomy), by
+default in to a parquet directory in the version's
+download directory.
+'''
+
+import sys, argparse, os, logging
+
+# Setup lib paths
+PARENTPATH = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
+sys.path.append(os.path.join(PARENTPATH, 'lib'))
+import microbedb.config_singleton
+from microbedb.logger_singleton import initLogger
+from microbedb.columnar import export_parquet
+
+def main():
+    parser = argParser()
+    opts = parser.parse_args()
+
+    cfg = microbedb.config_singleton.initConfig(opts.config)
+
+    initLogger(default_path=cfg.logger_cfg)
+    logger = logging.getLogger(__name__)
+
+    logger.info("Exporting MicrobeDB version {} to Parquet".format(opts.version))
+
+    try:
+        counts = export_parquet(opts.version, outdir=opts.output, batch_size=opts.batch_size, compression=opts.compression)
+
+        for table in sorted(counts):
+            print "{}: {} rows".format(table, counts[table])
+
+    except Exception as e:
+        print "Error exporting version {}: ".format(opts.version) + str(e)
+        sys.exit(1)
+
+def argParser():
+
+    parser = argparse.ArgumentParser(description='Export a MicrobeDB version to Parquet files')
+    parser.add_argument('-c','--config', dest='config', help='Config file', required=True)
+    parser.add_argument('-m','--mversion', dest='version', default='current', help='The version of MicrobeDB to export (default: current)', required=False)
+    parser.add_argument('-o','--outdir', dest='output', default=None, help='Directory to write the Parquet files to (default: in the version\'s directory)', required=False)
+    parser.add_argument('-b','--batch-size', dest='batch_size', type=int, default=50000, help='Rows per batch (and Parquet row group)', required=False)
+    parser.add_argument('--compression', dest='compression', default='snappy', help='Parquet compression codec (default: snappy)', required=False)
+
+    return parser
+
+if __name__ == "__main__":
+
+    main()
@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+
+'''
+Export a version of MicrobeDB to a read-only SQLite
+snapshot for use on compute nodes.
+
+By default the current version is exported in to
+its own download directory.
+'''
+
+import sys, argparse, os, logging
+
+# Setup lib paths
+PARENTPATH = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
+sys.path.append(os.path.join(PARENTPATH, 'lib'))
+import microbedb.config_singleton
+from microbedb.logger_singleton import initLogger
+from microbedb.snapshot import export_snapshot
+
+def main():
+    parser = argParser()
+    opts = parser.parse_args()
+
+    cfg = microbedb.config_singleton.initConfig(opts.config)
+
+    initLogger(default_path=cfg.logger_cfg)
+    logger = logging.getLogger(__name__)
+
+    logger.info("Exporting MicrobeDB version {} to a snapshot".format(opts.version))
+
+    try:
+        path = export_snapshot(opts.version, path=opts.output, batch_size=opts.batch_size)
+
+        print "Snapshot written to {}".format(path)
+
+    except Exception as e:
+        print "Error exporting version {}: ".format(opts.version) + str(e)
+        sys.exit(1)
+
+def argParser():
+
+    parser = argparse.ArgumentParser(description='Export a MicrobeDB version to a read-only SQLite snapshot')
+    parser.add_argument('-c','--config', dest='config', help='Config file', required=True)
+    parser.add_argument('-m','--mversion', dest='version', default='current', help='The version of MicrobeDB to export (default: current)', required=False)
+    parser.add_argument('-o','--output', dest='output', default=None, help='Snapshot file to write (default: in the version\'s directory)', required=False)
+    parser.add_argument('-b','--batch-size', dest='batch_size', type=int, default=5000, help='Rows to copy per batch', required=False)
+
+    return parser
+
+if __name__ == "__main__":
+
+    main()
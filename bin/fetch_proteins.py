@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+
+'''
+Fetch proteins by accession from a version's protein
+index as fasta, or (re)build the index for a version.
+
+Accessions can be given on the command line or in a
+file, one per line.
+'''
+
+import sys, argparse, os, logging
+
+# Setup lib paths
+PARENTPATH = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
+sys.path.append(os.path.join(PARENTPATH, 'lib'))
+import microbedb.config_singleton
+from microbedb.logger_singleton import initLogger
+from microbedb.protein_index import fetch_proteins, build_index
+
+def main():
+    parser = argParser()
+    opts = parser.parse_args()
+
+    cfg = microbedb.config_singleton.initConfig(opts.config)
+
+    initLogger(default_path=cfg.logger_cfg)
+    logger = logging.getLogger(__name__)
+
+    if opts.build:
+        try:
+            count = build_index(opts.version)
+            print "Indexed {} proteins for version {}".format(count, opts.version)
+
+        except Exception as e:
+            logger.exception("Error building the protein index")
+            print "Error building the protein index for version {}: ".format(opts.version) + str(e)
+            sys.exit(1)
+
+        return
+
+    accessions = list(opts.accessions)
+    if opts.file:
+        with open(opts.file, 'r') as infile:
+            accessions.extend(line.strip() for line in infile if line.strip())
+
+    if not accessions:
+        parser.error("Give some accessions to fetch, or --build")
+
+    try:
+        records = fetch_proteins(accessions, version=opts.version)
+
+    except Exception as e:
+        logger.exception("Error fetching proteins")
+        print "Error fetching proteins from version {}: ".format(opts.version) + str(e)
+        sys.exit(1)
+
+    outfile = open(opts.output, 'w') if opts.output else sys.stdout
+    try:
+        for accession in accessions:
+            if accession in records:
+                outfile.write(records[accession])
+    finally:
+        if opts.output:
+            outfile.close()
+
+    missing = [a for a in accessions if a not in records]
+    if missing:
+        sys.stderr.write("{} accessions not found: {}\n".format(len(missing), " ".join(missing[:20])))
+        sys.exit(1)
+
+def argParser():
+
+    parser = argparse.ArgumentParser(description='Fetch proteins by accession from MicrobeDB\'s protein index')
+    parser.add_argument('-c','--config', dest='config', help='Config file', required=True)
+    parser.add_argument('accessions', nargs='*', help='Protein accessions, e.g. WP_000001.1')
+    parser.add_argument('-f','--file', dest='file', default=None, help='File of protein accessions, one per line', required=False)
+    parser.add_argument('-m','--mversion', dest='version', default='current', help='The version of MicrobeDB to look in (default: current)', required=False)
+    parser.add_argument('-o','--output', dest='output', default=None, help='Write the fasta to this file rather than stdout', required=False)
+    parser.add_argument('--build', action='store_true', default=False, dest='build', help='(Re)build the version\'s protein index from its files', required=False)
+
+    return parser
+
+if __name__ == "__main__":
+
+    main()
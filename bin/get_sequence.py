@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+'''
+Fetch windows of replicons' sequences, given as
+accession:start-end (1 based, inclusive), and write
+them as fasta to stdout or a file.
+
+Only the bytes of each window are read from the
+replicon's .fna, see microbedb.sequence.
+'''
+
+import sys, argparse, os, logging, re
+
+# Setup lib paths
+PARENTPATH = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
+sys.path.append(os.path.join(PARENTPATH, 'lib'))
+import microbedb.config_singleton
+from microbedb.logger_singleton import initLogger
+from microbedb.sequence import get_sequence
+
+def main():
+    parser = argParser()
+    opts = parser.parse_args()
+
+    cfg = microbedb.config_singleton.initConfig(opts.config)
+
+    initLogger(default_path=cfg.logger_cfg)
+    logger = logging.getLogger(__name__)
+
+    outfile = open(opts.output, 'w') if opts.output else sys.stdout
+    failed = False
+
+    try:
+        for region in opts.regions:
+            m = re.match(r'^([^:]+):(\d+)-(\d+)$', region.replace(',', ''))
+            if not m:
+                sys.stderr.write("Can't understand region {}, expected accession:start-end\n".format(region))
+                failed = True
+                continue
+
+            rep_accnum, start, end = m.group(1), int(m.group(2)), int(m.group(3))
+
+            try:
+                seq = get_sequence(rep_accnum, start, end, strand=opts.strand, version=opts.version)
+            except Exception as e:
+                logger.error("Error fetching %s: %s", region, e)
+                sys.stderr.write("Error fetching {}: {}\n".format(region, e))
+                failed = True
+                continue
+
+            outfile.write(">{}:{}-{}{}\n".format(rep_accnum, start, end, '(-)' if opts.strand < 0 else ''))
+            for i in range(0, len(seq), opts.width):
+                outfile.write(seq[i:i + opts.width] + "\n")
+
+    finally:
+        if opts.output:
+            outfile.close()
+
+    if failed:
+        sys.exit(1)
+
+def argParser():
+
+    parser = argparse.ArgumentParser(description='Fetch windows of replicon sequences from MicrobeDB')
+    parser.add_argument('-c','--config', dest='config', help='Config file', required=True)
+    parser.add_argument('regions', nargs='+', help='Windows to fetch, as accession:start-end, e.g. NC_000913:10000-20000')
+    parser.add_argument('-m','--mversion', dest='version', default='current', help='The version of MicrobeDB to look in (default: current)', required=False)
+    parser.add_argument('--strand', dest='strand', type=int, choices=[1, -1], default=1, help='Strand, -1 for the reverse complement (default: 1)', required=False)
+    parser.add_argument('-o','--output', dest='output', default=None, help='Write the fasta to this file rather than stdout', required=False)
+    parser.add_argument('-w','--width', dest='width', type=int, default=60, help='Bases per line (default: 60)', required=False)
+
+    return parser
+
+if __name__ == "__main__":
+
+    main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+
+'''
+Fill the MicrobeDB taxonomy table from a local copy of
+NCBI's taxdump (nodes.dmp and names.dmp) rather than
+querying eutils one taxid at a time.
+
+Every taxid and species_taxid referenced by a genome
+project that's missing from the taxonomy table is added,
+with --relineage all existing rows are rebuilt too.
+'''
+
+import sys, argparse, os, logging
+
+# Setup lib paths
+PARENTPATH = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
+sys.path.append(os.path.join(PARENTPATH, 'lib'))
+import microbedb.config_singleton
+from microbedb.logger_singleton import initLogger
+from microbedb.models import *
+from microbedb.taxdump import init_taxdump
+
+def main():
+    parser = argParser()
+    opts = parser.parse_args()
+
+    cfg = microbedb.config_singleton.initConfig(opts.config)
+
+    initLogger(default_path=cfg.logger_cfg)
+    logger = logging.getLogger(__name__)
+
+    try:
+        if opts.taxdump:
+            init_taxdump(opts.taxdump)
+
+        session = fetch_session()
+
+        taxids = set()
+        for gp in session.query(GenomeProject.taxid, GenomeProject.species_taxid):
+            taxids.add(gp.taxid)
+            taxids.add(gp.species_taxid)
+
+        logger.info("Loading taxonomy from taxdump for {} genome project taxids".format(len(taxids)))
+
+        inserted, updated = Taxonomy.load_taxdump(taxids, relineage=opts.relineage)
+
+        print "Inserted {} taxids, updated {} taxids".format(inserted, updated)
+
+    except Exception as e:
+        print "Error loading taxdump: " + str(e)
+        sys.exit(1)
+
+def argParser():
+
+    parser = argparse.ArgumentParser(description='Load the MicrobeDB taxonomy table from NCBI taxdump files')
+    parser.add_argument('-c','--config', dest='config', help='Config file', required=True)
+    parser.add_argument('-d','--taxdump', dest='taxdump', default=None, help='Directory containing nodes.dmp and names.dmp (default: taxdump_dir from the config)', required=False)
+    parser.add_argument('--relineage', action='store_true', default=False, dest='relineage', help='Rebuild the lineage of every existing taxonomy row', required=False)
+
+    return parser
+
+if __name__ == "__main__":
+
+    main()
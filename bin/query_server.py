@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+
+'''
+Serve read-only MicrobeDB lookups (versions, genomes,
+replicon files, taxonomy) as JSON over HTTP, see
+microbedb.server for the requests it answers.
+'''
+
+import sys, argparse, os, logging
+
+# Setup lib paths
+PARENTPATH = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
+sys.path.append(os.path.join(PARENTPATH, 'lib'))
+import microbedb.config_singleton
+from microbedb.logger_singleton import initLogger
+from microbedb.models import open_snapshot
+
+def main():
+    parser = argParser()
+    opts = parser.parse_args()
+
+    cfg = microbedb.config_singleton.initConfig(opts.config)
+
+    initLogger(default_path=cfg.logger_cfg)
+    logger = logging.getLogger(__name__)
+
+    if opts.snapshot:
+        open_snapshot(opts.snapshot)
+
+    from microbedb.server import serve
+
+    print "Serving MicrobeDB lookups on {}:{}".format(opts.host, opts.port)
+
+    try:
+        serve(host=opts.host, port=opts.port, cache_size=opts.cache_size, version_ttl=opts.version_ttl)
+
+    except Exception as e:
+        logger.exception("Error serving lookups")
+        print "Error serving lookups: " + str(e)
+        sys.exit(1)
+
+def argParser():
+
+    parser = argparse.ArgumentParser(description='Serve read-only MicrobeDB lookups as JSON over HTTP')
+    parser.add_argument('-c','--config', dest='config', help='Config file', required=True)
+    parser.add_argument('--host', dest='host', default='127.0.0.1', help='Address to listen on (default: 127.0.0.1)', required=False)
+    parser.add_argument('-p','--port', dest='port', type=int, default=8080, help='Port to listen on (default: 8080)', required=False)
+    parser.add_argument('--cache-size', dest='cache_size', type=int, default=100000, help='Answers to keep in memory (default: 100000)', required=False)
+    parser.add_argument('--version-ttl', dest='version_ttl', type=float, default=5.0, help='Seconds between checks for a new current version (default: 5)', required=False)
+    parser.add_argument('-s','--snapshot', dest='snapshot', default=None, help='Serve from a read-only snapshot rather than the database', required=False)
+
+    return parser
+
+if __name__ == "__main__":
+
+    main()
@@ -6,6 +6,25 @@ Query NCBI and update MicrobeDB.
 Unless the -n option is given a new version of microbedb
 will be created and populated.
 
+With --plan nothing is changed, a plan of which genomes are
+new, changed or unchanged and how much would be downloaded
+is written out, it can be run later with --execute-plan.
+
+With --pipeline genomes are downloaded, unzipped, parsed and
+loaded concurrently, the number of workers for each stage can
+be set in the config file.
+
+To share an update between several processes or nodes, create
+the version and its work with --seed, start any number of
+--worker processes against the same database, and run --finish
+to wait for them, build the version's protein index and make
+the version current.
+
+With --profile and/or --memprofile each genome (each stage of it
+with --pipeline) is profiled with cProfile and/or tracemalloc, the
+profiles are written to the profile directory in the version's
+directory.
+
 '''
 
 import sys, argparse, os, logging
@@ -17,6 +36,11 @@ import microbedb.config_singleton
 from microbedb.logger_singleton import initLogger
 from microbedb.models import *
 from microbedb.ncbi import ncbi_fetcher
+from microbedb.pipeline import sync_pipeline, start_parse_pool
+from microbedb.shard import shard_worker
+from microbedb.metrics import getMetrics
+from microbedb.sqlstats import getQueryAccounting
+import microbedb.profiling
 
 def main():
     parser = argParser()
@@ -24,12 +48,32 @@ def main():
     
     cfg = microbedb.config_singleton.initConfig(opts.config)
 
+    # The pipeline's parse processes are forked before logging
+    # or metrics start any threads, unless the parsing is being
+    # profiled or its statements counted in this process
+    parse_pool = None
+    if opts.pipeline and not (opts.plan or opts.seed or opts.worker or opts.finish or
+                              opts.profile or opts.memprofile or opts.sql_stats):
+        parse_pool = start_parse_pool()
+
     initLogger(default_path=cfg.logger_cfg)
     logger = logging.getLogger(__name__)
 
     logger.info("Initializing MicrobeDB update")
 
-    if opts.noversion:
+    # Only work out what a sync would do, don't change anything
+    if opts.plan:
+        logger.info("Planning MicrobeDB update, writing plan to {}".format(opts.plan))
+
+        fetcher = ncbi_fetcher()
+        plan = fetcher.plan_version(opts.plan, bandwidth=opts.bandwidth)
+
+        print "New: {new}, changed: {changed}, unchanged: {unchanged}, download: {bytes} bytes, estimated time: {estimated_seconds} seconds".format(**plan['totals'])
+        return
+
+    # Workers share a version someone else has already seeded,
+    # seeding starts a new one unless told not to
+    if opts.noversion or ((opts.worker or opts.finish) and not opts.seed):
         version = Version.latest()
     else:
         version = Version.get_next()
@@ -37,18 +81,106 @@ def main():
 
     logger.info("Updating MicrobeDB version {}".format(version))
 
-    fetcher = ncbi_fetcher()
+    accounting = getQueryAccounting()
+    if opts.sql_stats:
+        accounting.enable()
+
+    metrics = getMetrics()
+    textfile = opts.prometheus or cfg.get('metrics_textfile', None)
+    if textfile:
+        metrics.start_textfile(textfile, interval=int(cfg.get('metrics_interval', 30)))
+
+    # Each worker sharing a version profiles to its own directory
+    profile_dir = os.path.join(Version.fetch_path(version) or cfg.basedir, "profile.{}".format(os.getpid()) if opts.worker else "profile")
+    profiles = microbedb.profiling.configure_from_options(opts, profile_dir)
+
+    try:
+        # Sharing the update between several workers, the version
+        # only becomes current once all the work is finished
+        if opts.seed or opts.worker or opts.finish:
+            worker = shard_worker(version=version, batch_size=opts.batch_size)
+
+            if opts.seed:
+                print "Added {} directories to the work for version {}".format(worker.seed(), version)
+
+            if opts.worker:
+                print "Worker {} processed {} directories".format(worker.name, worker.run())
+
+            if opts.finish:
+                counts = worker.wait()
+                print "Work for version {}: {}".format(version, counts)
+
+                if counts['failed']:
+                    logger.error("{} directories failed for version {}, not making it current".format(counts['failed'], version))
+                    sys.exit(1)
+
+                # The index can be rebuilt later (fetch_proteins.py --build),
+                # so the version still goes live without it
+                try:
+                    print "Indexed {} proteins for version {}".format(worker.build_protein_index(), version)
+                except Exception as e:
+                    logger.exception("Error building the protein index for version {}".format(version))
+
+                Version.set_current(version)
+
+            return
+
+        if opts.pipeline:
+            pipeline = sync_pipeline(queue_size=opts.queue_size, parse_pool=parse_pool)
+            pipeline.run(plan_file=opts.execute_plan)
+
+        else:
+            fetcher = ncbi_fetcher()
+
+            if opts.execute_plan:
+                fetcher.execute_plan(opts.execute_plan)
+            else:
+                fetcher.sync_version()
+
+        # We're done so set the current microbedb version to the new current one
+        Version.set_current(version)
+
+    finally:
+        metrics.stop_textfile()
+
+        # Where the time went, by stage
+        if metrics.report()['stages']:
+            metrics_file = opts.metrics
+            if not metrics_file and Version.fetch_path(version):
+                # Each worker sharing a version gets its own report
+                name = "sync_metrics.{}.json".format(os.getpid()) if opts.worker else "sync_metrics.json"
+                metrics_file = os.path.join(Version.fetch_path(version), name)
+
+            if metrics_file:
+                metrics.write_report(metrics_file)
 
-    fetcher.sync_version()
+        # And the statements sent to the database
+        if opts.sql_stats:
+            sql_file = os.path.join(Version.fetch_path(version) or '.', "sql_stats.{}.json".format(os.getpid()) if opts.worker else "sql_stats.json")
+            accounting.write_report(sql_file, top=opts.sql_top)
 
-    # We're done so set the current microbedb version to the new current one
-    Version.set_current(version)
+        if profiles:
+            profiles.write_report()
 
 def argParser():
 
     parser = argparse.ArgumentParser(description='Update MicrobeDB from NCBI\'s ftp site')
     parser.add_argument('-c','--config', dest='config', help='Config file', required=True)
     parser.add_argument('-n','--noversion', action='store_true', default=False, dest='noversion', help='Don\'t create a new version, use the latest', required=False)
+    parser.add_argument('--plan', dest='plan', default=None, help='Don\'t update, write a plan of what would be downloaded to this file', required=False)
+    parser.add_argument('--execute-plan', dest='execute_plan', default=None, help='Update using a plan file made with --plan rather than rescanning NCBI', required=False)
+    parser.add_argument('-p','--pipeline', action='store_true', default=False, dest='pipeline', help='Run the download, unzip, parse and load stages concurrently', required=False)
+    parser.add_argument('--queue-size', dest='queue_size', type=int, default=None, help='Genomes waiting between pipeline stages before earlier stages pause (default: 100)', required=False)
+    parser.add_argument('--seed', action='store_true', default=False, dest='seed', help='Create a new version (the latest with -n) and fill the shared work table with NCBI\'s directories for workers to claim', required=False)
+    parser.add_argument('--worker', action='store_true', default=False, dest='worker', help='Claim and process directories from the shared work table for the latest version (the seeded one with --seed)', required=False)
+    parser.add_argument('--finish', action='store_true', default=False, dest='finish', help='Wait for the shared work for the latest version to finish, then make it current', required=False)
+    parser.add_argument('--batch-size', dest='batch_size', type=int, default=None, help='Directories a worker claims at a time (default: 5)', required=False)
+    parser.add_argument('--metrics', dest='metrics', default=None, help='Write the per stage timings to this JSON file (default: sync_metrics.json in the version\'s directory)', required=False)
+    parser.add_argument('--prometheus', dest='prometheus', default=None, help='Keep the per stage timings in this Prometheus textfile updated during the run', required=False)
+    parser.add_argument('--sql-stats', action='store_true', default=False, dest='sql_stats', help='Count and time every SQL statement by statement, call site and genome, written to sql_stats.json in the version\'s directory', required=False)
+    parser.add_argument('--sql-top', dest='sql_top', type=int, default=10, help='Number of statements, call sites and genomes to report with --sql-stats (default: 10)', required=False)
+    parser.add_argument('--bandwidth', dest='bandwidth', type=float, default=10.0, help='Expected download speed in MB/s for the plan\'s time estimate (default: 10)', required=False)
+    microbedb.profiling.add_arguments(parser)
 
     return parser
 
@@ -37,6 +37,20 @@ CREATE TABLE IF NOT EXISTS `genomeproject_checksum` (
   PRIMARY KEY (`version_id`,`filename`)
 ) DEFAULT CHARSET=utf8 COLLATE=utf8_unicode_ci;
 
+--
+-- Table structure for table `genomeproject_ingest`
+--
+
+CREATE TABLE IF NOT EXISTS `genomeproject_ingest` (
+  `gpv_id` int(10) unsigned NOT NULL,
+  `version_id` int(10) unsigned DEFAULT NULL,
+  `state` enum('planned','downloading','downloaded','parsed','loaded','linked') CHARACTER SET latin1 DEFAULT 'planned',
+  `cloned` tinyint(1) DEFAULT '0',
+  `updated` datetime DEFAULT NULL,
+  PRIMARY KEY (`gpv_id`),
+  KEY `version_and_state` (`version_id`,`state`)
+) DEFAULT CHARSET=utf8 COLLATE=utf8_unicode_ci;
+
 --
 -- Table structure for table `genomeproject_meta`
 --
@@ -120,3 +134,22 @@ CREATE TABLE IF NOT EXISTS `version` (
   `is_current` tinyint(1) NOT NULL DEFAULT '0',
   PRIMARY KEY (`version_id`)
 ) DEFAULT CHARSET=latin1;
+
+--
+-- Table structure for table `sync_work`
+--
+
+CREATE TABLE IF NOT EXISTS `sync_work` (
+  `work_id` int(10) unsigned NOT NULL AUTO_INCREMENT,
+  `version_id` int(10) unsigned NOT NULL,
+  `genome_name` varchar(128) COLLATE utf8_unicode_ci NOT NULL,
+  `state` enum('pending','leased','done','failed') CHARACTER SET latin1 DEFAULT 'pending',
+  `owner` varchar(96) CHARACTER SET latin1 DEFAULT NULL,
+  `lease_expires` datetime DEFAULT NULL,
+  `heartbeat` datetime DEFAULT NULL,
+  `attempts` int(10) unsigned DEFAULT '0',
+  `last_error` text COLLATE utf8_unicode_ci,
+  PRIMARY KEY (`work_id`),
+  UNIQUE KEY `version_genome` (`version_id`,`genome_name`),
+  KEY `version_and_state` (`version_id`,`state`)
+) DEFAULT CHARSET=utf8 COLLATE=utf8_unicode_ci;
@@ -0,0 +1,77 @@
+'''
+A small bounded least recently used cache
+
+Used to keep frequently looked up rows in memory, such as
+the taxonomy of the handful of species most genomes share.
+Safe to share between threads.
+'''
+
+import threading
+from collections import OrderedDict
+
+class lru_cache():
+
+    def __init__(self, maxsize=10000):
+
+        self.maxsize = maxsize
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __str__(self):
+        return "lru_cache(): {} of {} items, hits: {}, misses: {}".format(len(self.items), self.maxsize, self.hits, self.misses)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, key):
+        return key in self.items
+
+    '''
+    Fetch an item from the cache, marking it as recently used,
+    default if it isn't in the cache
+    '''
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                value = self.items.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+
+            self.items[key] = value
+            self.hits += 1
+
+            return value
+
+    '''
+    Add an item to the cache, evicting the least recently used
+    item if we're full
+    '''
+    def put(self, key, value):
+        with self.lock:
+            if key in self.items:
+                self.items.pop(key)
+            elif len(self.items) >= self.maxsize:
+                self.items.popitem(last=False)
+
+            self.items[key] = value
+
+    def remove(self, key):
+        with self.lock:
+            self.items.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+    '''
+    Change the maximum size, evicting items if needed
+    '''
+    def resize(self, maxsize):
+        with self.lock:
+            self.maxsize = maxsize
+
+            while len(self.items) > maxsize:
+                self.items.popitem(last=False)
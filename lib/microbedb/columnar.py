@@ -0,0 +1,148 @@
+'''
+Library to export a version of MicrobeDB to Parquet files
+for analytics
+
+The genomeproject, genomeproject_meta, replicon and taxonomy
+rows for a version are streamed out of the database in fixed
+size batches and each batch is appended to the table's Parquet
+file as a row group, so memory use stays bounded by the batch
+size rather than the size of the version.
+
+Requires pyarrow.
+'''
+
+import os
+import logging
+from sqlalchemy import Integer, Float, Boolean, Date
+from .models import *
+from .models import Base, stream_rows
+from .snapshot import snapshot_query
+
+# Loaded by load_pyarrow(), on the first export
+pa = None
+pq = None
+
+logger = logging.getLogger(__name__)
+
+columnar_tables = ['genomeproject', 'genomeproject_meta', 'replicon', 'taxonomy']
+
+'''
+The default directory the Parquet files for a version are written to
+'''
+def parquet_path(version='current'):
+    path = Version.fetch_path(version)
+
+    if not path:
+        return None
+
+    return os.path.join(path, 'parquet')
+
+'''
+Export a version of MicrobeDB to one Parquet file per table in
+outdir (by default a parquet directory in the version's dl_directory).
+
+Returns a dict of table name to the number of rows written
+'''
+def export_parquet(version='current', outdir=None, batch_size=50000, compression='snappy'):
+    global logger
+
+    if not load_pyarrow():
+        raise Exception("pyarrow is required to export Parquet files")
+
+    version = Version.fetch(version)
+
+    if not outdir:
+        outdir = parquet_path(version)
+
+    if not outdir:
+        raise Exception("Can't find a path for version {}".format(version))
+
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+
+    logger.info("Exporting MicrobeDB version {} to Parquet in {}".format(version, outdir))
+
+    counts = dict()
+    for table_name in columnar_tables:
+        table = Base.metadata.tables[table_name]
+        filename = os.path.join(outdir, table_name + '.parquet')
+
+        counts[table_name] = export_table(table, version, filename, batch_size, compression)
+        logger.debug("Wrote {} rows from {} to {}".format(counts[table_name], table_name, filename))
+
+    return counts
+
+#
+# Stream a single table's rows for a version in to a Parquet file,
+# writing to a temporary name and moving it in place when done
+#
+def export_table(table, version, filename, batch_size, compression):
+    schema = arrow_schema(table)
+    names = [c.name for c in table.columns]
+
+    tmp_filename = filename + '.tmp'
+    writer = pq.ParquetWriter(tmp_filename, schema, compression=compression)
+
+    count = 0
+    try:
+        for rows in stream_rows(snapshot_query(table, version), batch_size):
+            arrays = [pa.array([row[i] for row in rows], type=schema.field(name).type)
+                      for i, name in enumerate(names)]
+
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            count += len(rows)
+
+        writer.close()
+
+    except Exception as e:
+        logger.exception("Error exporting {} for version {}".format(table.name, version))
+        writer.close()
+        os.unlink(tmp_filename)
+        raise e
+
+    os.rename(tmp_filename, filename)
+
+    return count
+
+#
+# pyarrow (and numpy) take longer to import than the rest of
+# MicrobeDB put together, only import them for an export
+#
+def load_pyarrow():
+    global pa
+    global pq
+
+    if pa is None:
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            return False
+
+        pa = pyarrow
+        pq = pyarrow.parquet
+
+    return True
+
+#
+# Map the table's column types to arrow types, anything
+# we don't recognize (Text, String, Enum) becomes a string
+#
+def arrow_schema(table):
+    fields = []
+
+    for col in table.columns:
+        if isinstance(col.type, Boolean):
+            t = pa.bool_()
+        elif isinstance(col.type, Integer):
+            t = pa.int64()
+        elif isinstance(col.type, Float):
+            t = pa.float64()
+        elif isinstance(col.type, Date):
+            t = pa.date32()
+        else:
+            t = pa.string()
+
+        fields.append(pa.field(col.name, t))
+
+    return pa.schema(fields)
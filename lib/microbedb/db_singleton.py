@@ -1,40 +1,63 @@
 import microbedb.config_singleton
-import mysql.connector
-from mysql.connector import Error
+from sqlalchemy import create_engine
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.exc import SQLAlchemyError
 
 '''
 Module for initializing a connection to the database,
 acts like a singleton.
 
+The database is chosen by the db_url option in the config
+file, any SQLAlchemy URL can be used, for example:
+
+    db_url: 'sqlite:////data/microbedb/microbedb.sqlite'
+
+If no db_url is given the MySQL URL is built from the
+db_host, database, db_user and db_password options.
+
 @author: Matthew Laird
 @created: May 8, 2015
 '''
 
 conn = None
 
-def initDB():
+'''
+Build the SQLAlchemy URL for the configured database
+'''
+def fetch_db_url():
 
     cfg = microbedb.config_singleton.getConfig()
 
+    db_url = cfg.get('db_url', None)
+    if db_url:
+        return db_url
+
+    return 'mysql://{}:{}@{}/{}?charset=utf8&use_unicode=0'.format(cfg.db_user, cfg.db_password, cfg.db_host, cfg.database)
+
+'''
+The backend name (mysql, sqlite, ...) of the configured database
+'''
+def fetch_backend():
+
+    return make_url(fetch_db_url()).get_backend_name()
+
+def initDB():
+    global conn
+
     try:
-        conn = mysql.connector.connect(host=cfg.db_host,
-                                       database=cfg.database,
-                                       user=cfg.db_user,
-                                       password=cfg.db_password)
+        engine = create_engine(fetch_db_url())
+        conn = engine.raw_connection()
 
-        if conn.is_connected():
-            return conn
+        return conn
 
-    except Error as e:
+    except SQLAlchemyError as e:
         print "Error connecting to db: {}".format(str(e))
         raise e
 
-    raise Exception("Error connecting to database, unknown reason")
-
 def fetch_connection():
     global conn
 
     if conn:
-        return self.conn
+        return conn
 
-    raise("Database connection not initialized yet")
+    raise Exception("Database connection not initialized yet")
@@ -7,6 +7,7 @@ from sqlalchemy.orm import relationship, sessionmaker
 from sqlalchemy.sql import func
 from sqlalchemy import create_engine
 import microbedb.config_singleton
+import microbedb.db_singleton
 
 Base = declarative_base()
 
@@ -101,9 +102,7 @@ def init_mapper():
     if session:
         return session
 
-    cfg = microbedb.config_singleton.getConfig()
-
-    engine = create_engine('mysql://{}:{}@{}/{}?charset=utf8&use_unicode=0'.format(cfg.db_user, cfg.db_password, cfg.db_host, cfg.database), pool_recycle=3600)
+    engine = create_engine(microbedb.db_singleton.fetch_db_url(), pool_recycle=3600)
 
     Base.metadata.bind = engine
 
@@ -0,0 +1,272 @@
+'''
+Library to export every replicon's protein (.faa), gene (.ffn)
+or genome (.fna) fasta in a version as one file, e.g. to build
+a BLAST or DIAMOND database
+
+The replicons are found with microbedb.query, optionally only
+those of a rep_type and/or taxon, and their files are concatenated
+in rpv_id order.  A pool of reader threads reads the files ahead of
+the writer, so on network storage many files are being fetched at
+once, while the writer copies them out in large buffered writes.
+At most read_ahead files are held in memory, files larger than
+max_prefetch are streamed by the writer instead.
+
+Returns (and logs) a report of the replicons, bytes and fasta
+records exported.
+'''
+
+import os
+import sys
+import time
+import logging
+import threading
+import microbedb.query as query
+from microbedb.models import Version
+
+logger = logging.getLogger(__name__)
+
+fasta_types = ['faa', 'ffn', 'fna']
+
+# Bytes per write, and the largest file read
+# ahead in to memory rather than streamed
+copy_buffer = 1024 * 1024
+max_prefetch = 16 * 1024 * 1024
+
+'''
+Read items in parallel with a pool of threads, handing the results
+back in the order the items were given with at most window of
+them read ahead of the caller
+'''
+class ordered_reader():
+
+    def __init__(self, items, read, workers=8, window=32):
+
+        self.items = iter(enumerate(items))
+        self.read = read
+        self.workers = max(1, workers)
+        self.slots = threading.Semaphore(max(1, window))
+        self.lock = threading.Lock()
+        self.ready = threading.Condition()
+        self.results = dict()
+        self.taken = 0
+        self.count = None
+
+    def __iter__(self):
+
+        threads = [threading.Thread(target=self.worker, name="fasta_reader_{}".format(i)) for i in range(self.workers)]
+        for t in threads:
+            t.daemon = True
+            t.start()
+
+        i = 0
+        while True:
+            with self.ready:
+                while i not in self.results and (self.count is None or i < self.count):
+                    self.ready.wait()
+
+                if i not in self.results:
+                    break
+
+                result = self.results.pop(i)
+
+            self.slots.release()
+            i += 1
+
+            yield result
+
+        for t in threads:
+            t.join()
+
+    def worker(self):
+
+        while True:
+            self.slots.acquire()
+
+            # Items are taken in order, so the one the caller is
+            # waiting for is always being read before later ones
+            with self.lock:
+                try:
+                    index, item = next(self.items)
+                except StopIteration:
+                    with self.ready:
+                        self.count = self.taken
+                        self.ready.notify_all()
+                    self.slots.release()
+                    return
+
+                self.taken = index + 1
+
+            try:
+                result = (item, self.read(item), None)
+            except Exception as e:
+                result = (item, None, e)
+
+            with self.ready:
+                self.results[index] = result
+                self.ready.notify_all()
+
+'''
+Export the fasta_type (faa, ffn or fna) files of every replicon in
+a version to outfile (a file name, or - for stdout), optionally only
+the replicons of rep_type and/or the genomes of a taxon (see
+microbedb.query.genomes).
+
+The file is written under a temporary name and moved in to place
+when complete.  Returns a report dict of what was exported.
+'''
+def export_fasta(outfile, fasta_type='faa', version='current', rep_type=None, taxon=None, rank=None, workers=8, read_ahead=32):
+    global logger
+
+    if fasta_type not in fasta_types:
+        raise Exception("Unknown fasta type {}, expected one of {}".format(fasta_type, ", ".join(fasta_types)))
+
+    version = Version.fetch(version)
+    ext = '.' + fasta_type
+
+    logger.info("Exporting %s files for version %s to %s (rep_type: %s, taxon: %s %s)", ext, version, outfile, rep_type, rank or '', taxon)
+
+    start = time.time()
+
+    # Directories of the genomes wanted
+    genomes = query.genomes(version=version, taxon=taxon, rank=rank, stream=True)
+    directories = dict((gp.gpv_id, gp.gpv_directory) for gp in genomes)
+
+    report = {'version': version,
+              'fasta_type': fasta_type,
+              'output': outfile,
+              'replicons': 0,
+              'skipped': 0,
+              'missing': 0,
+              'errors': 0,
+              'bytes': 0,
+              'records': 0}
+
+    # The paths are listed up front, the readers run
+    # in other threads than the database connection
+    files = []
+    for rep in query.replicons(version=version, rep_type=rep_type, stream=True):
+        if rep.gpv_id not in directories:
+            continue
+
+        # Replicons with nothing of this type (e.g. no proteins)
+        # don't have a non-empty file for it
+        if ext not in (rep.file_types or '').split():
+            report['skipped'] += 1
+            continue
+
+        files.append(os.path.join(directories[rep.gpv_id], rep.file_name) + ext)
+
+    to_stdout = outfile == '-'
+    tmp_file = "{}.{}.tmp".format(outfile, os.getpid())
+
+    out = sys.stdout if to_stdout else open(tmp_file, 'wb', copy_buffer)
+
+    try:
+        writer = fasta_writer(out)
+
+        for path, contents, error in ordered_reader(files, prefetch, workers=workers, window=read_ahead):
+            if error:
+                if isinstance(error, (IOError, OSError)) and not os.path.exists(path):
+                    logger.warning("Missing fasta file %s", path)
+                    report['missing'] += 1
+                else:
+                    logger.error("Error reading %s: %s", path, error)
+                    report['errors'] += 1
+                continue
+
+            if contents is None:
+                with open(path, 'rb') as infile:
+                    writer.copy(infile)
+            else:
+                writer.write(contents)
+
+            report['replicons'] += 1
+
+        writer.finish()
+        report['bytes'] = writer.bytes
+        report['records'] = writer.records
+
+        if not to_stdout:
+            out.close()
+            os.rename(tmp_file, outfile)
+
+    except Exception as e:
+        logger.exception("Error exporting fasta for version {}".format(version))
+        if not to_stdout:
+            out.close()
+            if os.path.exists(tmp_file):
+                os.unlink(tmp_file)
+        raise e
+
+    report['seconds'] = round(time.time() - start, 3)
+    report['mb_per_second'] = round(report['bytes'] / 1048576.0 / report['seconds'], 1) if report['seconds'] else None
+
+    logger.info("Exported %s replicons, %s records, %s bytes in %ss (%s skipped, %s missing, %s errors)",
+                report['replicons'], report['records'], report['bytes'], report['seconds'],
+                report['skipped'], report['missing'], report['errors'])
+
+    return report
+
+#
+# Read a file in to memory for the writer, or leave large
+# ones for the writer to stream
+#
+def prefetch(path):
+
+    if os.path.getsize(path) > max_prefetch:
+        return None
+
+    with open(path, 'rb') as infile:
+        return infile.read()
+
+#
+# Writes the fasta files out one after another, counting
+# the records (lines starting with >) as they pass and
+# making sure every file ends with a newline
+#
+class fasta_writer():
+
+    def __init__(self, out):
+        self.out = out
+        self.bytes = 0
+        self.records = 0
+        self.last = "\n"
+
+    def write(self, data):
+
+        if not data:
+            return
+
+        # A file ending without a newline would run in to the next
+        if self.last != "\n" and data.startswith('>'):
+            self.emit("\n")
+
+        self.emit(data)
+
+    def copy(self, infile):
+
+        first = True
+        while True:
+            data = infile.read(copy_buffer)
+            if not data:
+                break
+
+            if first:
+                self.write(data)
+                first = False
+            else:
+                self.emit(data)
+
+    def emit(self, data):
+
+        self.records += data.count("\n>") + (1 if self.last == "\n" and data.startswith('>') else 0)
+        self.out.write(data)
+        self.bytes += len(data)
+        self.last = data[-1]
+
+    def finish(self):
+
+        if self.last != "\n":
+            self.emit("\n")
+
+        self.out.flush()
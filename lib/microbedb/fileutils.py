@@ -4,10 +4,6 @@ Library for various file manipulation in MicrobeDB
 
 import logging
 import re, os, sys
-from Bio import SeqIO
-from Bio.SeqRecord import SeqRecord
-from Bio.Seq import Seq
-from Bio.Alphabet import IUPAC, generic_protein, generic_dna
 import pprint
 
 logger = logging.getLogger(__name__)
@@ -45,6 +41,13 @@ def find_extensions(path, prefix=None):
 def separate_genbank(genbank_file, fna_file, rep_accnum, path):
     global logger
 
+    # Biopython is slow to import, so it's only loaded
+    # by the commands that actually parse genbank files
+    from Bio import SeqIO
+    from Bio.SeqRecord import SeqRecord
+    from Bio.Seq import Seq
+    from Bio.Alphabet import IUPAC, generic_protein
+
     logger.info("Separating genbank file {} based on accnum {}, writing to {}".format(genbank_file, rep_accnum, path))
 
     if not os.path.exists(genbank_file):
@@ -231,3 +234,27 @@ def find_xref(xrefs, xref_type="GI"):
     except Exception as e:
         logger.exception("Error extracting xrefs from: " + str(xrefs))
         return None
+
+'''
+Walk the records of a fasta file without parsing the sequences,
+yields the id (first word of the header), byte offset and length
+in bytes (header included) of each record
+'''
+def fasta_offsets(fasta_file):
+
+    offset = 0
+    current = None
+
+    with open(fasta_file, 'rb') as infile:
+        for line in infile:
+            if line.startswith('>'):
+                if current:
+                    yield current[0], current[1], offset - current[1]
+
+                words = line[1:].split()
+                current = (words[0] if words else '', offset)
+
+            offset += len(line)
+
+    if current:
+        yield current[0], current[1], offset - current[1]
@@ -1,25 +1,52 @@
 import logging
 import os
 import json
+import time
+import atexit
+import threading
+import Queue
 import logging.config
+import microbedb.config_singleton
 
 '''
 Module for initializing the logger from a config file, acts
 like a singleton
 
+Optionally, set in microbedb.config:
+
+    log_queue        - hand records to a background thread that does
+                       the writing, so logging never blocks on slow
+                       (e.g. shared) storage
+    log_json         - write each record as a JSON object, with any
+                       extra fields given to the logging call
+    log_sample_after - after this many of the same (INFO or DEBUG)
+                       message only let through one in log_sample_every,
+                       noting how many were suppressed
+
+Sampling works on the unformatted message, so it only catches
+messages logged lazily, e.g. logger.info("Found %s", accession)
+rather than logger.info("Found {}".format(accession)).
 
 @author: Matthew Laird
 @created: May 23, 2015
 '''
 
 logger = None
+listener = None
+sampler = None
+
+# The attributes every LogRecord has, anything else was
+# passed in extra and is added to the JSON
+record_attributes = set(logging.LogRecord('', 0, '', 0, '', (), None).__dict__.keys()) | set(['message', 'asctime'])
 
-def initLogger(default_path='logging.json', 
+def initLogger(default_path='logging.json',
                default_level=logging.INFO,
-               env_key='LOG_CFG'
+               env_key='LOG_CFG',
+               queue=True
            ):
     """
-    Setup logging configuration
+    Setup logging configuration, queue=False writes
+    directly even if log_queue is set
     """
     global logger
 
@@ -37,8 +64,284 @@ def initLogger(default_path='logging.json',
     else:
         logging.basicConfig(level=default_level, disable_existing_loggers=False)
 
+    configure_handlers(queue)
+
     logger = logging.getLogger(__name__)
 
     logger.info("Logging initialized")
 
     return logger
+
+#
+# Apply the microbedb.config logging options to the
+# root logger's handlers
+#
+def configure_handlers(queue=True):
+    global sampler
+
+    if not microbedb.config_singleton.configLoaded():
+        return
+
+    cfg = microbedb.config_singleton.getConfig()
+    root = logging.getLogger()
+
+    if cfg.get('log_json', False):
+        for handler in root.handlers:
+            handler.setFormatter(JsonFormatter())
+
+    sample_after = cfg.get('log_sample_after', None)
+    sampler = SamplingFilter(int(sample_after), int(cfg.get('log_sample_every', 100))) if sample_after else None
+
+    if queue and cfg.get('log_queue', False):
+        startQueue(sampler)
+    elif sampler:
+        startSampling(sampler)
+
+    # Registered last so it runs first, while
+    # the queue is still being written out
+    atexit.register(shutdownLogging)
+
+'''
+Send everything logged through a queue to a background thread
+writing to the root logger's current handlers
+'''
+def startQueue(sampler=None):
+    global listener
+
+    if listener:
+        return listener
+
+    root = logging.getLogger()
+    handlers = list(root.handlers)
+
+    queue = Queue.Queue(-1)
+    queue_handler = QueueHandler(queue)
+    if sampler:
+        queue_handler.addFilter(sampler)
+
+    for handler in handlers:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+
+    listener = QueueListener(queue, *handlers)
+    listener.start()
+
+    atexit.register(stopQueue)
+
+    return listener
+
+'''
+Sample records once, in a single handler in front of the root
+logger's current handlers, rather than in each of them
+'''
+def startSampling(sampler):
+
+    root = logging.getLogger()
+    handlers = list(root.handlers)
+
+    dispatcher = DispatchHandler(*handlers)
+    dispatcher.addFilter(sampler)
+
+    for handler in handlers:
+        root.removeHandler(handler)
+    root.addHandler(dispatcher)
+
+    return dispatcher
+
+'''
+Report the suppressed messages and write out anything
+still queued, called at exit
+'''
+def shutdownLogging():
+
+    if sampler:
+        sampler.report()
+
+    stopQueue()
+
+def stopQueue():
+    global listener
+
+    if not listener:
+        return
+
+    listener.stop()
+    listener = None
+
+#
+# A backport of Python 3's logging.handlers.QueueHandler
+#
+class QueueHandler(logging.Handler):
+
+    def __init__(self, queue):
+        logging.Handler.__init__(self)
+        self.queue = queue
+
+    '''
+    Merge the message and its arguments now, as they may change
+    before the record is written, and the traceback, which can't
+    outlive the exception
+    '''
+    def prepare(self, record):
+
+        record.msg = record.getMessage()
+        record.args = None
+
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+
+        return record
+
+    def emit(self, record):
+        try:
+            self.queue.put_nowait(self.prepare(record))
+        except Exception:
+            self.handleError(record)
+
+#
+# Hands each record that gets through its filters
+# to the handlers behind it, at their own levels
+#
+class DispatchHandler(logging.Handler):
+
+    def __init__(self, *handlers):
+        logging.Handler.__init__(self)
+        self.handlers = handlers
+
+    def emit(self, record):
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+    def flush(self):
+        for handler in self.handlers:
+            handler.flush()
+
+#
+# A backport of Python 3's logging.handlers.QueueListener, hands
+# the queued records to the handlers from its own thread
+#
+class QueueListener():
+
+    sentinel = None
+
+    def __init__(self, queue, *handlers):
+        self.queue = queue
+        self.handlers = handlers
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.monitor, name="logging")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def handle(self, record):
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+    def monitor(self):
+
+        while True:
+            record = self.queue.get()
+
+            if record is self.sentinel:
+                break
+
+            self.handle(record)
+
+    def stop(self):
+
+        self.queue.put_nowait(self.sentinel)
+        self.thread.join()
+        self.thread = None
+
+        for handler in self.handlers:
+            handler.flush()
+
+'''
+Format records as one line JSON objects, with any extra
+fields passed to the logging call, e.g.
+
+    logger.info("Cloned %s", accession, extra={'assembly_accession': accession})
+'''
+class JsonFormatter(logging.Formatter):
+
+    def format(self, record):
+
+        event = {'time': time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)) + ".{:03d}".format(int(record.msecs)),
+                 'level': record.levelname,
+                 'logger': record.name,
+                 'thread': record.threadName,
+                 'message': record.getMessage()}
+
+        for key, value in record.__dict__.items():
+            if key not in record_attributes:
+                event[key] = value
+
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            event['exception'] = record.exc_text
+
+        return json.dumps(event, default=str)
+
+'''
+Let the first after records with the same (unformatted) message
+through, then one in every, counting how many were suppressed.
+Warnings and errors always get through.
+'''
+class SamplingFilter(logging.Filter):
+
+    # Messages formatted before logging are all different,
+    # don't keep count of them forever
+    max_messages = 10000
+
+    def __init__(self, after=10, every=100):
+        logging.Filter.__init__(self)
+
+        self.after = after
+        self.every = max(1, every)
+        self.lock = threading.Lock()
+        self.counts = dict()
+        self.suppressed = dict()
+
+    def filter(self, record):
+
+        if record.levelno >= logging.WARNING:
+            return True
+
+        key = (record.name, record.msg)
+
+        with self.lock:
+            if key not in self.counts:
+                if len(self.counts) >= self.max_messages:
+                    return True
+                self.counts[key] = 0
+
+            self.counts[key] += 1
+            count = self.counts[key]
+
+            if count <= self.after or (count - self.after) % self.every == 0:
+                suppressed = self.suppressed.pop(key, 0)
+                if suppressed and isinstance(record.msg, basestring):
+                    record.msg = "{} ({} similar messages suppressed)".format(record.msg, suppressed)
+                    record.suppressed = suppressed
+                return True
+
+            self.suppressed[key] = self.suppressed.get(key, 0) + 1
+            return False
+
+    '''
+    Log how many of each message were suppressed since
+    they last got through
+    '''
+    def report(self):
+
+        with self.lock:
+            suppressed = self.suppressed.items()
+            self.suppressed = dict()
+
+        for (name, msg), count in suppressed:
+            logging.getLogger(name).warning("%s similar messages suppressed: %s", count, msg)
@@ -0,0 +1,281 @@
+'''
+Library to record where the time goes in a MicrobeDB sync
+
+Each stage of a sync (fetching the summary and checksum files,
+verifying checksums, downloading, unzipping, parsing, splitting
+replicons, committing, cloning, symlinking and indexing proteins)
+is timed as it runs, along with the bytes it handles.  At the end
+of a run the counts, bytes, wall time and percentiles of each stage
+can be written as a JSON report, and during the run as a Prometheus
+textfile for node_exporter's textfile collector.
+
+The timings for each stage are kept as a fixed size random
+sample (reservoir sampling) so memory doesn't grow with the
+number of genomes.  Safe to use from several threads.
+'''
+
+import os
+import json
+import time
+import random
+import logging
+import threading
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+stages = ['summary_fetch', 'checksum_fetch', 'verify', 'download', 'gunzip',
+          'parse', 'replicon_split', 'db_commit', 'clone', 'symlink', 'protein_index']
+
+percentiles = [50, 90, 95, 99]
+
+class stage_stats():
+
+    def __init__(self, sample_size=10000):
+
+        self.sample_size = sample_size
+        self.count = 0
+        self.errors = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.max = 0.0
+        self.samples = []
+
+    def add(self, seconds, nbytes=0, error=False):
+
+        self.count += 1
+        self.bytes += nbytes
+        self.seconds += seconds
+        self.max = max(self.max, seconds)
+
+        if error:
+            self.errors += 1
+
+        if len(self.samples) < self.sample_size:
+            self.samples.append(seconds)
+        else:
+            i = random.randint(0, self.count - 1)
+            if i < self.sample_size:
+                self.samples[i] = seconds
+
+    def summary(self):
+
+        ordered = sorted(self.samples)
+
+        summary = {'count': self.count,
+                   'errors': self.errors,
+                   'bytes': self.bytes,
+                   'seconds': round(self.seconds, 6),
+                   'max': round(self.max, 6),
+                   'mean': round(self.seconds / self.count, 6) if self.count else 0.0}
+
+        for pct in percentiles:
+            summary['p{}'.format(pct)] = round(percentile(ordered, pct), 6)
+
+        if self.seconds:
+            summary['bytes_per_second'] = int(self.bytes / self.seconds)
+
+        return summary
+
+#
+# The pct percentile of an already sorted list
+#
+def percentile(ordered, pct):
+
+    if not ordered:
+        return 0.0
+
+    return ordered[int(round(pct / 100.0 * (len(ordered) - 1)))]
+
+class metrics_registry():
+
+    def __init__(self):
+
+        self.lock = threading.Lock()
+        self.stats = dict()
+        self.started = time.time()
+        self.writer = None
+        self.stopping = threading.Event()
+        self.journal = None
+
+    def record(self, stage, seconds, nbytes=0, error=False):
+
+        with self.lock:
+            if stage not in self.stats:
+                self.stats[stage] = stage_stats()
+
+            self.stats[stage].add(seconds, nbytes, error)
+
+            if self.journal is not None:
+                self.journal.append((stage, seconds, nbytes, error))
+
+    '''
+    Also keep every record in a list, for a worker process
+    to hand back to its parent (see drain)
+    '''
+    def start_journal(self):
+
+        with self.lock:
+            self.journal = []
+
+    '''
+    The records since the last drain, to
+    be given to the parent's record()
+    '''
+    def drain(self):
+
+        with self.lock:
+            records = self.journal or []
+            if self.journal is not None:
+                self.journal = []
+
+        return records
+
+    def reset(self):
+
+        with self.lock:
+            self.stats.clear()
+            self.started = time.time()
+
+    '''
+    The summary of every stage seen so far, known stages are
+    listed first in pipeline order
+    '''
+    def report(self):
+
+        with self.lock:
+            ordered = [s for s in stages if s in self.stats] + sorted([s for s in self.stats if s not in stages])
+
+            return {'started': datetime.fromtimestamp(self.started).strftime("%Y-%m-%d %H:%M:%S"),
+                    'wall_seconds': round(time.time() - self.started, 3),
+                    'stages': [dict(stage=s, **self.stats[s].summary()) for s in ordered]}
+
+    '''
+    Write the report as JSON
+    '''
+    def write_report(self, filename):
+
+        report = self.report()
+
+        with open(filename, 'w') as outfile:
+            json.dump(report, outfile, indent=1)
+
+        logger.info("Wrote sync metrics to {}".format(filename))
+
+        return report
+
+    '''
+    Write the metrics in Prometheus' text format, to a temporary
+    file first so the collector never sees a partial file
+    '''
+    def write_prometheus(self, filename):
+
+        report = self.report()
+
+        lines = ['# HELP microbedb_sync_stage_seconds Time spent in each stage of a MicrobeDB sync',
+                 '# TYPE microbedb_sync_stage_seconds summary']
+        for s in report['stages']:
+            for pct in percentiles:
+                lines.append('microbedb_sync_stage_seconds{{stage="{}",quantile="{}"}} {}'.format(s['stage'], pct / 100.0, s['p{}'.format(pct)]))
+            lines.append('microbedb_sync_stage_seconds_sum{{stage="{}"}} {}'.format(s['stage'], s['seconds']))
+            lines.append('microbedb_sync_stage_seconds_count{{stage="{}"}} {}'.format(s['stage'], s['count']))
+
+        lines += ['# HELP microbedb_sync_stage_bytes_total Bytes handled by each stage of a MicrobeDB sync',
+                  '# TYPE microbedb_sync_stage_bytes_total counter']
+        for s in report['stages']:
+            lines.append('microbedb_sync_stage_bytes_total{{stage="{}"}} {}'.format(s['stage'], s['bytes']))
+
+        lines += ['# HELP microbedb_sync_stage_errors_total Failures in each stage of a MicrobeDB sync',
+                  '# TYPE microbedb_sync_stage_errors_total counter']
+        for s in report['stages']:
+            lines.append('microbedb_sync_stage_errors_total{{stage="{}"}} {}'.format(s['stage'], s['errors']))
+
+        lines += ['# HELP microbedb_sync_wall_seconds Time since the MicrobeDB sync started',
+                  '# TYPE microbedb_sync_wall_seconds gauge',
+                  'microbedb_sync_wall_seconds {}'.format(report['wall_seconds'])]
+
+        tmp_filename = "{}.{}.tmp".format(filename, os.getpid())
+        with open(tmp_filename, 'w') as outfile:
+            outfile.write("\n".join(lines) + "\n")
+
+        os.rename(tmp_filename, filename)
+
+    '''
+    Rewrite the Prometheus textfile every interval seconds
+    in the background until stop_textfile is called
+    '''
+    def start_textfile(self, filename, interval=30):
+
+        def writer():
+            while not self.stopping.wait(interval):
+                try:
+                    self.write_prometheus(filename)
+                except Exception as e:
+                    logger.exception("Error writing metrics textfile {}".format(filename))
+
+        self.textfile = filename
+        self.stopping.clear()
+        self.writer = threading.Thread(target=writer, name="metrics")
+        self.writer.daemon = True
+        self.writer.start()
+
+    def stop_textfile(self):
+
+        if not self.writer:
+            return
+
+        self.stopping.set()
+        self.writer.join()
+        self.writer = None
+
+        self.write_prometheus(self.textfile)
+
+#
+# Times a block of code as a stage, the bytes
+# handled can be set on it before it ends, e.g.
+#
+#   with timed('download') as t:
+#       ...
+#       t.bytes = size
+#
+class timed():
+
+    def __init__(self, stage):
+        self.stage = stage
+        self.bytes = 0
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        registry.record(self.stage, time.time() - self.start, self.bytes, error=exc_type is not None)
+
+        return False
+
+#
+# Time each item taken from an iterator as a stage, for
+# when the work happens as the items are read (e.g. parsing
+# records out of a file)
+#
+def timed_iter(stage, iterable):
+    items = iter(iterable)
+
+    while True:
+        start = time.time()
+        try:
+            item = next(items)
+        except StopIteration:
+            return
+
+        registry.record(stage, time.time() - start)
+
+        yield item
+
+registry = metrics_registry()
+
+'''
+Fetch the metrics registry shared by the whole process
+'''
+def getMetrics():
+    return registry
@@ -1,40 +1,323 @@
+'''
+MicrobeDB models
+(microbedb.models)
+
+The engine and session factory are shared by all the models.
+Sessions are handed out through a scoped_session, so every
+thread gets its own session (and connection from the pool)
+while still calling fetch_session() as before.
+
+The database is chosen by the db_url config option (see
+microbedb.db_singleton), MySQL and SQLite are both supported.
+Pool behaviour for server databases can be tuned in the config file:
+
+    db_pool_size     - connections kept open in the pool (default 5)
+    db_max_overflow  - extra connections allowed beyond the pool (default 10)
+    db_pool_recycle  - seconds before a connection is recycled (default 3600)
+    db_pool_pre_ping - test connections on checkout (default True)
+
+For process pools call reset_engine() in each child (for example
+as the Pool initializer) so connections are never shared across
+a fork.
+
+To query a read-only SQLite snapshot of a version (see
+microbedb.snapshot) call open_snapshot() before using the models.
+'''
+
+import os
+import logging
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine, event, exc, select
+from sqlalchemy.orm import sessionmaker, scoped_session
 import microbedb.config_singleton
+import microbedb.db_singleton
+
+logger = logging.getLogger(__name__)
 
 Base = declarative_base()
-session = None
+engine = None
+stream_engine = None
+Session = None
+snapshot_url = None
 
-def fetch_session():
-    global session
+# The process the engine was made in, and the engines a
+# forked child inherited and must leave alone
+engine_pid = None
+inherited_engines = []
+
+def init_engine():
+    global engine
+    global engine_pid
+    global Session
     global Base
 
     # We're going to follow the singleton pattern
-    if session:
-        return session
+    if engine:
+        return engine
+
+    engine_pid = os.getpid()
+
+    if snapshot_url:
+        # A snapshot is a self contained SQLite file, no
+        # config is needed to read from it
+        engine = create_engine(snapshot_url,
+                               connect_args={'check_same_thread': False})
+
+        add_readonly_pragmas(engine)
+
+    elif microbedb.db_singleton.fetch_backend() == 'sqlite':
+        # SQLite has no server to pool connections to,
+        # SQLAlchemy picks a suitable pool itself
+        engine = create_engine(microbedb.db_singleton.fetch_db_url(),
+                               connect_args={'check_same_thread': False})
+
+        add_sqlite_pragmas(engine)
+    else:
+        cfg = microbedb.config_singleton.getConfig()
+
+        engine = create_engine(microbedb.db_singleton.fetch_db_url(),
+                               pool_size=int(cfg.get('db_pool_size', 5)),
+                               max_overflow=int(cfg.get('db_max_overflow', 10)),
+                               pool_recycle=int(cfg.get('db_pool_recycle', 3600)))
 
-    cfg = microbedb.config_singleton.getConfig()
+        if cfg.get('db_pool_pre_ping', True):
+            add_pre_ping(engine)
 
-    engine = create_engine('mysql://{}:{}@{}/{}?charset=utf8&use_unicode=0'.format(cfg.db_user, cfg.db_password, cfg.db_host, cfg.database), pool_recycle=3600)
+    add_fork_guard(engine)
 
     Base.metadata.bind = engine
 
-    DBSession = sessionmaker(bind=engine)
+    Session = scoped_session(sessionmaker(bind=engine))
+
+    # A local SQLite file has no separate schema loading step,
+    # make any missing tables
+    if engine.dialect.name == 'sqlite' and not snapshot_url:
+        create_schema()
+
+    return engine
+
+'''
+Point the models at a read-only SQLite snapshot of a version
+(see microbedb.snapshot) instead of the configured database,
+any existing sessions are discarded
+'''
+def open_snapshot(path):
+    global snapshot_url
+
+    if not os.path.exists(path):
+        raise Exception("Snapshot {} doesn't exist".format(path))
+
+    reset_engine()
+
+    snapshot_url = 'sqlite:///' + os.path.abspath(path)
+    logger.info("Using read-only snapshot {}".format(path))
+
+    return init_engine()
+
+'''
+Create any tables that don't exist yet in the configured database,
+for MySQL the schema in docs/schema.sql is normally loaded instead
+'''
+def create_schema():
+    init_engine()
+
+    Base.metadata.create_all(engine)
+
+'''
+The engine used for streaming large reads, for MySQL this uses
+server side cursors so rows are fetched from the server as
+they're consumed rather than all at once
+'''
+def init_stream_engine():
+    global stream_engine
+
+    if stream_engine:
+        return stream_engine
+
+    init_engine()
+
+    if engine.dialect.name == 'mysql' and engine.dialect.driver == 'mysqldb':
+        import MySQLdb.cursors
+        cfg = microbedb.config_singleton.getConfig()
+
+        stream_engine = create_engine(engine.url,
+                                      pool_recycle=int(cfg.get('db_pool_recycle', 3600)),
+                                      connect_args={'cursorclass': MySQLdb.cursors.SSCursor})
+        add_fork_guard(stream_engine)
+    else:
+        # SQLite cursors already step through the rows lazily
+        stream_engine = engine
+
+    return stream_engine
 
-    session = DBSession()
+'''
+Run a Core select and yield the rows back in lists of at most
+batch_size rows, memory use is bounded by the batch size no matter
+how many rows the query returns
+'''
+def stream_rows(query, batch_size=5000):
+    conn = init_stream_engine().connect()
 
-    return session
+    try:
+        result = conn.execution_options(stream_results=True).execute(query)
 
-from genomeproject import GenomeProject, GenomeProject_Meta, GenomeProject_Checksum
+        while True:
+            rows = result.fetchmany(batch_size)
+            if not rows:
+                break
+
+            yield rows
+
+        result.close()
+
+    finally:
+        conn.close()
+
+'''
+Fetch the session for the calling thread, each thread (or
+worker) gets its own session from the scoped_session registry
+'''
+def fetch_session():
+    init_engine()
+
+    return Session()
+
+'''
+Make a new session not tied to the calling thread, the caller
+is responsible for closing it when done
+'''
+def new_session():
+    init_engine()
+
+    return Session.session_factory()
+
+'''
+Release the calling thread's session and return its connection
+to the pool, workers should call this when they're finished
+'''
+def remove_session():
+    if Session:
+        Session.remove()
+
+'''
+Throw away all pooled connections and sessions, the next use
+makes a new engine.  To be called in a child process after a
+fork so the parent's connections are never reused.
+
+In a forked child the inherited connections are abandoned
+rather than closed, their sockets still belong to the parent.
+'''
+def reset_engine():
+    global engine
+    global stream_engine
+    global Session
+
+    if engine_pid == os.getpid():
+        if Session:
+            Session.remove()
+
+        if stream_engine and stream_engine is not engine:
+            stream_engine.dispose()
+
+        if engine:
+            engine.dispose()
+
+    elif engine:
+        # Kept referenced so they're never garbage
+        # collected (and closed) in this process
+        inherited_engines.append((engine, stream_engine, Session))
+
+    engine = None
+    stream_engine = None
+    Session = None
+
+#
+# Test connections as they're checked out of the pool and
+# transparently replace any that have gone away
+#
+def add_pre_ping(engine):
+
+    @event.listens_for(engine, "engine_connect")
+    def ping_connection(connection, branch):
+        if branch:
+            return
+
+        save_should_close_with_result = connection.should_close_with_result
+        connection.should_close_with_result = False
+
+        try:
+            connection.scalar(select([1]))
+        except exc.DBAPIError as err:
+            # The connection is stale, invalidate it and
+            # try once more, the pool will give us a fresh one
+            if err.connection_invalidated:
+                logger.debug("Pooled connection was stale, reconnecting")
+                connection.scalar(select([1]))
+            else:
+                raise
+        finally:
+            connection.should_close_with_result = save_should_close_with_result
+
+#
+# SQLite needs a little help to behave with several
+# readers and writers against the same file
+#
+def add_sqlite_pragmas(engine):
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA busy_timeout=30000")
+        cursor.close()
+
+#
+# Snapshots are only ever read, refuse any writes so a
+# compute node can't modify its copy by accident
+#
+def add_readonly_pragmas(engine):
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA query_only=ON")
+        cursor.close()
+
+#
+# Never hand a connection made in one process to another,
+# if a child inherits pooled connections from its parent
+# they're discarded rather than shared
+#
+def add_fork_guard(engine):
+
+    @event.listens_for(engine, "connect")
+    def connect(dbapi_connection, connection_record):
+        connection_record.info['pid'] = os.getpid()
+
+    @event.listens_for(engine, "checkout")
+    def checkout(dbapi_connection, connection_record, connection_proxy):
+        pid = os.getpid()
+        if connection_record.info['pid'] != pid:
+            connection_record.connection = connection_proxy.connection = None
+            raise exc.DisconnectionError(
+                "Connection record belongs to pid {}, attempting to check out in pid {}".format(connection_record.info['pid'], pid))
+
+from genomeproject import GenomeProject, GenomeProject_Meta, GenomeProject_Checksum, GenomeProject_Ingest
 from replicon import Replicon
 from version import Version
 from taxonomy import Taxonomy
+from syncwork import SyncWork
 
-__all__ = ['GenomeProject', 'GenomeProject_Meta', 'GenomeProject_Checksum',
+__all__ = ['GenomeProject', 'GenomeProject_Meta', 'GenomeProject_Checksum', 'GenomeProject_Ingest',
            'Replicon',
            'Version',
            'Taxonomy',
-           'fetch_session'
+           'SyncWork',
+           'fetch_session',
+           'new_session',
+           'remove_session',
+           'reset_engine',
+           'create_schema',
+           'open_snapshot',
+           'stream_rows'
     ]
-
@@ -16,23 +16,50 @@ to the first downloaded version in the series.
 
 Checksums are the NCBI checksums for download files associated
 with a particular version of a genome.
+
+The ingest state tracks how far along a genome is in being
+loaded in to a new version, so interrupted updates can resume.
 '''
 
 import os
 import logging
 import shutil
+from datetime import date
 from . import Base, fetch_session
 from .version import Version
 from .replicon import Replicon
-from sqlalchemy import Column, ForeignKey, Integer, String, Text, Date, Enum, Float, Boolean
+from sqlalchemy import Column, ForeignKey, Integer, String, Text, Date, DateTime, Enum, Float, Boolean
+from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from sqlalchemy.orm.session import make_transient
 from sqlalchemy import exc as sqlalcexcept
 import microbedb.config_singleton
+from microbedb.metrics import timed
 import pprint
 
 logger = logging.getLogger(__name__)
 
+# The stages a GenomeProject goes through when being ingested,
+# see GenomeProject_Ingest
+ingest_states = ('planned', 'downloading', 'downloaded', 'parsed', 'loaded', 'linked')
+
+#
+# NCBI's summary files give dates as YYYY/MM/DD, MySQL takes those
+# as they are but SQLite needs a date.  Split by hand rather than
+# with strptime, whose first use isn't thread safe in Python 2
+#
+def parse_release_date(value):
+
+    if not value:
+        return None
+
+    try:
+        return date(*[int(part) for part in value.split('/')])
+
+    except (ValueError, TypeError):
+        logger.warning("Can't understand release date {}, leaving it empty".format(value))
+        return None
+
 '''
 An individual version of a genome project
 '''
@@ -73,7 +100,7 @@ class GenomeProject(Base):
     @classmethod
     def find(cls, version='current', **kwargs):
         global logger
-        logger.info("Searching for GenomeProject, version: {}, args: ".format(version) + str(kwargs))
+        logger.info("Searching for GenomeProject, version: %s, args: %s", version, kwargs)
 
         session = fetch_session()
         version = Version.fetch(version)
@@ -105,7 +132,7 @@ class GenomeProject(Base):
     def find_or_create(cls, version='current', create_version='current', **kwargs):
         global logger
 
-        logger.info("Searching for GenomeProject or creating, version: {}, create_version: {}, args: ".format(version, create_version) + str(kwargs))
+        logger.info("Searching for GenomeProject or creating, version: %s, create_version: %s, args: %s", version, create_version, kwargs)
 
         gp = GenomeProject.find(version=version, **kwargs)
 
@@ -126,7 +153,7 @@ class GenomeProject(Base):
     @classmethod
     def create_gp(cls, version='current', **kwargs):
         global logger
-        logger.info("Creating GenomeProject, version: {}, args: ".format(version) + str(kwargs))
+        logger.info("Creating GenomeProject, version: %s, args: %s", version, kwargs)
 
         session = fetch_session()
 
@@ -137,11 +164,18 @@ class GenomeProject(Base):
                 if prop in kwargs:
                     setattr(gp, prop, kwargs[prop])
 
+            if isinstance(gp.release_date, basestring):
+                gp.release_date = parse_release_date(gp.release_date)
+
             gp.version_id = Version.fetch(version)
             gp.gpv_directory = os.path.join(Version.fetch_path(gp.version_id), kwargs['genome_name'], kwargs['assembly_accession'] + '_' + kwargs['asm_name'])
             
-            logger.debug("Committing GenomeProject: " + str(gp))
+            logger.debug("Committing GenomeProject: %s", gp)
             session.add(gp)
+            session.flush()
+
+            # Start tracking the progress of the new GP through ingestion
+            session.add(GenomeProject_Ingest(gpv_id=gp.gpv_id, version_id=gp.version_id, state='planned'))
             session.commit()
 
         except sqlalcexcept.IntegrityError as e:
@@ -150,6 +184,7 @@ class GenomeProject(Base):
             return None
         except Exception as e:
             logger.exception("Unknown error creating GenomeProject: " + str(e))
+            session.rollback()
             return None
 
         return gp
@@ -181,7 +216,7 @@ class GenomeProject(Base):
 
     def clone_gp(self, version='latest'):
         global logger
-        logger.info("Cloning GenomeProject {}, version: {}".format(self.gpv_id, version))
+        logger.info("Cloning GenomeProject %s, version: %s", self.gpv_id, version)
 
         session = fetch_session()
 
@@ -219,30 +254,40 @@ class GenomeProject(Base):
                 # Now remember the path for the root GP so we can symlink to it
                 old_path = root_gp.gpv_directory
 
+            # A clone interrupted before it was committed can leave its
+            # symlink behind
+            if os.path.islink(self.gpv_directory):
+                logger.debug("Removing stale symlink {}".format(self.gpv_directory))
+                os.unlink(self.gpv_directory)
+
             if os.path.exists(old_path) and self.verify_basedir():
                 logger.debug("Making symlink from {} to {}".format(old_path, self.gpv_directory))
-                os.symlink(old_path, self.gpv_directory)
+                with timed('symlink'):
+                    os.symlink(old_path, self.gpv_directory)
             else:
                 logger.error("We couldn't find the old path {} to make the symlink from, this is a problem".format(old_path))
 
             logger.debug("Committing self")
             session.add(self)
+            session.flush()
+
+            session.add(GenomeProject_Ingest(gpv_id=self.gpv_id, version_id=self.version_id, state='planned', cloned=True))
             session.commit()
 
             # If we have a metadata object and we've successfully
             # updated ourself, clone the gp_meta object
             if gp_meta:
-                logger.debug("We have metadata, clone: {}".format(gp_meta))
+                logger.debug("We have metadata, clone: %s", gp_meta)
                 gp_meta.clone_gpmeta(self.gpv_id) 
 
            # Clone the replicons as we clone the GP record
             update_params = {'version_id': version, 'gpv_id': self.gpv_id}
             for rep in session.query(Replicon).filter(Replicon.gpv_id == old_gpv_id):
-                logger.debug("Copying replicon {}".format(rep.rpv_id))
+                logger.debug("Copying replicon %s", rep.rpv_id)
                 rep.copy_and_update(**update_params)
 
             for gpcs in session.query(GenomeProject_Checksum).filter(GenomeProject_Checksum.gpv_id == old_gpv_id):
-                logger.debug("Copying GP_Checksum for file {}".format(gpcs.filename))
+                logger.debug("Copying GP_Checksum for file %s", gpcs.filename)
                 gpcs.copy_and_update(**update_params)
 
         except Exception as e:
@@ -341,6 +386,10 @@ class GenomeProject(Base):
             for rep in session.query(Replicon).filter(Replicon.gpv_id == gpv_id):
                 Replicon.remove_replicon(rep.rpv_id)
 
+            # And their proteins from the version's protein index
+            from microbedb.protein_index import remove_genome
+            remove_genome(gpv_id, gp.version_id)
+
             # Next let's remove all the GP_Checksums
             for gpcs in session.query(GenomeProject_Checksum).filter(GenomeProject_Checksum.gpv_id == gpv_id):
                 session.delete(gpcs)
@@ -349,6 +398,10 @@ class GenomeProject(Base):
             for gpmeta in session.query(GenomeProject_Meta).filter(GenomeProject_Meta.gpv_id == gpv_id):
                 session.delete(gpmeta)
 
+            # And the ingest state
+            for gpingest in session.query(GenomeProject_Ingest).filter(GenomeProject_Ingest.gpv_id == gpv_id):
+                session.delete(gpingest)
+
             # Now we need to untangle the symlinks if there are any
             if gp.prev_gpv:
                 logger.debug("We're a leaf GP, no one should be pointing at us")
@@ -509,7 +562,7 @@ class GenomeProject_Meta(Base):
     @classmethod
     def create_or_update(cls, gpv_id, **kwargs):
         global logger
-        logger.info("Create or update GP_Meta {}, args: ".format(gpv_id) + str(kwargs))
+        logger.info("Create or update GP_Meta %s, args: %s", gpv_id, kwargs)
 
         session = fetch_session()
 
@@ -556,7 +609,7 @@ class GenomeProject_Checksum(Base):
     '''
     def copy_and_update(self, **kwargs):
         global logger
-        logger.info("Copy and update GP_Checksum file: {}, version: {}".format(self.filename, self.version_id))
+        logger.info("Copy and update GP_Checksum file: %s, version: %s", self.filename, self.version_id)
 
         session = fetch_session()
         
@@ -578,7 +631,7 @@ class GenomeProject_Checksum(Base):
                 elif getattr(self, prop):
                     setattr(gpcs, prop, getattr(self, prop))
                     
-            logger.debug("Committing GP_Checksum: " + str(gpcs))
+            logger.debug("Committing GP_Checksum: %s", gpcs)
             session.add(gpcs)
             session.commit()
 
@@ -600,7 +653,7 @@ class GenomeProject_Checksum(Base):
     @classmethod
     def verify(cls, filename, checksum, version='current'):
         global logger
-        logger.info("Verifying checksum, filename: {}, checksum: {}, version: {}".format(filename, checksum, version))
+        logger.info("Verifying checksum, filename: %s, checksum: %s, version: %s", filename, checksum, version)
         session = fetch_session()
 
         version = Version.fetch(version)
@@ -612,13 +665,82 @@ class GenomeProject_Checksum(Base):
         
             # We found a checksum for this file, return if they match
             if gpcs is not None:
-                logger.debug("Comparing db version: {} to ftp version: {}".format(gpcs.checksum, checksum))
+                logger.debug("Comparing db version: %s to ftp version: %s", gpcs.checksum, checksum)
                 return gpcs.checksum == checksum
 
             # Nothing found, return false
-            logger.debug("Didn't find a checksum for {}, version {}".format(filename, version))
+            logger.debug("Didn't find a checksum for %s, version %s", filename, version)
             return False
 
         except Exception as e:
             logger.exception("Error checking checksum: " + str(e))
             return False
+
+'''
+The progress of a GenomeProject through ingestion in to a new
+version of microbedb, so an interrupted update can pick up each
+genome from the last stage it completed.
+
+Downloaded genomes move through the states in order:
+
+    planned     - the GenomeProject row has been made
+    downloading - fetching the files from NCBI
+    downloaded  - all the files are fetched and unzipped
+    parsed      - the replicons have been split out and loaded
+    loaded      - the GenomeProject_Meta has been loaded
+    linked      - finished
+
+Cloned genomes go straight from planned to linked once the
+clone and its symlink are complete.
+'''
+
+class GenomeProject_Ingest(Base):
+    __tablename__ = 'genomeproject_ingest'
+    gpv_id = Column(Integer, primary_key=True)
+    version_id = Column(Integer)
+    state = Column(Enum(*ingest_states), default='planned')
+    cloned = Column(Boolean, default=False)
+    updated = Column(DateTime, default=func.now(), onupdate=func.now())
+
+    def __str__(self):
+        return "GenomeProject_Ingest(): gpv_id {}, version: {}, state: {}, cloned: {}".format(self.gpv_id, self.version_id, self.state, self.cloned)
+
+    '''
+    Fetch the ingest record for a GP, None if it doesn't have one
+    (for example GPs loaded before ingest tracking existed)
+    '''
+    @classmethod
+    def fetch(cls, gpv_id):
+        session = fetch_session()
+
+        return session.query(GenomeProject_Ingest).filter(GenomeProject_Ingest.gpv_id == gpv_id).first()
+
+    '''
+    Move a GP on to the given ingest state
+
+    If successful return True, if the commit fails return False
+    '''
+    @classmethod
+    def set_state(cls, gpv_id, state):
+        global logger
+        logger.debug("Ingest state for gpv_id %s is now %s", gpv_id, state)
+
+        session = fetch_session()
+
+        try:
+            gpingest = session.query(GenomeProject_Ingest).filter(GenomeProject_Ingest.gpv_id == gpv_id).first()
+
+            if not gpingest:
+                gp = session.query(GenomeProject).filter(GenomeProject.gpv_id == gpv_id).first()
+                gpingest = GenomeProject_Ingest(gpv_id=gpv_id, version_id=gp.version_id if gp else None)
+
+            gpingest.state = state
+            session.add(gpingest)
+            session.commit()
+
+            return True
+
+        except Exception as e:
+            logger.exception("Error setting ingest state {} for gpv_id {}".format(state, gpv_id))
+            session.rollback()
+            return False
@@ -8,7 +8,6 @@ associated with a GenomeProject.
 import os
 import re
 import logging
-from Bio import SeqIO
 from . import Base, fetch_session
 from .version import Version
 from sqlalchemy import Column, ForeignKey, Integer, String, Text, Date, Enum, Float, Boolean
@@ -44,12 +43,12 @@ class Replicon(Base):
     @classmethod
     def create_from_genbank(cls, gp, record, version='latest'):
         global logger
-        logger.info("Creating Replicon from genbank record, gpv_id: {}, version: {}".format(gp.gpv_id, version))
+        logger.info("Creating Replicon from genbank record, gpv_id: %s, version: %s", gp.gpv_id, version)
 
         session = fetch_session()
 
         try:
-            logger.debug("Creating Replicon, gpv_id: {}, accnum: {}, assembly_accession: {}".format(gp.gpv_id, record.id, gp.assembly_accession))
+            logger.debug("Creating Replicon, gpv_id: %s, accnum: %s, assembly_accession: %s", gp.gpv_id, record.id, gp.assembly_accession)
             accnum, rep_version = record.id.split(".")
 
             rep = Replicon(gpv_id=gp.gpv_id,
@@ -79,12 +78,12 @@ class Replicon(Base):
             rep.gene_num = gene
             rep.rna_num = rna
             rep.rep_size = len(record.seq)
-            logger.debug("Replicon features, genes: {}, CDS: {}, RNA: {}, size: {}".format(gene, CDS, rna, rep.rep_size))
+            logger.debug("Replicon features, genes: %s, CDS: %s, RNA: %s, size: %s", gene, CDS, rna, rep.rep_size)
 
             rep.rep_type = find_replicon_type(record)
-            logger.debug("We think this replicon is of type {}".format(rep.rep_type))
+            logger.debug("We think this replicon is of type %s", rep.rep_type)
 
-            logger.debug("Committing: " + str(rep))
+            logger.debug("Committing: %s", rep)
             session.add(rep)
             session.commit()
 
@@ -107,7 +106,7 @@ class Replicon(Base):
     '''
     def copy_and_update(self, **kwargs):
         global logger
-        logger.info("Copy and update replicon {}".format(self.rpv_id))
+        logger.info("Copy and update replicon %s", self.rpv_id)
 
         session = fetch_session()
 
@@ -132,7 +131,7 @@ class Replicon(Base):
                 elif getattr(self, prop):
                     setattr(rep, prop, getattr(self, prop))
                     
-            logger.debug("Committing Replicon: " + str(rep))
+            logger.debug("Committing Replicon: %s", rep)
             session.add(rep)
             session.commit()
 
@@ -179,6 +178,9 @@ class Replicon(Base):
     def write_faa(self, filename):
         global logger
 
+        # Biopython is slow to import, and only needed here
+        from Bio import SeqIO
+
         gp = self.genomeproject
         if not gp:
             logger.critical("Why can't we find our genome project for Replicon: " + str(self))
@@ -271,7 +273,7 @@ class Replicon(Base):
 #
 def find_replicon_type(record):
     global logger
-    logger.debug("Testing description for genome type: {}".format(record.description))
+    logger.debug("Testing description for genome type: %s", record.description)
 
     desc = record.description
 
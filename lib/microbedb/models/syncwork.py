@@ -0,0 +1,266 @@
+'''
+Sync work model
+(microbedb.models.syncwork)
+
+So several update processes, possibly on different nodes, can
+share building one version of MicrobeDB, the species directories
+to fetch are put in a work table.  Workers claim batches of rows
+by taking a lease on them, which they keep alive with heartbeats
+while they process the directories, then release them as done.
+
+If a worker dies its leases expire and the rows are claimed by
+another worker, each claim counts as an attempt and rows that
+have used up their attempts are marked failed.
+
+Lease times come from each node's clock, so the nodes should
+be kept in sync (e.g. ntp) and the lease length kept well above
+any clock difference.
+'''
+
+import os
+import socket
+import logging
+import uuid
+from datetime import datetime, timedelta
+from . import Base, fetch_session
+from .version import Version
+from sqlalchemy import Column, Integer, String, Text, DateTime, Enum, UniqueConstraint
+from sqlalchemy import and_, or_
+from sqlalchemy.sql import func
+import microbedb.config_singleton
+
+logger = logging.getLogger(__name__)
+
+class SyncWork(Base):
+    __tablename__ = 'sync_work'
+    __table_args__ = (UniqueConstraint('version_id', 'genome_name', name='version_genome'),)
+    work_id = Column(Integer, primary_key=True)
+    version_id = Column(Integer, nullable=False)
+    genome_name = Column(String(128), nullable=False)
+    state = Column(Enum('pending', 'leased', 'done', 'failed'), default='pending')
+    owner = Column(String(96))
+    lease_expires = Column(DateTime)
+    heartbeat = Column(DateTime)
+    attempts = Column(Integer, default=0)
+    last_error = Column(Text)
+
+    def __str__(self):
+        return "SyncWork(): {}, version: {}, genome: {}, state: {}, owner: {}, attempts: {}".format(self.work_id, self.version_id, self.genome_name, self.state, self.owner, self.attempts)
+
+    '''
+    Add the species directories to the work table for a version,
+    directories already in the table are left alone so seeding can
+    be rerun safely
+
+    Returns the number of rows added
+    '''
+    @classmethod
+    def seed(cls, genome_names, version='latest'):
+        global logger
+
+        session = fetch_session()
+        version = Version.fetch(version)
+
+        existing = set([row[0] for row in session.query(SyncWork.genome_name).filter(SyncWork.version_id == version)])
+
+        added = 0
+        try:
+            for genome_name in genome_names:
+                if genome_name in existing:
+                    continue
+
+                session.add(SyncWork(version_id=version, genome_name=genome_name, state='pending', attempts=0))
+                existing.add(genome_name)
+                added += 1
+
+            session.commit()
+
+        except Exception as e:
+            logger.exception("Error seeding work for version {}".format(version))
+            session.rollback()
+            raise e
+
+        logger.info("Seeded {} directories for version {}".format(added, version))
+
+        return added
+
+    '''
+    Claim up to batch_size rows of work for owner, either
+    pending rows or rows whose lease has expired
+
+    Each row is claimed with a conditional update, so if two
+    workers go for the same row only one of them gets it.
+
+    Returns the list of claimed SyncWork rows
+    '''
+    @classmethod
+    def claim(cls, owner, batch_size=1, version='latest', lease_seconds=600, max_attempts=3):
+        global logger
+
+        session = fetch_session()
+        version = Version.fetch(version)
+
+        cls.expire(version, max_attempts)
+
+        now = datetime.utcnow()
+        claimable = and_(SyncWork.version_id == version,
+                         SyncWork.attempts < max_attempts,
+                         or_(SyncWork.state == 'pending',
+                             and_(SyncWork.state == 'leased', SyncWork.lease_expires < now)))
+
+        claimed = []
+        try:
+            # If other workers beat us to every row we picked, those
+            # rows are no longer claimable so go back for more
+            while not claimed:
+                candidates = [row[0] for row in session.query(SyncWork.work_id).filter(claimable)
+                                                         .order_by(SyncWork.attempts, SyncWork.work_id)
+                                                         .limit(batch_size)]
+
+                if not candidates:
+                    return []
+
+                for work_id in candidates:
+                    rows = session.query(SyncWork).filter(SyncWork.work_id == work_id, claimable) \
+                                                  .update({'state': 'leased',
+                                                           'owner': owner,
+                                                           'lease_expires': now + timedelta(seconds=lease_seconds),
+                                                           'heartbeat': now,
+                                                           'attempts': SyncWork.attempts + 1},
+                                                          synchronize_session=False)
+                    session.commit()
+
+                    if rows:
+                        claimed.append(work_id)
+                    else:
+                        logger.debug("Work {} was claimed by someone else".format(work_id))
+
+        except Exception as e:
+            logger.exception("Error claiming work for {}".format(owner))
+            session.rollback()
+            raise e
+
+        logger.info("{} claimed work {}".format(owner, claimed))
+
+        return session.query(SyncWork).filter(SyncWork.work_id.in_(claimed)).order_by(SyncWork.work_id).all()
+
+    '''
+    Extend the leases on all the work owner holds, returns the
+    number of leases extended
+    '''
+    @classmethod
+    def renew(cls, owner, lease_seconds=600, session=None):
+
+        if not session:
+            session = fetch_session()
+
+        now = datetime.utcnow()
+
+        try:
+            rows = session.query(SyncWork).filter(SyncWork.owner == owner, SyncWork.state == 'leased') \
+                                          .update({'lease_expires': now + timedelta(seconds=lease_seconds),
+                                                   'heartbeat': now},
+                                                  synchronize_session=False)
+            session.commit()
+
+            return rows
+
+        except Exception as e:
+            logger.exception("Error renewing leases for {}".format(owner))
+            session.rollback()
+            raise e
+
+    '''
+    Mark a row of work as done, if the lease has been lost to
+    another worker it's left alone and False is returned
+    '''
+    @classmethod
+    def release(cls, work_id, owner):
+        return cls.finish(work_id, owner, {'state': 'done', 'owner': None, 'lease_expires': None, 'last_error': None})
+
+    '''
+    Give a row of work back after an error, it'll be picked
+    up again until it runs out of attempts
+    '''
+    @classmethod
+    def fail(cls, work_id, owner, error, max_attempts=3):
+        work = fetch_session().query(SyncWork).filter(SyncWork.work_id == work_id).first()
+        state = 'failed' if work and work.attempts >= max_attempts else 'pending'
+
+        return cls.finish(work_id, owner, {'state': state, 'owner': None, 'lease_expires': None, 'last_error': str(error)})
+
+    #
+    # Update a row of work we hold the lease on
+    #
+    @classmethod
+    def finish(cls, work_id, owner, values):
+        global logger
+
+        session = fetch_session()
+
+        try:
+            rows = session.query(SyncWork).filter(SyncWork.work_id == work_id,
+                                                  SyncWork.owner == owner,
+                                                  SyncWork.state == 'leased') \
+                                          .update(values, synchronize_session=False)
+            session.commit()
+
+        except Exception as e:
+            logger.exception("Error updating work {}".format(work_id))
+            session.rollback()
+            raise e
+
+        if not rows:
+            logger.warning("We ({}) no longer hold the lease on work {}".format(owner, work_id))
+            return False
+
+        return True
+
+    '''
+    Mark expired leases that have used up all their attempts
+    as failed
+    '''
+    @classmethod
+    def expire(cls, version='latest', max_attempts=3):
+        session = fetch_session()
+        version = Version.fetch(version)
+
+        try:
+            rows = session.query(SyncWork).filter(SyncWork.version_id == version,
+                                                  SyncWork.state == 'leased',
+                                                  SyncWork.lease_expires < datetime.utcnow(),
+                                                  SyncWork.attempts >= max_attempts) \
+                                          .update({'state': 'failed', 'owner': None, 'last_error': 'Lease expired'},
+                                                  synchronize_session=False)
+            session.commit()
+
+        except Exception as e:
+            logger.exception("Error expiring leases for version {}".format(version))
+            session.rollback()
+            raise e
+
+        if rows:
+            logger.warning("{} leases expired with no attempts left for version {}".format(rows, version))
+
+        return rows
+
+    '''
+    Count the work for a version by state
+    '''
+    @classmethod
+    def summary(cls, version='latest'):
+        session = fetch_session()
+        version = Version.fetch(version)
+
+        counts = {'pending': 0, 'leased': 0, 'done': 0, 'failed': 0}
+        for state, count in session.query(SyncWork.state, func.count(SyncWork.work_id)) \
+                                   .filter(SyncWork.version_id == version).group_by(SyncWork.state):
+            counts[state] = count
+
+        return counts
+
+'''
+A name for a worker that's unique across nodes
+'''
+def worker_name():
+    return "{}:{}:{}".format(socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
@@ -1,8 +1,9 @@
 import os
 import logging
 import shutil
-import requests, sys
-import xml.etree.ElementTree as ET
+import time
+import threading
+import sys
 from . import Base, fetch_session
 #from .genomeproject import GenomeProject
 from sqlalchemy import Column, ForeignKey, Integer, String, Text, Date, Enum, Float, Boolean
@@ -10,6 +11,8 @@ from sqlalchemy.orm import relationship
 from sqlalchemy.sql.expression import desc
 from sqlalchemy.sql import func
 import microbedb.config_singleton
+from microbedb.taxdump import fetch_taxdump
+from microbedb.cache import lru_cache
 import pprint
 
 logger = logging.getLogger(__name__)
@@ -36,6 +39,13 @@ class Taxonomy(Base):
 
         logger.info("Searching for taxid {}".format(taxid))
 
+        if not taxid:
+            return None
+
+        tax = taxonomy_cache.get(int(taxid))
+        if tax is not None:
+            return tax
+
         session = fetch_session()
 
         try:
@@ -43,108 +53,407 @@ class Taxonomy(Base):
 
             if tax is not None:
                 logger.debug("Found taxid {}".format(taxid))
-                return tax
+                return cls.cache(tax)
 
             tax = Taxonomy(taxon_id = taxid)
 
-            lineage = cls.ncbi_fetch(taxid)
-            # A little hack because of that reserved word
-            if 'class' in lineage:
-                lineage['tax_class'] = lineage['class']
+            lineage = cls.fetch_lineage(taxid)
 
-            for col in Taxonomy.__table__.columns:
-                prop = tax.__mapper__._columntoproperty[col].key
-                if prop in lineage:
-                    setattr(tax, prop, lineage[prop])
+            for prop, value in cls.lineage_columns(lineage).items():
+                setattr(tax, prop, value)
 
             logger.debug("Committing Taxonomy: " + str(tax))
             session.add(tax)
             session.commit()
 
-            return tax
+            # The commit expired it, reload it before it's detached
+            return cls.cache(tax, refresh=True)
 
         except Exception as e:
             logger.exception("Error fetching or creating taxid {}".format(taxid))
             session.rollback()
             return None
 
+    '''
+    Put a Taxonomy row in the cache, it's detached from the session
+    so it can be shared between sessions (and threads) and commits
+    elsewhere don't expire it.  Taxonomy rows are only read once made.
+
+    A row that's just been queried is already loaded, one that's been
+    committed since needs refresh so it isn't detached expired.
+    '''
+    @classmethod
+    def cache(cls, tax, refresh=False):
+
+        session = fetch_session()
+
+        if refresh:
+            session.refresh(tax)
+        session.expunge(tax)
+
+        taxonomy_cache.put(tax.taxon_id, tax)
+
+        return tax
+
+    '''
+    Load the taxonomy table (up to the size of the cache) in to the
+    cache in one query, along with the gram stain predictions, so a
+    sync doesn't go to the database for the common taxids
+    '''
+    @classmethod
+    def warm_cache(cls):
+        global logger
+
+        cfg = microbedb.config_singleton.getConfig()
+        size = int(cfg.get('taxonomy_cache_size', 10000))
+        taxonomy_cache.resize(size)
+        gram_cache.resize(size)
+
+        session = fetch_session()
+
+        try:
+            rows = session.query(Taxonomy).limit(size).all()
+
+            for tax in rows:
+                session.expunge(tax)
+                taxonomy_cache.put(tax.taxon_id, tax)
+                gram_cache.put(tax.taxon_id, cls.predict_gram(tax))
+
+            logger.info("Warmed taxonomy cache with {} taxids".format(len(rows)))
+
+        except Exception as e:
+            logger.exception("Error warming the taxonomy cache")
+            session.rollback()
+
+    '''
+    Throw away the cached taxonomy, for when the table has been changed
+    '''
+    @classmethod
+    def clear_cache(cls):
+        taxonomy_cache.clear()
+        gram_cache.clear()
+
+    '''
+    Ensure all the given taxids are in the taxonomy table, any we
+    don't have are fetched from NCBI in batches of batch_size per
+    request and inserted in bulk.
+
+    Returns the number of taxids inserted
+    '''
+    @classmethod
+    def load_batch(cls, taxids, batch_size=200):
+        global logger
+
+        taxids = set([int(t) for t in taxids if t])
+        if not taxids:
+            return 0
+
+        session = fetch_session()
+
+        try:
+            # Find which of the taxids we already have
+            known = set()
+            taxid_list = list(taxids)
+            for i in range(0, len(taxid_list), batch_size):
+                chunk = taxid_list[i:i + batch_size]
+                for row in session.query(Taxonomy.taxon_id).filter(Taxonomy.taxon_id.in_(chunk)):
+                    known.add(row.taxon_id)
+
+            missing = sorted(taxids - known)
+            logger.info("Loading taxonomy in batches, {} taxids, {} unknown".format(len(taxids), len(missing)))
+
+            if not missing:
+                return 0
+
+            # Anything the local taxdump (if we have one) doesn't
+            # know about we go to NCBI for
+            lineages = dict()
+            dump = fetch_taxdump()
+            if dump:
+                for taxid in missing:
+                    lineage = dump.lineage(taxid, valid_ranks)
+                    if lineage:
+                        lineages[taxid] = lineage
+
+            remote = [taxid for taxid in missing if taxid not in lineages]
+            if remote:
+                lineages.update(cls.ncbi_fetch_batch(remote, batch_size=batch_size))
+
+            rows = []
+            for taxid in missing:
+                if taxid not in lineages:
+                    logger.error("NCBI didn't return taxonomy for taxid {}".format(taxid))
+                    continue
+
+                row = cls.lineage_columns(lineages[taxid])
+                row['taxon_id'] = taxid
+                rows.append(row)
+
+            if rows:
+                session.bulk_insert_mappings(Taxonomy, rows)
+                session.commit()
+
+            return len(rows)
+
+        except Exception as e:
+            logger.exception("Error bulk loading taxonomy")
+            session.rollback()
+            return 0
+
+    '''
+    Fill the taxonomy table from the local taxdump (see
+    microbedb.taxdump), no requests are made to NCBI.
+
+    Any of the given taxids not in the table are inserted, and if
+    relineage is set every existing row is rebuilt from the dump.
+    Rows are written in bulk, batch_size at a time.
+
+    Returns a tuple of (inserted, updated) counts
+    '''
+    @classmethod
+    def load_taxdump(cls, taxids=[], relineage=False, batch_size=5000):
+        global logger
+
+        dump = fetch_taxdump()
+        if not dump:
+            raise Exception("No taxdump available, set taxdump_dir in the config file")
+
+        session = fetch_session()
+
+        # Every lineage column is set so ranks that have
+        # gone away in the dump are cleared
+        blank = dict((col.key, None) for col in Taxonomy.__table__.columns if col.key != 'taxon_id')
+
+        try:
+            known = set(row.taxon_id for row in session.query(Taxonomy.taxon_id))
+
+            inserts = []
+            updates = []
+            for taxid in sorted(set([int(t) for t in taxids if t]) - known):
+                lineage = dump.lineage(taxid, valid_ranks)
+                if not lineage:
+                    logger.error("Taxid {} isn't in the taxdump".format(taxid))
+                    continue
+
+                row = dict(blank)
+                row.update(cls.lineage_columns(lineage))
+                row['taxon_id'] = taxid
+                inserts.append(row)
+
+            if relineage:
+                for taxid in sorted(known):
+                    lineage = dump.lineage(taxid, valid_ranks)
+                    if not lineage:
+                        logger.debug("Taxid {} isn't in the taxdump, leaving it alone".format(taxid))
+                        continue
+
+                    row = dict(blank)
+                    row.update(cls.lineage_columns(lineage))
+                    row['taxon_id'] = taxid
+                    updates.append(row)
+
+            logger.info("Loading taxdump, inserting {}, updating {}".format(len(inserts), len(updates)))
+
+            for i in range(0, len(inserts), batch_size):
+                session.bulk_insert_mappings(Taxonomy, inserts[i:i + batch_size])
+
+            for i in range(0, len(updates), batch_size):
+                session.bulk_update_mappings(Taxonomy, updates[i:i + batch_size])
+
+            session.commit()
+
+            if updates:
+                cls.clear_cache()
+
+            return len(inserts), len(updates)
+
+        except Exception as e:
+            logger.exception("Error loading taxonomy from taxdump")
+            session.rollback()
+            raise e
+
+    '''
+    Find the lineage for a taxid, from the local taxdump if
+    we have one, otherwise from NCBI
+    '''
+    @classmethod
+    def fetch_lineage(cls, taxid):
+
+        dump = fetch_taxdump()
+        if dump:
+            lineage = dump.lineage(taxid, valid_ranks)
+            if lineage:
+                return lineage
+
+        return cls.ncbi_fetch(taxid)
+
+    '''
+    Map a lineage dict from NCBI to the columns of the taxonomy table
+    '''
+    @classmethod
+    def lineage_columns(cls, lineage):
+        columns = dict()
+
+        if not lineage:
+            return columns
+
+        # A little hack because of that reserved word
+        if 'class' in lineage:
+            lineage['tax_class'] = lineage['class']
+
+        for col in Taxonomy.__table__.columns:
+            prop = Taxonomy.__mapper__._columntoproperty[col].key
+            if prop in lineage:
+                columns[prop] = lineage[prop]
+
+        return columns
+
     @classmethod
     def guess_gram(cls, taxid):
         global logger
 
+        if not taxid:
+            return None
+
+        if int(taxid) in gram_cache:
+            return gram_cache.get(int(taxid))
+
         tax = cls.find_or_create(taxid)
 
         if not tax:
             logger.error("Couldn't find taxid {}".format(taxid))
             return None
 
+        gram = cls.predict_gram(tax)
+        gram_cache.put(int(taxid), gram)
+
+        return gram
+
+    '''
+    Find the gram stain for a Taxonomy row based on the first
+    rank in its lineage we have a prediction for
+    '''
+    @classmethod
+    def predict_gram(cls, tax):
+
         for rank in valid_ranks:
-            lin = getattr(tax, rank)
+            # Remember class is stored as tax_class
+            lin = getattr(tax, 'tax_class' if rank == 'class' else rank)
             if lin and lin in gram_predictions:
                 return gram_predictions[lin]
 
         return None
-                    
 
     @classmethod
     def ncbi_fetch(cls, taxid, email="lairdm@sfu.ca", tool="microbedb"):
         global logger
 
         try:
-            server = "https://eutils.ncbi.nlm.nih.gov/"
-            ext = "/entrez/eutils/efetch.fcgi?db=taxonomy&id={taxid}&report=xml&mode=text&email={email}&tool={tool}"
+            lineages = cls.ncbi_fetch_batch([taxid], email=email, tool=tool)
 
-            req_str = server + ext.format(taxid=taxid, email=email, tool=tool)
+            if int(taxid) not in lineages:
+                logger.critical("No lineage tree for taxon {}".format(taxid))
+                return None
 
-            r = requests.get(req_str)
+            return lineages[int(taxid)]
 
-            if not r.ok:
-                r.raise_for_status()
-                logger.error("Error fetching taxon information")
-                return None
+        except Exception as e:
+            logger.exception("Error fetching taxonomy from ncbi")
+            return None
 
-            # Parse and we know we won't to go one level down
-            # to the Taxon tag
-            root = ET.fromstring(r.text)
-            root = root.find("Taxon")
+    '''
+    Fetch the lineages for a list of taxids from NCBI, batch_size
+    taxids are sent per efetch request (comma separated) over a
+    single keep-alive connection, respecting NCBI's rate limits.
 
-            lineage = dict()
+    Returns a dict of taxid to lineage dict, taxids NCBI doesn't
+    know about are left out.
+    '''
+    @classmethod
+    def ncbi_fetch_batch(cls, taxids, batch_size=200, email="lairdm@sfu.ca", tool="microbedb"):
+        global logger
 
-            # Parse through the lineage to find the classes
-            lineageex = root.find("LineageEx")
-            if not lineageex or not len(lineageex):
-                logger.critical("No lineage tree for taxon {}".format(taxid))
-                return None
+        import xml.etree.ElementTree as ET
 
-            for tax in lineageex.findall("Taxon"):
-                rank = tax.find("Rank")
-                if rank.text in valid_ranks:
-                    lineage[rank.text] = tax.find("ScientificName").text
+        taxids = [int(t) for t in taxids]
+        lineages = dict()
 
-            # Fetch the synonyms
-            synonyms = cls.parse_synonyms(root)
-            if synonyms:
-                lineage['synonyms'] = synonyms
+        for i in range(0, len(taxids), batch_size):
+            chunk = taxids[i:i + batch_size]
+            logger.debug("Fetching {} taxids from ncbi".format(len(chunk)))
 
-            # Find the other field
-            rank = root.find("Rank")
-            if rank.text == "no rank":
-                lineage['other'] = root.find("ScientificName").text
-            else:
-                lineage[rank.text] = root.find("ScientificName").text
+            params = {'db': 'taxonomy',
+                      'id': ','.join([str(t) for t in chunk]),
+                      'report': 'xml',
+                      'mode': 'text',
+                      'email': email,
+                      'tool': tool}
 
-            return lineage
+            r = eutils_request('efetch.fcgi', params)
 
-        except Exception as e:
-            logger.exception("Error fetching taxonomy from ncbi")
+            # Each taxon is one level down, the Taxon tags
+            # further in are the lineage
+            root = ET.fromstring(r.content)
+
+            for taxon in root.findall("Taxon"):
+                lineage = cls.parse_taxon(taxon)
+                if not lineage:
+                    continue
+
+                # Merged taxids come back under their new id, so
+                # file it under the ids we asked for too
+                ids = [int(taxon.find("TaxId").text)]
+                aka = taxon.find("AkaTaxIds")
+                if aka is not None:
+                    ids.extend([int(t.text) for t in aka.findall("TaxId")])
+
+                for taxid in ids:
+                    if taxid in chunk:
+                        lineages[taxid] = lineage
+
+        return lineages
+
+    '''
+    Parse an individual Taxon record from an efetch
+    result in to a lineage dict
+    '''
+    @classmethod
+    def parse_taxon(cls, root):
+        global logger
+
+        lineage = dict()
+
+        # Parse through the lineage to find the classes
+        lineageex = root.find("LineageEx")
+        if lineageex is None or not len(lineageex):
+            logger.critical("No lineage tree for taxon {}".format(root.find("TaxId").text))
             return None
 
+        for tax in lineageex.findall("Taxon"):
+            rank = tax.find("Rank")
+            if rank.text in valid_ranks:
+                lineage[rank.text] = tax.find("ScientificName").text
+
+        # Fetch the synonyms
+        synonyms = cls.parse_synonyms(root)
+        if synonyms:
+            lineage['synonyms'] = synonyms
+
+        # Find the other field
+        rank = root.find("Rank")
+        if rank.text == "no rank":
+            lineage['other'] = root.find("ScientificName").text
+        else:
+            lineage[rank.text] = root.find("ScientificName").text
+
+        return lineage
+
     @classmethod
     def parse_synonyms(cls, root):
 
         names_tag = root.find("OtherNames")
 
-        if not names_tag or not len(names_tag):
+        if names_tag is None or not len(names_tag):
             return None
 
         synonyms = list()
@@ -160,6 +469,54 @@ class Taxonomy(Base):
         else:
             return None
 
+# Taxonomy rows and gram stain predictions by taxid, most
+# genomes share a small number of species
+taxonomy_cache = lru_cache(maxsize=10000)
+gram_cache = lru_cache(maxsize=10000)
+
+#
+# All eutils requests go through one keep-alive session and
+# are spaced out to stay under NCBI's rate limit, 3 requests
+# a second, or 10 if an ncbi_api_key is in the config. The
+# server can be changed with eutils_url, e.g. to point at a
+# local stand-in for testing.
+#
+http_session = None
+last_request = 0
+request_lock = threading.Lock()
+
+def eutils_request(tool, params):
+    global http_session
+    global last_request
+
+    cfg = microbedb.config_singleton.getConfig()
+
+    server = cfg.get('eutils_url', "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/")
+    api_key = cfg.get('ncbi_api_key', None)
+    if api_key:
+        params['api_key'] = api_key
+
+    interval = 1.0 / (10 if api_key else 3)
+
+    with request_lock:
+        if not http_session:
+            # Only commands that go to NCBI pay for importing requests
+            import requests
+            http_session = requests.Session()
+
+        wait = last_request + interval - time.time()
+        if wait > 0:
+            time.sleep(wait)
+
+        try:
+            r = http_session.post(server.rstrip('/') + '/' + tool, data=params)
+        finally:
+            last_request = time.time()
+
+    r.raise_for_status()
+
+    return r
+
 # Valid ranks we'll accept for lineage classification
 valid_ranks = ['superkingdom', 'phylum', 'class', 'order', 'family', 'genus', 'species']
 
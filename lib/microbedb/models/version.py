@@ -75,11 +75,20 @@ class Version(Base):
 
         v.dl_directory = os.path.join(cfg.basedir, 'Bacteria_' + datestr)
 
+        # A second version made the same day needs a directory of its
+        # own, the default path can only point at one of them
+        if os.path.exists(v.dl_directory) or \
+           session.query(Version).filter(Version.dl_directory == v.dl_directory, Version.version_id != v.version_id).first():
+            v.dl_directory += '_' + str(v.version_id)
+
         session.commit()
 
-        # Special case for when we're first initializing microbedb
+        # Special case for when we're first initializing microbedb, the
+        # version goes live straight away so the default path needs
+        # its directory to point at
         if not Version.current():
-            Version.set_current(v.version_id)
+            if Version.mkpath(v.version_id):
+                Version.set_current(v.version_id)
 
         return v
 
@@ -129,6 +138,12 @@ class Version(Base):
 
     '''
     Set the default directory symlink to the given version
+
+    The symlink is swapped atomically, a new link is made under
+    a temporary name and renamed over the old one, so anyone reading
+    through the default path always sees either the old or the new
+    version and never a missing path.  Anything that resolved the old
+    link keeps working since the old version's directory is untouched.
     '''
     @classmethod
     def set_default_directory(cls, version):
@@ -142,16 +157,21 @@ class Version(Base):
             path = Version.fetch_path(version)
             default_path = Version.fetch_default_path()
 
-            if path and os.path.exists(path):
-                if os.path.islink(default_path):
-                    os.unlink(default_path)
-                elif os.path.exists(default_path):
-                    shutil.rmtree(default_path)
-                else:
-                    logger.error("Default path doesn't exist, why was this? ({})".format(default_path))
+            if not path or not os.path.exists(path):
+                logger.error("Path for version {} doesn't exist ({}), can't point the default path at it".format(version, path))
+                return False
+
+            if os.path.exists(default_path) and not os.path.islink(default_path):
+                # A real directory can't be swapped atomically for a
+                # symlink, move it aside once so from now on it can be
+                aside = "{}.old.{}".format(default_path, os.getpid())
+                logger.warning("Default path {} is a directory rather than a symlink, moving it to {}".format(default_path, aside))
+                os.rename(default_path, aside)
+            elif not os.path.lexists(default_path):
+                logger.info("Default path %s doesn't exist yet, linking it to %s", default_path, path)
+
+            replace_symlink(path, default_path)
 
-                os.symlink(path, default_path)
-                
             return True
 
         except Exception as e:
@@ -161,6 +181,11 @@ class Version(Base):
     '''
     Set the current version of microbedb to the given version_id and
     change the path for the static directory name as needed
+
+    The is_current flag and the symlink change together, the flag
+    change is held in an open transaction while the symlink is swapped
+    and only committed once it's in place.  If either fails both are
+    put back the way they were.
     '''
     @classmethod
     def set_current(cls, version):
@@ -172,27 +197,49 @@ class Version(Base):
 
         session = fetch_session()
 
+        default_path = Version.fetch_default_path()
+        previous_path = os.readlink(default_path) if os.path.islink(default_path) else None
+
         try:
+            # Get the requested version, if it doesn't exist
+            # the current version stays as it is
+            new_version = session.query(Version).filter(Version.version_id == version).first()
+            if not new_version:
+                raise Exception("Version {} not found".format(version))
+
             for v in session.query(Version).filter(Version.is_current == True):
                 v.is_current = False
 
-            # And now get the requested version and update it if we fine it
-            v = session.query(Version).filter(Version.version_id == version).first()
-            if v:
-                v.is_current = True
-                logger.info("New live version is {}".format(version))
+            new_version.is_current = True
 
-            session.commit()
+            session.flush()
 
-            Version.set_default_directory(version)
-
-            return True
+            if not Version.set_default_directory(version):
+                raise Exception("Couldn't point the default path at version {}".format(version))
 
         except Exception as e:
             logger.exception("Error setting new current version")
             session.rollback()
             return False
 
+        try:
+            session.commit()
+
+        except Exception as e:
+            logger.exception("Error committing new current version, restoring the default path")
+            session.rollback()
+
+            if previous_path:
+                replace_symlink(previous_path, default_path)
+            elif os.path.islink(default_path):
+                os.unlink(default_path)
+
+            return False
+
+        logger.info("New live version is {}".format(version))
+
+        return True
+
     '''
     Remove a version of MicrobeDB, including all the GenomeProjects and
     Replicons.  Remove the flat files if requested.
@@ -260,3 +307,23 @@ class Version(Base):
         except Exception as e:
             logger.exception("Error creating version path for version {}, path {}:".format(version, path))
             return False
+
+#
+# Atomically point a symlink at a new target, make the new link
+# under a temporary name then rename it over the old one
+#
+def replace_symlink(target, link_path):
+    global logger
+
+    tmp_link = "{}.tmp.{}".format(link_path, os.getpid())
+    if os.path.lexists(tmp_link):
+        os.unlink(tmp_link)
+
+    logger.debug("Pointing symlink {} at {}".format(link_path, target))
+    os.symlink(target, tmp_link)
+
+    try:
+        os.rename(tmp_link, link_path)
+    except Exception as e:
+        os.unlink(tmp_link)
+        raise e
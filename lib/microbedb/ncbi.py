@@ -10,32 +10,58 @@ checksums have changed.
 import ftplib
 import gzip
 import logging
-from Bio import SeqIO
+import json
+import sys
+from datetime import datetime
+from sqlalchemy import func
 import os.path
 from urlparse import urlparse
 import microbedb.config_singleton
 from microbedb.fileutils import find_extensions
 from microbedb.fileutils import separate_genbank
+from microbedb.metrics import timed, timed_iter
+from microbedb.sqlstats import sql_genome
+from microbedb.profiling import profiled
+import microbedb.protein_index
+from microbedb.sequence import index_fasta
 from .models import *
+from .models.genomeproject import ingest_states
 import pprint
 
 class ncbi_fetcher():
 
-    def __init__(self):
+    def __init__(self, index_inline=True, connect=True):
 
         self.cfg = microbedb.config_singleton.getConfig()
         self.logger = logging.getLogger(__name__)
 
+        # Whether genomes are added to the version's protein index as
+        # they're parsed, or the index is built once all are loaded
+        self.index_inline = index_inline
+
         self.logger.info("Initializing ncbi_fetcher")
 
-        self.logger.debug("Connecting to ncbi's ftp: {}".format(self.cfg.ncbi_ftp))
-        self.ftp = ftplib.FTP(self.cfg.ncbi_ftp)
-        self.ftp.login()
-        self.ftp.cwd(self.cfg.ncbi_rootdir)
+        # Without a connection only the local work
+        # (e.g. parsing) can be done
+        self.ftp = None
+        if connect:
+            self.connect()
 
     def __str__(self):
         return "ncbi_fetcher()"
-        
+
+    #
+    # Connect to ncbi's ftp, or a local stand in for it
+    # if ncbi_ftp_port is set
+    #
+    def connect(self):
+        port = int(self.cfg.get('ncbi_ftp_port', 21))
+
+        self.logger.debug("Connecting to ncbi's ftp: {}:{}".format(self.cfg.ncbi_ftp, port))
+        self.ftp = ftplib.FTP()
+        self.ftp.connect(self.cfg.ncbi_ftp, port)
+        self.ftp.login()
+        self.ftp.cwd(self.cfg.ncbi_rootdir)
 
     def check_and_reconnect(self):
         retry = 5
@@ -57,9 +83,7 @@ class ncbi_fetcher():
                 self.logger.exception("Unknown exception in ftp connection")
 
             self.logger.info("Reconnecting to ftp server")
-            self.ftp = ftplib.FTP(self.cfg.ncbi_ftp)
-            self.ftp.login()
-            self.ftp.cwd(self.cfg.ncbi_rootdir)
+            self.connect()
             retry = retry - 1
 
         return False
@@ -72,6 +96,10 @@ class ncbi_fetcher():
     '''
     def sync_version(self):
 
+        # Most genomes share a handful of species, load the
+        # taxonomy we already have in to memory up front
+        Taxonomy.warm_cache()
+
         # First we fetch all the files
         files = self.ftp.nlst()
 
@@ -80,12 +108,176 @@ class ncbi_fetcher():
 
             # Check the connection to the ftp server and reconnect
             if not self.check_and_reconnect():
-                logger.critical("We can't seem to connect to the ftp server, aborting")
+                self.logger.critical("We can't seem to connect to the ftp server, aborting")
                 sys.exit(1)
 
             self.process_remote_directory(file)
 
             
+    '''
+    Work out what sync_version would do without changing anything,
+    walk NCBI's directories and classify each complete genome as new,
+    changed or unchanged against the current version of microbedb.
+    The size of the files that would be downloaded is totalled up and
+    turned in to a rough time estimate given the bandwidth (MB/s) and
+    per genome processing times.
+
+    The plan is written as JSON to plan_file, it can be run later with
+    execute_plan.  Returns the plan.
+    '''
+    def plan_version(self, plan_file, bandwidth=10.0, genome_seconds=2.0, clone_seconds=0.2):
+
+        current_version = Version.current()
+
+        plan = {'created': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                'current_version': current_version,
+                'genomes': []}
+
+        # On a fresh install there's nothing to compare against,
+        # every genome is new
+        if current_version is None:
+            self.logger.info("No current version, planning every genome as new")
+
+        totals = {'new': 0, 'changed': 0, 'unchanged': 0, 'bytes': 0}
+
+        for genomedir in self.ftp.nlst():
+            self.logger.info("Planning remote directory: {}".format(genomedir))
+
+            if not self.check_and_reconnect():
+                self.logger.critical("We can't seem to connect to the ftp server, aborting")
+                sys.exit(1)
+
+            assembly_lines = []
+            try:
+                self.ftp.retrlines("RETR {}/assembly_summary.txt".format(genomedir), assembly_lines.append)
+            except ftplib.error_perm as e:
+                self.logger.exception("Perm FTP error: " + str(e))
+                continue
+
+            for line in assembly_lines:
+                if line.startswith("#"):
+                    continue
+
+                assembly = self.map_summary(line)
+                if not self.wanted_assembly(assembly) or not assembly['ftp_path']:
+                    continue
+
+                try:
+                    checksums = self.fetch_checksums(assembly)
+
+                    if current_version is None:
+                        gp, genome_changed = None, True
+                    else:
+                        gp, genome_changed = self.check_genome(assembly, checksums)
+
+                    if not gp:
+                        status = 'new'
+                    elif genome_changed:
+                        status = 'changed'
+                    else:
+                        status = 'unchanged'
+
+                    size = 0
+                    if status != 'unchanged':
+                        size = self.download_size(assembly, checksums)
+
+                except Exception as e:
+                    self.logger.exception("Error planning genome {}".format(line))
+                    continue
+
+                totals[status] += 1
+                totals['bytes'] += size
+
+                plan['genomes'].append({'genome_name': genomedir,
+                                        'status': status,
+                                        'bytes': size,
+                                        'assembly': assembly,
+                                        'checksums': checksums})
+
+        downloads = totals['new'] + totals['changed']
+        totals['estimated_seconds'] = int(totals['bytes'] / (bandwidth * 1024 * 1024) +
+                                          downloads * genome_seconds +
+                                          totals['unchanged'] * clone_seconds)
+        plan['totals'] = totals
+
+        self.logger.info("Sync plan: {}".format(totals))
+
+        with open(plan_file, 'w') as outfile:
+            json.dump(plan, outfile, indent=1)
+
+        return plan
+
+    '''
+    Run a plan made by plan_version, each genome in the plan is
+    processed as sync_version would but without rescanning NCBI's
+    directories or refetching the checksum files.  Genomes are
+    still checked against the database in case anything has
+    changed since the plan was made.
+    '''
+    def execute_plan(self, plan_file):
+
+        with open(plan_file, 'r') as infile:
+            plan = json.load(infile)
+
+        self.logger.info("Executing sync plan {} from {}, {}".format(plan_file, plan['created'], plan['totals']))
+
+        Taxonomy.warm_cache()
+
+        taxids = set()
+        for genome in plan['genomes']:
+            taxids.add(genome['assembly']['taxid'])
+            taxids.add(genome['assembly']['species_taxid'])
+        Taxonomy.load_batch(taxids)
+
+        for genome in plan['genomes']:
+            if not self.check_and_reconnect():
+                self.logger.critical("We can't seem to connect to the ftp server, aborting")
+                sys.exit(1)
+
+            # We don't want things to fail out for just one genome failing
+            try:
+                self.process_genome(genome['genome_name'],
+                                    genome['assembly'],
+                                    checksums=genome['checksums'])
+
+            except Exception as e:
+                self.logger.exception("Error processing genome {}/{}".format(genome['genome_name'], genome['assembly']['assembly_accession']))
+
+    #
+    # Total size in bytes of the files we'd download for an assembly,
+    # one MLSD listing of the directory if the server supports it,
+    # otherwise a SIZE for each file
+    #
+    def download_size(self, assembly, checksums):
+
+        path = urlparse(assembly['ftp_path']).path
+
+        filenames = []
+        for line in checksums:
+            filename, md5 = self.separate_md5line(line)
+            if 'annotation_hashes.txt' not in filename:
+                filenames.append(filename)
+
+        sizes = dict()
+        try:
+            listing = []
+            self.ftp.retrlines("MLSD {}".format(path), listing.append)
+
+            for entry in listing:
+                facts, name = entry.split(' ', 1)
+                for fact in facts.lower().split(';'):
+                    if fact.startswith('size='):
+                        sizes[name] = int(fact[5:])
+
+        except ftplib.error_perm as e:
+            self.logger.debug("MLSD not available, using SIZE: " + str(e))
+
+            self.ftp.voidcmd("TYPE I")
+            for filename in filenames:
+                sizes[filename] = self.ftp.size("{}/{}".format(path, filename)) or 0
+
+        return sum([sizes.get(filename, 0) for filename in filenames])
+
     '''
     For a given species directory in NCBI's ftp
     directory, download the assembly summary file,
@@ -93,43 +285,96 @@ class ncbi_fetcher():
     '''
     def process_remote_directory(self, genomedir):
         
-        assembly_lines = []
         self.logger.debug("Processing genome directory {}".format(genomedir))
 
         try:
-            self.logger.debug("Fetching genome summary file {}/assembly_summary.txt".format(genomedir))
-
-            self.ftp.retrlines("RETR {}/assembly_summary.txt".format(genomedir), assembly_lines.append)
-
-            for line in assembly_lines:
-                self.logger.debug("Summary file line: {}".format(line))
-                self.process_summary(genomedir, line)
+            self.process_directory(genomedir)
 
         except ftplib.error_perm as e:
             self.logger.exception("Perm FTP error: " + str(e))
         except Exception as e:
             self.logger.exception("Unknown exception: " + str(e))
 
+    #
+    # Fetch a species directory's summary file and process each
+    # genome in it, unlike process_remote_directory errors fetching
+    # the summary file are passed on to the caller.  Returns the
+    # number of genomes that failed.
+    #
+    def process_directory(self, genomedir):
+
+        assembly_lines = []
+        self.logger.debug("Fetching genome summary file {}/assembly_summary.txt".format(genomedir))
+
+        with timed('summary_fetch') as t:
+            self.ftp.retrlines("RETR {}/assembly_summary.txt".format(genomedir), assembly_lines.append)
+            t.bytes = sum(len(line) + 1 for line in assembly_lines)
+
+        # Fetch the taxonomy for the whole summary file up front
+        # in a few batched requests rather than one per genome
+        self.preload_taxonomy(assembly_lines)
+
+        failed = 0
+        for line in assembly_lines:
+            self.logger.debug("Summary file line: %s", line)
+            if self.process_summary(genomedir, line) is False:
+                failed += 1
+
+        return failed
+
+
+    #
+    # Gather the taxids and species_taxids of all the genomes
+    # we'll process in a summary file and make sure we have
+    # them all in the taxonomy table
+    #
+    def preload_taxonomy(self, assembly_lines):
+
+        taxids = set()
+        for line in assembly_lines:
+            if line.startswith("#"):
+                continue
+
+            assembly = self.map_summary(line)
+            if not self.wanted_assembly(assembly):
+                continue
+
+            taxids.add(assembly['taxid'])
+            taxids.add(assembly['species_taxid'])
+
+        try:
+            Taxonomy.load_batch(taxids)
+
+        except Exception as e:
+            # Not fatal, find_or_create will fetch them one at a time
+            self.logger.exception("Error preloading taxonomy: " + str(e))
+
+    #
+    # We're only interested in complete genomes or reference genomes
+    #
+    def wanted_assembly(self, assembly):
+
+        return assembly['assembly_level'] == 'Complete Genome' or assembly['refseq_category'] == 'reference genome'
 
     #
     # For a given line of a summary file, determine
-    # if we should process it. Is it a complete 
-    # genome?
+    # if we should process it. Is it a complete
+    # genome?  Returns False if processing it failed.
     #
     def process_summary(self, genomedir, line):
 
         # Skip comment lines
         if line.startswith("#"):
             return
-        
+
         # Split the line in to it's fields
         assembly = self.map_summary(line)
 
         # We're only interested in complete genomes or reference genomes
-        if assembly['assembly_level'] != 'Complete Genome' and assembly['refseq_category'] != 'reference genome':
+        if not self.wanted_assembly(assembly):
             return
 
-        self.logger.info("Found complete genome: " + str(assembly))
+        self.logger.info("Found complete genome: %s", assembly, extra={'assembly_accession': assembly['assembly_accession']})
 
         # We don't want things to fail out for just one line in the summary failing
         try:
@@ -138,99 +383,195 @@ class ncbi_fetcher():
 
         except Exception as e:
             self.logger.exception("Error processing genome {}".format(line))
+            return False
+
+        return True
 
     #
     # We have a genome we know is complete,
     # process it.
     #
-    def process_genome(self, current_genome, assembly):
-        self.logger.info("Processing genome: {}, assembly_accession: {}, asm_name: {}".format(current_genome, assembly['assembly_accession'], assembly['asm_name']))
+    def process_genome(self, current_genome, assembly, checksums=None):
+        self.logger.info("Processing genome: %s, assembly_accession: %s, asm_name: %s", current_genome, assembly['assembly_accession'], assembly['asm_name'],
+                         extra={'genome_name': current_genome, 'assembly_accession': assembly['assembly_accession']})
 
         # Fetch the summary file with the checksums
         if not assembly['ftp_path']:
             self.logger.error("No FTP path for genome {}/{}".format(current_genome, assembly['assembly_accession']))
             return
 
-        # Build the url for the checksum file, then grab it
-        url_pieces = urlparse(assembly['ftp_path'])
-        summary_url = "{}/md5checksums.txt".format(url_pieces.path)
-        checksums = []
-        self.logger.debug("RETR checksum file {}".format(summary_url))
-        self.ftp.retrlines("RETR {}".format(summary_url), checksums.append)
+        with sql_genome(assembly['assembly_accession']), profiled(assembly['assembly_accession']):
+            gp, state, checksums = self.prepare_genome(current_genome, assembly, checksums)
 
-        # Remove all paths that have a slash in them, we don't
-        # want files that aren't in the root path
-        checksums = [cs for cs in checksums if cs.count('/') <= 1]
+            if not gp:
+                return
+
+            # Nothing changed in this genome so just clone everything and
+            # make the needed symlinks
+            if state == 'clone':
+                self.copy_genome(gp)
+            else:
+                self.ingest_genome(gp, assembly, checksums, state=state)
 
-        # See if we have this genome in the current version of the
-        # database already
-        gp = GenomeProject.find(**assembly)
+    #
+    # Work out what needs to be done for a genome, returns a tuple
+    # of the GP to work on, what to do with it and the checksums:
+    #
+    #   (None, None, checksums)  - nothing left to do
+    #   (gp, 'clone', checksums) - gp from the current version is unchanged
+    #   (gp, state, checksums)   - gp in the new version still has to be
+    #                              ingested from the given state
+    #
+    def prepare_genome(self, current_genome, assembly, checksums=None):
 
-        # If we didn't find the GP, then consider it changed already
-        genome_changed = True if not gp else False
-        self.logger.debug("Starting checksum check, genome has changed: {}".format(genome_changed))
+        # If the update was interrupted we may already have started
+        # on this genome in the version we're building, pick up from
+        # wherever it got to
+        gp = GenomeProject.find(version='latest', **assembly)
+        if gp:
+            gpingest = GenomeProject_Ingest.fetch(gp.gpv_id)
 
-        # Go through the checksum lines, and for each see if we have
-        # that checksum already and if it matches the current microbedb version
-        for line in checksums:
-            self.logger.debug("Examining checksum file line: {}".format(line))
-            filename, md5 = self.separate_md5line(line)
+            # GPs loaded before we tracked ingest state, or that
+            # we've already finished, have nothing left to do
+            if not gpingest or gpingest.state == 'linked':
+                self.logger.info("We already have gpv_id %s for version %s, skipping", gp.gpv_id, gp.version_id)
+                return None, None, checksums
 
-            if 'annotation_hashes.txt' in filename:
-                self.logger.debug("Found annotation.txt file, moving on to the next line")
-                continue
+            # Clones are cheap, rather than work out how far the clone
+            # got, remove it and start over
+            if gpingest.cloned:
+                self.logger.info("Removing partial clone gpv_id %s", gp.gpv_id)
+                GenomeProject.remove_gp(gp.gpv_id, remove_files=True)
 
-            # If the checksum if different (or wasn't found) we know the genome
-            # has changed and we'll have tp update it
-            if not GenomeProject_Checksum.verify(filename, md5):
-                self.logger.debug("Checksum for file {} has changed".format(filename))
-                genome_changed = True
+            else:
+                self.logger.info("Resuming gpv_id %s from state %s", gp.gpv_id, gpingest.state)
+
+                if gpingest.state == 'planned':
+                    self.fetch_taxonomy(gp)
+
+                return gp, gpingest.state, checksums
+
+        # Grab the checksum file, unless we were given
+        # them (e.g. from a sync plan)
+        if checksums is None:
+            checksums = self.fetch_checksums(assembly)
+
+        gp, genome_changed = self.check_genome(assembly, checksums)
+
+        if not genome_changed:
+            self.logger.info("Genome %s/%s hasn't changed, cloning", assembly['assembly_accession'], assembly['asm_name'],
+                             extra={'assembly_accession': assembly['assembly_accession'], 'action': 'clone'})
+            return gp, 'clone', checksums
 
         # If the genome has changed we're going to have to download and process it
-        if genome_changed:
-            self.logger.info("Genome {}/{} has changed, creating a new copy".format(assembly['assembly_accession'], assembly['asm_name']))
-            # Start fresh, don't reuse the previous GP, even if found
-            # We're going to maintain the same directory structure, so we need the directory
-            # name for the species
-            assembly['genome_name'] = current_genome
-            gp = GenomeProject.create_gp(version='latest', **assembly)
-
-            # Uh-oh, we had a problem making the new GenomeProject, bail
-            if not gp:
-                self.logger.error("We had a problem making the GenomeProject {}/{}".format(current_genome, assembly['assembly_accession']))
-                return
+        self.logger.info("Genome %s/%s has changed, creating a new copy", assembly['assembly_accession'], assembly['asm_name'],
+                         extra={'assembly_accession': assembly['assembly_accession'], 'action': 'ingest'})
+        # Start fresh, don't reuse the previous GP, even if found
+        # We're going to maintain the same directory structure, so we need the directory
+        # name for the species
+        assembly['genome_name'] = current_genome
+        gp = GenomeProject.create_gp(version='latest', **assembly)
+
+        # Uh-oh, we had a problem making the new GenomeProject, bail
+        if not gp:
+            self.logger.error("We had a problem making the GenomeProject %s/%s", current_genome, assembly['assembly_accession'])
+            return None, None, checksums
+
+        self.fetch_taxonomy(gp)
+
+        return gp, 'planned', checksums
+
+    #
+    # Fetch metadata from source or clone it from current version if we have
+    # it, here
+    #
+    # And ensure we have all the taxonomy information for this genome
+    #
+    def fetch_taxonomy(self, gp):
+
+        if gp.taxid:
+            Taxonomy.find_or_create(gp.taxid)
 
-            # Fetch metadata from source or clone it from current version if we have
-            # it, here
+        if gp.species_taxid:
+            Taxonomy.find_or_create(gp.species_taxid)
 
-            # And ensure we have all the taxonomy information for this genome
-            if gp.taxid:
-                Taxonomy.find_or_create(gp.taxid)
+    #
+    # Take a new GP through the stages of ingestion, download,
+    # parse, load the metadata, starting after the given state
+    # (the last state the GP successfully reached)
+    #
+    def ingest_genome(self, gp, assembly, checksums, state='planned'):
+        stage = ingest_states.index(state)
 
-            if gp.species_taxid:
-                Taxonomy.find_or_create(gp.species_taxid)
+        if stage < ingest_states.index('downloaded'):
+            if checksums is None:
+                checksums = self.fetch_checksums(assembly)
 
             # Go fetch the genome files from NCBI
-            self.fetch_genome(gp, url_pieces.path, checksums)
+            self.fetch_genome(gp, urlparse(assembly['ftp_path']).path, checksums)
 
+        if stage < ingest_states.index('parsed'):
             # Now that we should have the files, process and load
             # the replicons
             self.logger.info("Parsing genbank file for gp {}".format(gp.gpv_id))
             self.parse_replicons(gp)
 
-        # Nothing changed in this genome so just clone everything and
-        # make the needed symlinks
-        else:
-            self.logger.info("Genome {}/{} hasn't changed, cloning".format(assembly['assembly_accession'], assembly['asm_name']))
+        if stage < ingest_states.index('loaded'):
+            self.load_meta(gp)
 
-            # What if the script was restarted? And we've already loaded this genone?
-            # Do nothing then
-            if gp.version_id == Version.latest():
-                self.logger.error("We already seem to have gpv_id {} for version {}, skipping".format(gp.gpv_id, gp.version_id))
-                return
+        GenomeProject_Ingest.set_state(gp.gpv_id, 'linked')
 
-            # Copy the genome and all realted pieces
-            self.copy_genome(gp)
+    #
+    # Fetch the md5checksums.txt file for an assembly, only
+    # the lines for files in the assembly's root directory
+    #
+    def fetch_checksums(self, assembly):
+
+        url_pieces = urlparse(assembly['ftp_path'])
+        summary_url = "{}/md5checksums.txt".format(url_pieces.path)
+        checksums = []
+        self.logger.debug("RETR checksum file {}".format(summary_url))
+        with timed('checksum_fetch') as t:
+            self.ftp.retrlines("RETR {}".format(summary_url), checksums.append)
+            t.bytes = sum(len(line) + 1 for line in checksums)
+
+        # Remove all paths that have a slash in them, we don't
+        # want files that aren't in the root path
+        return [cs for cs in checksums if cs.count('/') <= 1]
+
+    #
+    # Compare an assembly and its checksums against the current
+    # version of microbedb, returns the GP from the current version
+    # (None if we don't have one) and if the genome has changed
+    #
+    def check_genome(self, assembly, checksums):
+
+        with timed('verify'):
+            # See if we have this genome in the current version of the
+            # database already
+            gp = GenomeProject.find(**assembly)
+
+            # If we didn't find the GP, then consider it changed already
+            genome_changed = True if not gp else False
+            self.logger.debug("Starting checksum check, genome has changed: %s", genome_changed)
+
+            # Go through the checksum lines, and for each see if we have
+            # that checksum already and if it matches the current microbedb version
+            for line in checksums:
+                self.logger.debug("Examining checksum file line: %s", line)
+                filename, md5 = self.separate_md5line(line)
+
+                if 'annotation_hashes.txt' in filename:
+                    self.logger.debug("Found annotation.txt file, moving on to the next line")
+                    continue
+
+                # If the checksum if different (or wasn't found) we know the genome
+                # has changed and we'll have tp update it
+                if not GenomeProject_Checksum.verify(filename, md5):
+                    self.logger.debug("Checksum for file %s has changed", filename)
+                    genome_changed = True
+
+        return gp, genome_changed
 
     #
     # The genome project hasn't changed, therefore we need to copy
@@ -240,23 +581,42 @@ class ncbi_fetcher():
     # automatically get cloned as well
     #
     def copy_genome(self, gp):
-        self.logger.info("Copying GenomeProject {}".format(gp.gpv_id))
-        gp.clone_gp()
+        self.logger.info("Copying GenomeProject %s", gp.gpv_id)
+        old_gpv_id, old_version = gp.gpv_id, gp.version_id
+
+        with timed('clone'):
+            gp.clone_gp()
 
-        self.logger.debug("New gpv_id: {}".format(gp.gpv_id))
+        self.logger.debug("New gpv_id: %s", gp.gpv_id)
+
+        replicons = fetch_session().query(Replicon).filter(Replicon.gpv_id == gp.gpv_id).all()
+        self.index_proteins(microbedb.protein_index.clone_genome, gp, old_gpv_id, old_version, replicons)
+        GenomeProject_Ingest.set_state(gp.gpv_id, 'linked')
 
     #
     # We have an updated genome, grab the files,
-    # and parse them
+    # and unzip them
     #
     def fetch_genome(self, gp, ftp_path, checksums):
+
+        files = self.download_files(gp, ftp_path, checksums)
+        self.decompress_files(gp, files)
+
+    #
+    # Download the files for a GP from NCBI, returns a list of
+    # (filename, md5, local_filename) for the files fetched
+    #
+    def download_files(self, gp, ftp_path, checksums):
         session = fetch_session()
         self.logger.debug("Fetching genome {} from {}".format(gp.gpv_id, ftp_path))
 
+        GenomeProject_Ingest.set_state(gp.gpv_id, 'downloading')
+
         if not os.path.exists(gp.gpv_directory):
             self.logger.info("making directory {}".format(gp.gpv_directory))
             os.makedirs(gp.gpv_directory)
-            
+
+        files = []
         for line in checksums:
             filename, md5 = self.separate_md5line(line)
 
@@ -265,33 +625,71 @@ class ncbi_fetcher():
                 continue
 
             try:
-                # Retreive the genome file from ncbi
                 local_filename = os.path.join(gp.gpv_directory, filename)
-                self.logger.debug("Using local filename {}".format(local_filename))
-                self.ftp.retrbinary("RETR {}/{}".format(ftp_path, filename),
-                                    open(local_filename,'wb').write)
 
-                # Insert the checksum
-                gpcs = GenomeProject_Checksum(filename=filename, 
-                                              checksum=md5, 
-                                              version_id=Version.fetch("latest"),
-                                              gpv_id=gp.gpv_id)
+                # The checksum is only inserted once the file is fully
+                # downloaded and unzipped, so if we have it (and it still
+                # matches) an earlier, interrupted, run already got the file
+                gpcs = session.query(GenomeProject_Checksum).filter(GenomeProject_Checksum.gpv_id == gp.gpv_id,
+                                                                    GenomeProject_Checksum.filename == filename).first()
+                if gpcs:
+                    if gpcs.checksum == md5:
+                        self.logger.debug("Already have %s for gpv_id %s, skipping", filename, gp.gpv_id)
+                        continue
 
-                session.add(gpcs)
-                session.commit()
+                    session.delete(gpcs)
+                    session.commit()
+
+                # Retreive the genome file from ncbi
+                self.logger.debug("Using local filename %s", local_filename)
+                with timed('download') as t:
+                    with open(local_filename, 'wb') as outfile:
+                        self.ftp.retrbinary("RETR {}/{}".format(ftp_path, filename),
+                                            outfile.write)
+                    t.bytes = os.path.getsize(local_filename)
+
+                files.append((filename, md5, local_filename))
 
+            except Exception as e:
+                self.logger.exception("Exception downloading {}: ".format(filename))
+                session.rollback()
+                raise e
+
+        return files
+
+    #
+    # Unzip the files download_files fetched and record
+    # their checksums
+    #
+    def decompress_files(self, gp, files):
+        session = fetch_session()
+
+        for filename, md5, local_filename in files:
+            try:
                 if local_filename[-2:] == 'gz':
-                    self.logger.debug("Gzipped file, unzipping {}".format(local_filename))
+                    self.logger.debug("Gzipped file, unzipping %s", local_filename)
                     # Unzip the file
-                    with gzip.open(local_filename, 'rb') as infile:
-                        with open(local_filename[:-3], 'w') as outfile:
-                            for line in infile:
-                                outfile.write(line)
+                    with timed('gunzip') as t:
+                        with gzip.open(local_filename, 'rb') as infile:
+                            with open(local_filename[:-3], 'w') as outfile:
+                                for line in infile:
+                                    outfile.write(line)
+                        t.bytes = os.path.getsize(local_filename[:-3])
                 
                     # Remove the gzip files
                     if os.path.exists(local_filename):
                         os.unlink(local_filename)
 
+                # Insert the checksum
+                gpcs = GenomeProject_Checksum(filename=filename, 
+                                              checksum=md5, 
+                                              version_id=Version.fetch("latest"),
+                                              gpv_id=gp.gpv_id)
+
+                with timed('db_commit'):
+                    session.add(gpcs)
+                    session.commit()
+
             except Exception as e:
                 self.logger.exception("Exception inserting checksum for {}: ".format(filename))
                 session.rollback()
@@ -306,42 +704,113 @@ class ncbi_fetcher():
         if not gp.commit():
             self.logger.critical("We had trouble committing the filename for GP: " + str(gp))
 
+        GenomeProject_Ingest.set_state(gp.gpv_id, 'downloaded')
+
+    #
+    # Split the genbank file for a GP in to its replicons and
+    # load them
+    #
     def parse_replicons(self, gp):
+        from Bio import SeqIO
 
         try:
             session = fetch_session()
 
+            # Clear out any replicons left by an interrupted parse
+            for rep in session.query(Replicon).filter(Replicon.gpv_id == gp.gpv_id):
+                self.logger.debug("Removing replicon %s from a previous parse", rep.rpv_id)
+                Replicon.remove_replicon(rep.rpv_id)
+
             genbank_file = "{}/{}_{}_genomic.gbff".format(gp.gpv_directory, gp.assembly_accession, gp.asm_name)
             self.logger.debug("Using genbank file {}".format(genbank_file))
 
             if not os.path.exists(genbank_file):
                 raise Exception("Genbank file for {}_{} (gpv_id {}) doesn't exist".format(gp.assembly_accession, gp.asm_name, gp.gpv_id))
 
-            type_count = {'chromosome_num': 0,
-                          'plasmid_num': 0,
-                          'contig_num': 0 }
-
             # Parse the genbank file and for each replicon in it
             # parse and load it
+            replicons = []
             with open(genbank_file, 'rU') as infile:
-                for record in SeqIO.parse(infile, "genbank"):
-                    rep = Replicon.create_from_genbank(gp, record)
+                for record in timed_iter('parse', SeqIO.parse(infile, "genbank")):
+                    with timed('db_commit'):
+                        rep = Replicon.create_from_genbank(gp, record)
 
                     # And finally try to make all the per replicon files
-                    separate_genbank(os.path.join(rep.genomeproject.gpv_directory, rep.genomeproject.filename) +  '_genomic.gbff',
-                                     os.path.join(rep.genomeproject.gpv_directory, rep.genomeproject.filename) +  '_genomic.fna',
-                                     rep.rep_accnum,
-                                     rep.genomeproject.gpv_directory)
+                    with timed('replicon_split'):
+                        separate_genbank(os.path.join(rep.genomeproject.gpv_directory, rep.genomeproject.filename) +  '_genomic.gbff',
+                                         os.path.join(rep.genomeproject.gpv_directory, rep.genomeproject.filename) +  '_genomic.fna',
+                                         rep.rep_accnum,
+                                         rep.genomeproject.gpv_directory)
+
+                        self.index_sequence(os.path.join(rep.genomeproject.gpv_directory, rep.rep_accnum) + '.fna')
 
                     # Find all the file types for the replicon
                     file_types = find_extensions(rep.genomeproject.gpv_directory, rep.file_name)
                     if file_types:
                         rep.file_types = file_types
 
-                    if not rep.commit():
-                        self.logger.critical("We couldn't commit changes to Rep " + str(rep))
+                    with timed('db_commit'):
+                        if not rep.commit():
+                            self.logger.critical("We couldn't commit changes to Rep " + str(rep))
+
+                    replicons.append(rep)
+
+        except Exception as e:
+            self.logger.exception("Error parsing replicons for GP: " + str(e))
+            session.rollback()
+            raise e
+
+        self.index_proteins(microbedb.protein_index.index_genome, gp, replicons)
 
-                    type_count[rep.rep_type+"_num"] += 1
+        GenomeProject_Ingest.set_state(gp.gpv_id, 'parsed')
+
+    #
+    # The protein index can always be rebuilt from the files
+    # (protein_index.build_index), so failing to update it
+    # doesn't fail the genome
+    #
+    def index_proteins(self, update, gp, *args):
+
+        if not self.index_inline:
+            return
+
+        try:
+            with timed('protein_index'):
+                update(gp, *args)
+        except Exception as e:
+            self.logger.exception("Error updating the protein index for gpv_id %s, rebuild it with build_index", gp.gpv_id)
+
+    #
+    # Index the replicon's .fna for sequence lookups, a lookup
+    # builds the index itself if it's missing so failing to
+    # doesn't fail the genome
+    #
+    def index_sequence(self, fna_file):
+
+        if not os.path.exists(fna_file):
+            return
+
+        try:
+            index_fasta(fna_file)
+        except Exception as e:
+            self.logger.warning("Can't index %s, it will be indexed when first looked up: %s", fna_file, e)
+
+    #
+    # Load the GenomeProject_Meta for a GP from its
+    # replicons
+    #
+    def load_meta(self, gp):
+
+        try:
+            session = fetch_session()
+
+            type_count = {'chromosome_num': 0,
+                          'plasmid_num': 0,
+                          'contig_num': 0 }
+
+            for rep_type, count in session.query(Replicon.rep_type, func.count(Replicon.rpv_id)) \
+                                          .filter(Replicon.gpv_id == gp.gpv_id).group_by(Replicon.rep_type):
+                type_count[rep_type+"_num"] = count
 
             self.logger.debug("Updating GP with rep_types: " + str(type_count))
 
@@ -350,16 +819,19 @@ class ncbi_fetcher():
             if gram:
                 type_count['gram_stain'] = gram
 
-            GenomeProject_Meta.create_or_update(gp.gpv_id, **type_count)
+            with timed('db_commit'):
+                GenomeProject_Meta.create_or_update(gp.gpv_id, **type_count)
 
-            # Commit the rep_type changes
-            session.commit()
+                # Commit the rep_type changes
+                session.commit()
 
         except Exception as e:
             self.logger.exception("Error updating GP with rep_type counts: " + str(e))
             session.rollback()
             raise e
 
+        GenomeProject_Ingest.set_state(gp.gpv_id, 'loaded')
+
     '''
     The mappings of an ncbi assembly summary file to fields we need
     '''
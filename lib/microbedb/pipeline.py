@@ -0,0 +1,407 @@
+'''
+Library to run a MicrobeDB update as a pipeline
+
+Rather than taking each genome through checksums, download,
+unzipping, parsing and loading before starting the next, each
+stage has its own pool of worker threads joined by bounded
+queues.  Genomes flow from one stage to the next so downloads
+overlap with parsing and loading, and when a stage falls behind
+its queue fills and the stages before it wait (backpressure),
+keeping memory use bounded.
+
+The stages are:
+
+    discovery  - walk NCBI's directories and summary files (one thread)
+    checksum   - fetch the md5checksums.txt and decide what to do
+    download   - fetch the genome files
+    decompress - unzip them and record their checksums
+    parse      - split the genbank file and load the replicons
+    load       - load the metadata, or clone unchanged genomes
+
+The checksum and download workers each have their own ftp
+connection and every worker its own database session.  The
+ingest state of each genome is recorded as it goes (see
+GenomeProject_Ingest) so an interrupted pipeline can be rerun
+the same way as a serial update.
+
+Parsing the genbank files is CPU bound, so given a pool from
+start_parse_pool each parse worker hands its genomes to a process
+of its own (with its own database engine) rather than doing the
+work under the GIL.  The parse timings are sent back to this
+process, and the genome's proteins are indexed here so the protein
+index keeps a single writer.  Without a pool (e.g. with --profile
+or --sql-stats, so it's measured) the parsing stays in this process.
+'''
+
+import ftplib
+import json
+import logging
+import threading
+import multiprocessing
+import Queue
+from urlparse import urlparse
+import microbedb.config_singleton
+import microbedb.protein_index
+from microbedb.logger_singleton import initLogger
+from .models import *
+from .models.genomeproject import ingest_states
+from .ncbi import ncbi_fetcher
+from .metrics import timed, getMetrics
+from .sqlstats import sql_genome
+from .profiling import profiled
+
+stages = ['checksum', 'download', 'decompress', 'parse', 'load']
+
+# The stages that talk to NCBI and need their own ftp connection
+ftp_stages = ['checksum', 'download']
+
+default_workers = {'checksum': 4,
+                   'download': 4,
+                   'decompress': 2,
+                   'parse': 2,
+                   'load': 1}
+
+class sync_pipeline():
+
+    def __init__(self, workers=None, queue_size=None, parse_pool=None):
+
+        self.cfg = microbedb.config_singleton.getConfig()
+        self.logger = logging.getLogger(__name__)
+
+        # Worker counts per stage, from the arguments, then the
+        # config file (pipeline_<stage>_workers), then the defaults
+        workers = workers or {}
+        self.workers = dict()
+        for stage in stages:
+            self.workers[stage] = int(workers.get(stage) or
+                                      self.cfg.get('pipeline_{}_workers'.format(stage), default_workers[stage]))
+
+        if queue_size is None:
+            queue_size = int(self.cfg.get('pipeline_queue_size', 100))
+
+        # Seconds to wait for a parse process before
+        # giving up on the genome
+        self.parse_timeout = int(self.cfg.get('pipeline_parse_timeout', 3600))
+        self.parse_pool = parse_pool
+
+        self.queues = dict((stage, Queue.Queue(maxsize=queue_size)) for stage in stages)
+        self.threads = dict((stage, []) for stage in stages)
+
+        self.lock = threading.Lock()
+        self.counts = dict((stage, 0) for stage in stages)
+        self.errors = dict((stage, 0) for stage in stages)
+
+        # The discovery stage's connection, also used by the
+        # stages that don't need to talk to NCBI
+        self.fetcher = ncbi_fetcher()
+
+    def __str__(self):
+        return "sync_pipeline(): workers: {}".format(self.workers)
+
+    '''
+    Run the pipeline over everything in NCBI's directories, or
+    the genomes in a plan made by ncbi_fetcher.plan_version if
+    plan_file is given.  Returns once every genome has gone through
+    all the stages.
+    '''
+    def run(self, plan_file=None):
+
+        self.logger.info("Starting update pipeline, workers: {}".format(self.workers))
+
+        Taxonomy.warm_cache()
+
+        for stage in stages:
+            for i in range(self.workers[stage]):
+                fetcher = ncbi_fetcher() if stage in ftp_stages else self.fetcher
+                t = threading.Thread(target=self.worker, args=(stage, fetcher), name="{}-{}".format(stage, i))
+                t.daemon = True
+                t.start()
+                self.threads[stage].append(t)
+
+        try:
+            if plan_file:
+                self.discover_plan(plan_file)
+            else:
+                self.discover()
+
+        finally:
+            # Shut the stages down in order, once every worker in a
+            # stage has finished nothing more can arrive at the next one
+            for stage in stages:
+                for t in self.threads[stage]:
+                    self.queues[stage].put(None)
+
+                for t in self.threads[stage]:
+                    t.join()
+
+            if self.parse_pool:
+                self.parse_pool.close()
+                self.parse_pool.join()
+                self.parse_pool = None
+
+        self.logger.info("Update pipeline finished, genomes per stage: {}, errors: {}".format(self.counts, self.errors))
+
+        return self.counts
+
+    #
+    # Walk NCBI's directories and queue each complete genome
+    # in the summary files
+    #
+    def discover(self):
+        fetcher = self.fetcher
+
+        for genomedir in fetcher.ftp.nlst():
+            self.logger.info("Processing remote directory: {}".format(genomedir))
+
+            if not fetcher.check_and_reconnect():
+                self.logger.critical("We can't seem to connect to the ftp server, aborting")
+                raise Exception("Lost connection to the ftp server")
+
+            assembly_lines = []
+            try:
+                with timed('summary_fetch') as t:
+                    fetcher.ftp.retrlines("RETR {}/assembly_summary.txt".format(genomedir), assembly_lines.append)
+                    t.bytes = sum(len(line) + 1 for line in assembly_lines)
+
+            except ftplib.error_perm as e:
+                self.logger.exception("Perm FTP error: " + str(e))
+                continue
+
+            fetcher.preload_taxonomy(assembly_lines)
+
+            for line in assembly_lines:
+                if line.startswith("#"):
+                    continue
+
+                assembly = fetcher.map_summary(line)
+                if not fetcher.wanted_assembly(assembly):
+                    continue
+
+                if not assembly['ftp_path']:
+                    self.logger.error("No FTP path for genome {}/{}".format(genomedir, assembly['assembly_accession']))
+                    continue
+
+                self.queues['checksum'].put({'genome_name': genomedir,
+                                             'assembly': assembly,
+                                             'checksums': None})
+
+    #
+    # Queue the genomes from a sync plan, they already have
+    # their checksums
+    #
+    def discover_plan(self, plan_file):
+
+        with open(plan_file, 'r') as infile:
+            plan = json.load(infile)
+
+        self.logger.info("Executing sync plan {} from {}, {}".format(plan_file, plan['created'], plan['totals']))
+
+        taxids = set()
+        for genome in plan['genomes']:
+            taxids.add(genome['assembly']['taxid'])
+            taxids.add(genome['assembly']['species_taxid'])
+        Taxonomy.load_batch(taxids)
+
+        for genome in plan['genomes']:
+            self.queues['checksum'].put({'genome_name': genome['genome_name'],
+                                         'assembly': genome['assembly'],
+                                         'checksums': genome['checksums']})
+
+    #
+    # The loop each worker thread runs, take a genome from the
+    # stage's queue, run the stage and pass it on to the next
+    # stage it needs
+    #
+    def worker(self, stage, fetcher):
+
+        handler = getattr(self, 'run_' + stage)
+        queue = self.queues[stage]
+
+        while True:
+            job = queue.get()
+
+            # Shutdown
+            if job is None:
+                break
+
+            try:
+                if stage in ftp_stages and not fetcher.check_and_reconnect():
+                    raise Exception("Lost connection to the ftp server")
+
+                accession = job['assembly']['assembly_accession']
+                with sql_genome(accession), profiled(accession, stage):
+                    to_stage = handler(fetcher, job)
+
+                with self.lock:
+                    self.counts[stage] += 1
+
+                if to_stage:
+                    self.queues[to_stage].put(job)
+
+            except Exception as e:
+                self.logger.exception("Error in stage {} for genome {}/{}".format(stage, job['genome_name'], job['assembly']['assembly_accession']))
+
+                with self.lock:
+                    self.errors[stage] += 1
+
+            finally:
+                # Objects can't be shared between sessions, each stage
+                # looks up the GP again in its own
+                remove_session()
+
+        if fetcher is not self.fetcher:
+            try:
+                fetcher.ftp.quit()
+            except Exception:
+                pass
+
+    #
+    # Decide what needs to be done for the genome, create the new GP
+    # if needed and send it to the stage after the last one it reached
+    #
+    def run_checksum(self, fetcher, job):
+
+        gp, state, job['checksums'] = fetcher.prepare_genome(job['genome_name'], job['assembly'], job['checksums'])
+
+        if not gp:
+            return None
+
+        job['gpv_id'] = gp.gpv_id
+        job['state'] = state
+
+        if state == 'clone':
+            return 'load'
+
+        return next_stage(state)
+
+    def run_download(self, fetcher, job):
+        gp = fetch_gp(job['gpv_id'])
+
+        if job['checksums'] is None:
+            job['checksums'] = fetcher.fetch_checksums(job['assembly'])
+
+        job['files'] = fetcher.download_files(gp, urlparse(job['assembly']['ftp_path']).path, job['checksums'])
+
+        return 'decompress'
+
+    def run_decompress(self, fetcher, job):
+        gp = fetch_gp(job['gpv_id'])
+
+        fetcher.decompress_files(gp, job.pop('files', []))
+
+        return 'parse'
+
+    def run_parse(self, fetcher, job):
+        gp = fetch_gp(job['gpv_id'])
+
+        self.logger.info("Parsing genbank file for gp {}".format(gp.gpv_id))
+
+        if not self.parse_pool:
+            fetcher.parse_replicons(gp)
+            return 'load'
+
+        try:
+            records = self.parse_pool.apply_async(parse_genome, (gp.gpv_id,)).get(self.parse_timeout)
+        except multiprocessing.TimeoutError:
+            raise Exception("Parsing gpv_id {} took longer than {} seconds".format(gp.gpv_id, self.parse_timeout))
+
+        metrics = getMetrics()
+        for record in records:
+            metrics.record(*record)
+
+        replicons = fetch_session().query(Replicon).filter(Replicon.gpv_id == gp.gpv_id).all()
+        fetcher.index_proteins(microbedb.protein_index.index_genome, gp, replicons)
+
+        return 'load'
+
+    def run_load(self, fetcher, job):
+        gp = fetch_gp(job['gpv_id'])
+
+        if job['state'] == 'clone':
+            fetcher.copy_genome(gp)
+            return None
+
+        if ingest_states.index(job['state']) < ingest_states.index('loaded'):
+            fetcher.load_meta(gp)
+
+        GenomeProject_Ingest.set_state(gp.gpv_id, 'linked')
+
+        return None
+
+'''
+Start the processes the parse stage hands its genomes to, for
+sync_pipeline's parse_pool.  They're forked, so this has to be
+called before anything starts a thread (the logging queue, the
+metrics textfile) or opens a database connection.
+'''
+def start_parse_pool(workers=None):
+    cfg = microbedb.config_singleton.getConfig()
+
+    workers = int(workers or cfg.get('pipeline_parse_workers', default_workers['parse']))
+
+    return multiprocessing.Pool(workers, init_parse_process)
+
+# The fetcher a parse process parses with
+parse_fetcher = None
+
+#
+# Set up a parse process, it makes its own database connections,
+# writes its own log records and leaves the ftp connection and
+# protein index to the parent
+#
+def init_parse_process():
+    global parse_fetcher
+
+    cfg = microbedb.config_singleton.getConfig()
+
+    reset_engine()
+    initLogger(default_path=cfg.logger_cfg, queue=False)
+    getMetrics().start_journal()
+
+    parse_fetcher = ncbi_fetcher(index_inline=False, connect=False)
+
+#
+# Parse a genome in a parse process, returns the stage
+# timings recorded since the last genome
+#
+def parse_genome(gpv_id):
+
+    try:
+        parse_fetcher.parse_replicons(fetch_gp(gpv_id))
+
+    except Exception as e:
+        # Sent back as a plain exception, not everything
+        # raised (e.g. by the database driver) can be pickled
+        raise Exception("{}: {}".format(type(e).__name__, e))
+
+    finally:
+        remove_session()
+
+    return getMetrics().drain()
+
+#
+# The stage that picks up a genome which has reached
+# the given ingest state
+#
+def next_stage(state):
+
+    if state in ['planned', 'downloading']:
+        return 'download'
+
+    if state == 'downloaded':
+        return 'parse'
+
+    return 'load'
+
+#
+# Look up a GP in the calling thread's session
+#
+def fetch_gp(gpv_id):
+    session = fetch_session()
+
+    gp = session.query(GenomeProject).filter(GenomeProject.gpv_id == gpv_id).first()
+
+    if not gp:
+        raise Exception("GenomeProject {} not found".format(gpv_id))
+
+    return gp
@@ -0,0 +1,300 @@
+'''
+Library to profile the CPU and memory use of MicrobeDB's scripts
+
+When enabled, each stage of work on a genome (the whole genome in a
+serial update, each pipeline stage, removing a genome) is run under
+its own cProfile profiler and/or has the memory it allocates traced.
+The profiles are added up per stage and written at the end of the
+run, to the version's profile directory by default:
+
+    <stage>.pstats            - for pstats, snakeviz, gprof2dot...
+    <stage>_allocations.txt   - top allocation sites (tracemalloc)
+    profile_summary.txt       - top functions by cumulative time per stage
+
+Profiling every genome slows a run down, a sample of the genomes
+can be profiled instead (chosen by a hash of the genome, so every
+stage of a sampled genome is profiled).  With a threshold only
+genomes whose stage took at least that long are counted, and each
+also has its own profile written so the slow ones can be looked
+at individually.
+
+Memory is traced with tracemalloc where the Python has it, which
+traces the whole process so in the pipeline allocations made by
+other threads at the same time are counted too.  Without it the
+growth in the process' peak resident size is reported instead.
+'''
+
+import os
+import time
+import zlib
+import logging
+import threading
+import resource
+import cProfile
+import pstats
+from StringIO import StringIO
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+logger = logging.getLogger(__name__)
+
+class stage_profile():
+
+    def __init__(self):
+
+        self.count = 0
+        self.seconds = 0.0
+        self.stats = None
+        self.allocations = dict()
+        self.rss_growth = []
+
+    def add_cpu(self, profile):
+
+        if self.stats is None:
+            self.stats = pstats.Stats(profile)
+        else:
+            self.stats.add(profile)
+
+    #
+    # Allocation sites from a tracemalloc snapshot
+    # comparison, summed over every genome
+    #
+    def add_allocations(self, differences):
+
+        for diff in differences:
+            if diff.size_diff <= 0:
+                continue
+
+            site = str(diff.traceback)
+            size, count = self.allocations.get(site, (0, 0))
+            self.allocations[site] = (size + diff.size_diff, count + diff.count_diff)
+
+class profiler():
+
+    def __init__(self):
+
+        self.lock = threading.Lock()
+        self.stages = dict()
+        self.cpu = False
+        self.memory = False
+        self.directory = None
+        self.sample = 1.0
+        self.threshold = 0.0
+        self.top = 25
+
+    @property
+    def enabled(self):
+        return self.cpu or self.memory
+
+    '''
+    Turn profiling on, cpu for cProfile and memory for
+    tracemalloc, of a sample (0-1) of the genomes taking
+    at least threshold seconds, written to directory
+    '''
+    def configure(self, directory, cpu=False, memory=False, sample=1.0, threshold=0.0, top=25):
+
+        self.directory = directory
+        self.cpu = cpu
+        self.memory = memory
+        self.sample = sample
+        self.threshold = threshold
+        self.top = top
+
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        if memory:
+            if tracemalloc:
+                tracemalloc.start()
+            else:
+                logger.warning("tracemalloc isn't available in this Python, only reporting the growth in peak memory")
+
+        logger.info("Profiling cpu: {}, memory: {}, sample: {}, threshold: {}s, writing to {}".format(cpu, memory, sample, threshold, directory))
+
+    '''
+    Is a genome in the sample being profiled, every
+    stage of a genome gets the same answer
+    '''
+    def sampled(self, genome):
+
+        if self.sample >= 1.0:
+            return True
+
+        return (zlib.crc32(str(genome)) & 0xffffffff) % 10000 < self.sample * 10000
+
+    def record(self, genome, stage, seconds, profile=None, differences=None, rss_growth=None):
+
+        # Too quick to be interesting
+        if seconds < self.threshold:
+            return
+
+        with self.lock:
+            if stage not in self.stages:
+                self.stages[stage] = stage_profile()
+
+            s = self.stages[stage]
+            s.count += 1
+            s.seconds += seconds
+
+            if profile:
+                s.add_cpu(profile)
+            if differences:
+                s.add_allocations(differences)
+            if rss_growth is not None:
+                s.rss_growth.append((rss_growth, genome))
+
+        # The slow ones get their own profile to look at
+        if self.threshold and profile:
+            profile.dump_stats(os.path.join(self.directory, "{}.{}.pstats".format(safe_name(genome), stage)))
+
+    '''
+    Write out the profiles and allocations for each stage and a
+    summary of them, returns the summary file name
+    '''
+    def write_report(self):
+
+        summary_file = os.path.join(self.directory, 'profile_summary.txt')
+
+        with self.lock:
+            with open(summary_file, 'w') as summary:
+                for stage in sorted(self.stages):
+                    s = self.stages[stage]
+                    summary.write("Stage {}: {} profiled, {:.3f}s\n\n".format(stage, s.count, s.seconds))
+
+                    if s.stats:
+                        s.stats.dump_stats(os.path.join(self.directory, "{}.pstats".format(stage)))
+
+                        # pstats only prints to a stream
+                        out = StringIO()
+                        s.stats.stream = out
+                        s.stats.sort_stats('cumulative').print_stats(self.top)
+                        summary.write(out.getvalue() + "\n")
+
+                    if s.allocations:
+                        lines = self.allocation_lines(s.allocations)
+                        with open(os.path.join(self.directory, "{}_allocations.txt".format(stage)), 'w') as outfile:
+                            outfile.write("\n".join(lines) + "\n")
+
+                        summary.write("Top allocation sites:\n" + "\n".join(lines) + "\n\n")
+
+                    if s.rss_growth:
+                        summary.write("Largest growth in peak resident size:\n")
+                        for growth, genome in sorted(s.rss_growth, reverse=True)[:self.top]:
+                            summary.write("{:>12} KB  {}\n".format(growth, genome))
+                        summary.write("\n")
+
+        logger.info("Wrote profiles to {}".format(self.directory))
+
+        return summary_file
+
+    def allocation_lines(self, allocations):
+
+        ordered = sorted(allocations.items(), key=lambda item: item[1][0], reverse=True)[:self.top]
+
+        return ["{:>12.1f} KB {:>10} blocks  {}".format(size / 1024.0, count, site) for site, (size, count) in ordered]
+
+#
+# Genome names end up in file names
+#
+def safe_name(genome):
+    return "".join(c if c.isalnum() or c in '._-' else '_' for c in str(genome))
+
+profiles = profiler()
+
+'''
+Fetch the profiler shared by the whole process
+'''
+def getProfiler():
+    return profiles
+
+#
+# Profile a stage of work on a genome, if profiling is
+# on and the genome is in the sample, e.g.
+#
+#   with profiled(assembly['assembly_accession'], 'download'):
+#       ...
+#
+class profiled():
+
+    def __init__(self, genome, stage='genome'):
+        self.genome = genome
+        self.stage = stage
+        self.active = False
+
+    def __enter__(self):
+
+        if not profiles.enabled or not profiles.sampled(self.genome):
+            return self
+
+        self.active = True
+        self.profile = None
+        self.snapshot = None
+
+        if profiles.memory:
+            if tracemalloc:
+                self.snapshot = tracemalloc.take_snapshot()
+            else:
+                self.rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        if profiles.cpu:
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+
+        self.start = time.time()
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+
+        if not self.active:
+            return False
+
+        seconds = time.time() - self.start
+
+        if self.profile:
+            self.profile.disable()
+
+        differences = None
+        rss_growth = None
+        if profiles.memory:
+            if self.snapshot:
+                differences = tracemalloc.take_snapshot().compare_to(self.snapshot, 'lineno')
+            else:
+                rss_growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - self.rss
+
+        profiles.record(self.genome, self.stage, seconds, self.profile, differences, rss_growth)
+
+        return False
+
+'''
+Add the profiling options to a script's argument parser
+'''
+def add_arguments(parser):
+
+    parser.add_argument('--profile', action='store_true', default=False, dest='profile', help='Profile the cpu use of each stage with cProfile', required=False)
+    parser.add_argument('--memprofile', action='store_true', default=False, dest='memprofile', help='Profile the memory allocated by each stage with tracemalloc', required=False)
+    parser.add_argument('--profile-dir', dest='profile_dir', default=None, help='Directory to write the profiles to', required=False)
+    parser.add_argument('--profile-sample', dest='profile_sample', type=float, default=1.0, help='Fraction of genomes to profile (default: 1, all)', required=False)
+    parser.add_argument('--profile-threshold', dest='profile_threshold', type=float, default=0.0, help='Only profile stages taking at least this many seconds, and write a profile for each', required=False)
+    parser.add_argument('--profile-top', dest='profile_top', type=int, default=25, help='Functions and allocation sites to report per stage (default: 25)', required=False)
+
+'''
+Configure the profiler from a script's options, profiles are
+written to the directory given in the options or default_dir
+'''
+def configure_from_options(opts, default_dir):
+
+    if not opts.profile and not opts.memprofile:
+        return None
+
+    profiles.configure(opts.profile_dir or default_dir,
+                       cpu=opts.profile,
+                       memory=opts.memprofile,
+                       sample=opts.profile_sample,
+                       threshold=opts.profile_threshold,
+                       top=opts.profile_top)
+
+    return profiles
@@ -0,0 +1,378 @@
+'''
+Library for the per version index of protein accessions
+
+Each version has a SQLite file in its dl_directory that maps every
+protein_id (e.g. WP_000001.1) to the replicon it's on and where its
+record is in the replicon's .faa.  The index is filled in as genomes
+are parsed (ncbi_fetcher.parse_replicons) and carried over from the
+previous version's index when a genome is cloned, so finding the
+sequences of many proteins is a few indexed lookups and a read of
+each record rather than a scan of the genomes' protein files, e.g.
+
+    from microbedb.protein_index import fetch_proteins
+
+    records = fetch_proteins(['WP_000001.1', 'WP_000002'])
+
+Accessions can be given with or without their .version.  The same
+protein (WP_ accessions are shared between genomes) is found on
+every replicon it's on, fetch_proteins reads it from the first.
+
+Versions made before the index existed, or built by workers
+sharing an update across nodes (see microbedb.shard), are indexed
+with build_index() in a single process.
+'''
+
+import os
+import sqlite3
+import logging
+import threading
+from collections import namedtuple
+from microbedb.fileutils import fasta_offsets
+
+logger = logging.getLogger(__name__)
+
+index_filename = 'microbedb_proteins.sqlite'
+
+protein_location = namedtuple('protein_location', ['protein_id', 'gpv_id', 'rpv_id', 'rep_accnum', 'file', 'offset', 'length'])
+
+# How many accessions are sent in each IN (...) lookup
+lookup_batch_size = 500
+
+schema = ['''CREATE TABLE IF NOT EXISTS replicon_file (
+                 rpv_id INTEGER PRIMARY KEY,
+                 gpv_id INTEGER NOT NULL,
+                 rep_accnum TEXT,
+                 file TEXT NOT NULL)''',
+          '''CREATE INDEX IF NOT EXISTS replicon_file_gpv_id ON replicon_file (gpv_id)''',
+          '''CREATE TABLE IF NOT EXISTS protein (
+                 accession TEXT NOT NULL,
+                 version INTEGER,
+                 rpv_id INTEGER NOT NULL,
+                 offset INTEGER NOT NULL,
+                 length INTEGER NOT NULL,
+                 PRIMARY KEY (accession, rpv_id)) WITHOUT ROWID''',
+          '''CREATE INDEX IF NOT EXISTS protein_rpv_id ON protein (rpv_id)''']
+
+class protein_index():
+
+    def __init__(self, path, create=True):
+
+        if not create and not os.path.exists(path):
+            raise Exception("There's no protein index {}".format(path))
+
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=60)
+
+        # Genomes are indexed by several threads of one process at
+        # once, WAL needs every writer on the same host so workers
+        # sharing an update across nodes leave the index to --finish
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+
+        if create:
+            with self.conn:
+                for statement in schema:
+                    self.conn.execute(statement)
+
+    def __str__(self):
+        return "protein_index(): {}".format(self.path)
+
+    '''
+    Index the proteins in a replicon's .faa file,
+    replacing anything indexed for it before
+
+    Returns the number of proteins indexed
+    '''
+    def add_replicon(self, gpv_id, rpv_id, rep_accnum, faa_file):
+
+        rows = []
+        for record_id, offset, length in fasta_offsets(faa_file):
+            for protein_id in header_proteins(record_id):
+                accession, version = split_accession(protein_id)
+                rows.append((accession, version, rpv_id, offset, length))
+
+        with self.conn:
+            self.conn.execute("DELETE FROM protein WHERE rpv_id = ?", (rpv_id,))
+            self.conn.execute("INSERT OR REPLACE INTO replicon_file (rpv_id, gpv_id, rep_accnum, file) VALUES (?, ?, ?, ?)",
+                              (rpv_id, gpv_id, rep_accnum, faa_file))
+
+            # A protein repeated in a replicon is found at its first copy
+            self.conn.executemany("INSERT OR IGNORE INTO protein (accession, version, rpv_id, offset, length) VALUES (?, ?, ?, ?, ?)", rows)
+
+        return len(rows)
+
+    '''
+    Drop everything indexed for a genome
+    '''
+    def remove_genome(self, gpv_id):
+
+        with self.conn:
+            self.conn.execute("DELETE FROM protein WHERE rpv_id IN (SELECT rpv_id FROM replicon_file WHERE gpv_id = ?)", (gpv_id,))
+            self.conn.execute("DELETE FROM replicon_file WHERE gpv_id = ?", (gpv_id,))
+
+    '''
+    Copy a cloned genome's proteins from the index of the version
+    it was cloned from, the files are the same (the genome's
+    directory is a symlink) but the ids and paths are new.
+
+    replicons is a dict of rep_accnum to the clone's rpv_id,
+    returns the number of proteins copied
+    '''
+    def copy_genome(self, source, old_gpv_id, gpv_id, gpv_directory, replicons):
+
+        count = 0
+        with self.conn:
+            self.conn.execute("DELETE FROM protein WHERE rpv_id IN (SELECT rpv_id FROM replicon_file WHERE gpv_id = ?)", (gpv_id,))
+            self.conn.execute("DELETE FROM replicon_file WHERE gpv_id = ?", (gpv_id,))
+
+            for old_rpv_id, rep_accnum, old_file in source.conn.execute("SELECT rpv_id, rep_accnum, file FROM replicon_file WHERE gpv_id = ?", (old_gpv_id,)).fetchall():
+                rpv_id = replicons.get(rep_accnum)
+                if not rpv_id:
+                    continue
+
+                self.conn.execute("INSERT OR REPLACE INTO replicon_file (rpv_id, gpv_id, rep_accnum, file) VALUES (?, ?, ?, ?)",
+                                  (rpv_id, gpv_id, rep_accnum, os.path.join(gpv_directory, os.path.basename(old_file))))
+
+                rows = source.conn.execute("SELECT accession, version, ?, offset, length FROM protein WHERE rpv_id = ?", (rpv_id, old_rpv_id)).fetchall()
+                self.conn.executemany("INSERT OR IGNORE INTO protein (accession, version, rpv_id, offset, length) VALUES (?, ?, ?, ?, ?)", rows)
+                count += len(rows)
+
+        return count
+
+    '''
+    Drop everything in the index
+    '''
+    def clear(self):
+
+        with self.conn:
+            self.conn.execute("DELETE FROM protein")
+            self.conn.execute("DELETE FROM replicon_file")
+
+    '''
+    Is anything indexed for a genome
+    '''
+    def has_genome(self, gpv_id):
+        return self.conn.execute("SELECT 1 FROM replicon_file WHERE gpv_id = ? LIMIT 1", (gpv_id,)).fetchone() is not None
+
+    '''
+    Find many proteins at once, by accession with or without
+    the .version
+
+    Returns a dict of the protein ids asked for to the list of
+    protein_locations they're found at, ids not in the index
+    are left out
+    '''
+    def lookup(self, protein_ids):
+
+        wanted = dict()
+        for protein_id in protein_ids:
+            accession, version = split_accession(protein_id)
+            wanted.setdefault(accession, []).append((protein_id, version))
+
+        accessions = sorted(wanted)
+        found = dict()
+
+        for i in range(0, len(accessions), lookup_batch_size):
+            chunk = accessions[i:i + lookup_batch_size]
+            query = "SELECT p.accession, p.version, f.gpv_id, p.rpv_id, f.rep_accnum, f.file, p.offset, p.length " \
+                    "FROM protein p JOIN replicon_file f ON p.rpv_id = f.rpv_id " \
+                    "WHERE p.accession IN ({}) ORDER BY p.rpv_id".format(",".join("?" * len(chunk)))
+
+            for accession, version, gpv_id, rpv_id, rep_accnum, path, offset, length in self.conn.execute(query, chunk):
+                for protein_id, wanted_version in wanted[accession]:
+                    if wanted_version is not None and wanted_version != version:
+                        continue
+
+                    location = protein_location(join_accession(accession, version), gpv_id, rpv_id, rep_accnum, path, offset, length)
+                    found.setdefault(protein_id, []).append(location)
+
+        return found
+
+    '''
+    Fetch the fasta records of many proteins at once,
+    reading each file once in offset order
+
+    A protein on several replicons is read from the first
+    whose file can be read
+
+    Returns a dict of the protein ids asked for to their
+    fasta record, ids not in the index (or in no readable
+    file) are left out
+    '''
+    def fetch(self, protein_ids):
+
+        pending = self.lookup(protein_ids)
+        records = dict()
+        unreadable = set()
+
+        while pending:
+            by_file = dict()
+            for protein_id, locations in pending.items():
+                for location in locations:
+                    if location.file not in unreadable:
+                        by_file.setdefault(location.file, []).append((location.offset, location.length, protein_id))
+                        break
+
+            if not by_file:
+                break
+
+            for path, wanted in by_file.items():
+                try:
+                    with open(path, 'rb') as infile:
+                        for offset, length, protein_id in sorted(wanted):
+                            infile.seek(offset)
+                            records[protein_id] = infile.read(length)
+
+                except IOError as e:
+                    logger.error("Can't read proteins from %s: %s", path, e)
+                    unreadable.add(path)
+
+            pending = dict((protein_id, locations) for protein_id, locations in pending.items() if protein_id not in records)
+
+        return records
+
+    def close(self):
+        self.conn.close()
+
+#
+# The protein ids in a per replicon .faa header,
+# e.g. gi|1234|ref|WP_000001.1|locus|ABC_0001|:1..300
+#
+def header_proteins(record_id):
+    fields = record_id.split('|')
+
+    return [fields[i + 1] for i in range(len(fields) - 1) if fields[i] == 'ref' and fields[i + 1]]
+
+def split_accession(protein_id):
+    accession, _, version = protein_id.partition('.')
+
+    return accession, int(version) if version.isdigit() else None
+
+def join_accession(accession, version):
+    return "{}.{}".format(accession, version) if version is not None else accession
+
+# Each thread (and process) keeps its own
+# connection to the indexes it writes to
+open_indexes = threading.local()
+
+'''
+The index in a version's directory, opened once per thread
+'''
+def open_index(directory, create=True):
+
+    if getattr(open_indexes, 'pid', None) != os.getpid():
+        open_indexes.pid = os.getpid()
+        open_indexes.indexes = dict()
+
+    path = os.path.join(directory, index_filename)
+    if path not in open_indexes.indexes:
+        open_indexes.indexes[path] = protein_index(path, create=create)
+
+    return open_indexes.indexes[path]
+
+'''
+The index for a version (a number, current or latest)
+'''
+def version_index(version='current', create=False):
+    from microbedb.models import Version
+
+    path = Version.fetch_path(version)
+    if not path:
+        raise Exception("Can't find the directory for version {}".format(version))
+
+    return open_index(path, create=create)
+
+'''
+Find where many proteins are in a version, see protein_index.lookup
+'''
+def lookup_proteins(protein_ids, version='current'):
+    return version_index(version).lookup(protein_ids)
+
+'''
+Fetch the fasta records of many proteins in a
+version, see protein_index.fetch
+'''
+def fetch_proteins(protein_ids, version='current'):
+    return version_index(version).fetch(protein_ids)
+
+'''
+Index the proteins of every replicon of a genome, the replicons'
+.faa files must already have been written (separate_genbank)
+'''
+def index_genome(gp, replicons):
+
+    index = version_index(gp.version_id, create=True)
+    index.remove_genome(gp.gpv_id)
+
+    count = 0
+    for rep in replicons:
+        faa_file = os.path.join(gp.gpv_directory, rep.file_name) + '.faa'
+        if os.path.exists(faa_file):
+            count += index.add_replicon(gp.gpv_id, rep.rpv_id, rep.rep_accnum, faa_file)
+
+    logger.debug("Indexed %s proteins for gpv_id %s", count, gp.gpv_id)
+
+    return count
+
+'''
+Carry a cloned genome's proteins over from the index of the
+version it was cloned from, indexing its files if that version
+has no index (or nothing for the genome)
+'''
+def clone_genome(gp, old_gpv_id, old_version, replicons):
+
+    index = version_index(gp.version_id, create=True)
+
+    try:
+        source = version_index(old_version)
+    except Exception:
+        source = None
+
+    if source and source.has_genome(old_gpv_id):
+        count = index.copy_genome(source, old_gpv_id, gp.gpv_id, gp.gpv_directory,
+                                  dict((rep.rep_accnum, rep.rpv_id) for rep in replicons))
+        logger.debug("Copied %s proteins for gpv_id %s from gpv_id %s", count, gp.gpv_id, old_gpv_id)
+        return count
+
+    return index_genome(gp, replicons)
+
+'''
+Drop a genome from its version's index, if
+the version has one
+'''
+def remove_genome(gpv_id, version):
+
+    try:
+        index = version_index(version)
+    except Exception:
+        return
+
+    index.remove_genome(gpv_id)
+
+'''
+(Re)build the index for a whole version from the replicons'
+.faa files, for versions made before the index existed
+
+Returns the number of proteins indexed
+'''
+def build_index(version='current'):
+    import microbedb.query as query
+
+    index = version_index(version, create=True)
+    index.clear()
+
+    directories = dict((gp.gpv_id, gp.gpv_directory) for gp in query.genomes(version=version, stream=True))
+
+    count = 0
+    for rep in query.replicons(version=version, stream=True):
+        faa_file = os.path.join(directories.get(rep.gpv_id, ''), rep.file_name or '') + '.faa'
+
+        if not os.path.exists(faa_file):
+            logger.warning("No protein file for replicon %s, %s", rep.rpv_id, faa_file)
+            continue
+
+        count += index.add_replicon(rep.gpv_id, rep.rpv_id, rep.rep_accnum, faa_file)
+
+    logger.info("Indexed %s proteins for version %s", count, version)
+
+    return count
@@ -0,0 +1,277 @@
+'''
+Library for reading MicrobeDB from pipelines without the ORM
+
+Every lookup is a plain Core SELECT and the rows come back as
+lightweight namedtuple records (genome_record, replicon_record,
+file_record) rather than ORM objects, so there's no session state,
+lazy loading or identity map to pay for.  Lookups of many keys
+(gpv_ids, accessions) are sent in batches of IN queries rather
+than one query per key.
+
+The functions returning every matching row take stream=True to
+return a generator instead of a list, the rows are then fetched
+from the database in batches (through a server side cursor on
+MySQL, see microbedb.models.stream_rows) so iterating over the
+whole catalogue uses constant memory, e.g.
+
+    from microbedb.query import genomes, replicons_for_genomes
+
+    for gp in genomes(version='current', stream=True):
+        ...
+
+    reps = replicons_for_genomes([1, 2, 3], rep_type='chromosome')
+'''
+
+import os
+import logging
+from collections import namedtuple
+from sqlalchemy import select, and_, or_
+from .models import *
+from .models import Base, init_engine, stream_rows
+from .models.taxonomy import valid_ranks
+
+logger = logging.getLogger(__name__)
+
+tables = Base.metadata.tables
+
+version_record = namedtuple('version_record', [c.name for c in tables['version'].columns])
+genome_record = namedtuple('genome_record', [c.name for c in tables['genomeproject'].columns])
+replicon_record = namedtuple('replicon_record', [c.name for c in tables['replicon'].columns])
+taxonomy_record = namedtuple('taxonomy_record', [c.name for c in tables['taxonomy'].columns])
+
+'''
+Where a replicon's files are, file_types is the list
+of extensions written for it, e.g. '.faa .gbk'
+'''
+class file_record(namedtuple('file_record', ['rep_accnum', 'rpv_id', 'gpv_id', 'version_id', 'gpv_directory', 'file_name', 'file_types'])):
+    __slots__ = ()
+
+    @property
+    def path(self):
+        return os.path.join(self.gpv_directory, self.file_name)
+
+    '''
+    The path to one of the replicon's files, by
+    extension, None if it wasn't written
+    '''
+    def file(self, ext):
+        if ext not in self.extensions():
+            return None
+
+        return self.path + ext
+
+    def extensions(self):
+        return (self.file_types or '').split()
+
+# How many keys are sent in each IN (...) lookup
+lookup_batch_size = 500
+
+'''
+Fetch every version of MicrobeDB, oldest first
+
+Returns a list of version_records
+'''
+def versions():
+    version = tables['version']
+
+    return run_query(select(list(version.columns)).order_by(version.c.version_id), version_record)
+
+'''
+Fetch the genomes for a version, optionally only those
+of a taxon or with a replicon of the given rep_type.
+
+taxon is matched against the genomes' taxid and species_taxid,
+or with rank (e.g. 'genus', 'family') against that rank's name
+in the taxonomy table, e.g. genomes(taxon='Escherichia', rank='genus')
+
+Returns a list of genome_records, or a generator of them with stream=True
+'''
+def genomes(version='current', taxon=None, rank=None, rep_type=None, stream=False, batch_size=5000):
+    gp = tables['genomeproject']
+
+    conditions = [gp.c.version_id == Version.fetch(version)]
+
+    if taxon is not None:
+        conditions.append(taxon_condition(taxon, rank))
+
+    if rep_type:
+        rep = tables['replicon']
+        conditions.append(gp.c.gpv_id.in_(select([rep.c.gpv_id]).where(rep.c.rep_type == rep_type)))
+
+    query = select(list(gp.columns)).where(and_(*conditions)).order_by(gp.c.gpv_id)
+
+    return run_query(query, genome_record, stream, batch_size)
+
+'''
+Fetch the genomes of a taxon, see genomes()
+'''
+def genomes_by_taxon(taxon, version='current', rank=None, stream=False):
+    return genomes(version=version, taxon=taxon, rank=rank, stream=stream)
+
+'''
+Fetch the genomes with at least one replicon of
+rep_type (chromosome, plasmid, contig), see genomes()
+'''
+def genomes_by_rep_type(rep_type, version='current', stream=False):
+    return genomes(version=version, rep_type=rep_type, stream=stream)
+
+'''
+Fetch the replicons for a version, optionally only
+those of rep_type
+
+Returns a list of replicon_records, or a generator of them with stream=True
+'''
+def replicons(version='current', rep_type=None, stream=False, batch_size=5000):
+    rep = tables['replicon']
+
+    conditions = [rep.c.version_id == Version.fetch(version)]
+    if rep_type:
+        conditions.append(rep.c.rep_type == rep_type)
+
+    query = select(list(rep.columns)).where(and_(*conditions)).order_by(rep.c.rpv_id)
+
+    return run_query(query, replicon_record, stream, batch_size)
+
+'''
+Fetch the replicons of many genomes at once, optionally
+only those of rep_type and/or in version
+
+Returns a dict of gpv_id to the list of its replicon_records,
+gpv_ids with no replicons (in version) are left out
+'''
+def replicons_for_genomes(gpv_ids, rep_type=None, version=None):
+    rep = tables['replicon']
+
+    found = dict()
+    for chunk in batches(sorted(set(int(g) for g in gpv_ids))):
+        conditions = [rep.c.gpv_id.in_(chunk)]
+        if rep_type:
+            conditions.append(rep.c.rep_type == rep_type)
+        if version is not None:
+            conditions.append(rep.c.version_id == Version.fetch(version))
+
+        query = select(list(rep.columns)).where(and_(*conditions)).order_by(rep.c.rpv_id)
+
+        for record in run_query(query, replicon_record):
+            found.setdefault(record.gpv_id, []).append(record)
+
+    return found
+
+'''
+Find the files for many replicons of a version at once, by
+accession (with or without the .version, e.g. NC_000913 or
+NC_000913.3)
+
+Returns a dict of the accessions asked for to their file_records,
+accessions not in the version are left out
+'''
+def replicon_paths(rep_accnums, version='current'):
+    gp = tables['genomeproject']
+    rep = tables['replicon']
+
+    version = Version.fetch(version)
+
+    # Replicons are stored without the .version
+    wanted = dict()
+    for accession in rep_accnums:
+        wanted.setdefault(accession.split('.')[0], []).append(accession)
+
+    columns = [rep.c.rep_accnum, rep.c.rpv_id, rep.c.gpv_id, rep.c.version_id,
+               gp.c.gpv_directory, rep.c.file_name, rep.c.file_types]
+
+    found = dict()
+    for chunk in batches(sorted(wanted)):
+        query = select(columns) \
+            .select_from(rep.join(gp, rep.c.gpv_id == gp.c.gpv_id)) \
+            .where(and_(rep.c.version_id == version, rep.c.rep_accnum.in_(chunk)))
+
+        for record in run_query(query, file_record):
+            for accession in wanted[record.rep_accnum]:
+                found[accession] = record
+
+    return found
+
+'''
+Find the genomes of a version for many assembly accessions
+(e.g. GCF_000005845.2) at once
+
+Returns a dict of assembly_accession to genome_record,
+accessions not in the version are left out
+'''
+def genomes_by_accession(assembly_accessions, version='current'):
+    gp = tables['genomeproject']
+
+    version = Version.fetch(version)
+
+    found = dict()
+    for chunk in batches(sorted(set(assembly_accessions))):
+        query = select(list(gp.columns)) \
+            .where(and_(gp.c.version_id == version, gp.c.assembly_accession.in_(chunk)))
+
+        for record in run_query(query, genome_record):
+            found[record.assembly_accession] = record
+
+    return found
+
+'''
+Fetch the lineages of many taxids at once
+
+Returns a dict of taxon_id to taxonomy_record, taxids
+not in the taxonomy table are left out
+'''
+def lineages(taxids):
+    tax = tables['taxonomy']
+
+    found = dict()
+    for chunk in batches(sorted(set(int(t) for t in taxids))):
+        for record in run_query(select(list(tax.columns)).where(tax.c.taxon_id.in_(chunk)), taxonomy_record):
+            found[record.taxon_id] = record
+
+    return found
+
+#
+# Match genomes to a taxid, or to a name at a rank
+# of their lineage
+#
+def taxon_condition(taxon, rank=None):
+    gp = tables['genomeproject']
+
+    if not rank:
+        return or_(gp.c.taxid == int(taxon), gp.c.species_taxid == int(taxon))
+
+    if rank not in valid_ranks:
+        raise Exception("Unknown taxonomic rank {}, expected one of {}".format(rank, ", ".join(valid_ranks)))
+
+    # class is stored as tax_class
+    tax = tables['taxonomy']
+    column = tax.c['tax_class' if rank == 'class' else rank]
+
+    return gp.c.taxid.in_(select([tax.c.taxon_id]).where(column == taxon))
+
+#
+# Run a Core select, either all at once in to a list or as
+# a generator streaming the rows in batches
+#
+def run_query(query, record, stream=False, batch_size=5000):
+
+    if stream:
+        return stream_records(query, record, batch_size)
+
+    conn = init_engine().connect()
+
+    try:
+        return [record(*row) for row in conn.execute(query)]
+    finally:
+        conn.close()
+
+def stream_records(query, record, batch_size):
+
+    for rows in stream_rows(query, batch_size):
+        for row in rows:
+            yield record(*row)
+
+def batches(keys, size=None):
+    size = size or lookup_batch_size
+
+    for i in range(0, len(keys), size):
+        yield keys[i:i + size]
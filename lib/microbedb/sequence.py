@@ -0,0 +1,274 @@
+'''
+Library to fetch a window of a replicon's sequence without
+reading the whole replicon
+
+The replicon's .fna (written by fileutils.separate_genbank) is found
+through its Replicon and GenomeProject and indexed the way samtools
+faidx does, a .fai file beside it records where each record's
+sequence starts and how its lines are wrapped.  With that the byte
+range for any coordinates can be worked out directly and only those
+bytes are read, through mmap, so a lookup takes the same time
+whatever the size of the replicon, e.g.
+
+    from microbedb.sequence import get_sequence
+
+    seq = get_sequence('NC_000913', 10000, 20000, strand=-1)
+
+The index is written beside the .fna as the replicon is parsed
+during an update (index_fasta).  Failing that it's built the first
+time the replicon is looked up, and rebuilt if the .fna is newer.
+If the directory can't be written to the index is kept in memory
+only.
+'''
+
+import os
+import mmap
+import string
+import logging
+from collections import OrderedDict
+from microbedb.cache import lru_cache
+from microbedb.models import Version
+import microbedb.query as query
+
+logger = logging.getLogger(__name__)
+
+# IUPAC codes and their complements
+complements = string.maketrans('ACGTRYKMBVDHNacgtrykmbvdhn', 'TGCAYRMKVBHDNtgcayrmkvbhdn')
+
+# Indexes of recently used files, and the .fna file of
+# recently used replicons by (version_id, rep_accnum)
+index_cache = lru_cache(maxsize=1000)
+path_cache = lru_cache(maxsize=100000)
+
+class fasta_index():
+
+    def __init__(self, fasta_file):
+
+        self.fasta_file = fasta_file
+        self.index_file = fasta_file + '.fai'
+
+        # name -> (length, offset, line bases, line width)
+        self.records = OrderedDict()
+
+    def __str__(self):
+        return "fasta_index(): {}, {} records".format(self.fasta_file, len(self.records))
+
+    '''
+    Load the index from the .fai file, building it
+    if it's missing or older than the fasta file
+    '''
+    def load(self):
+
+        if os.path.exists(self.index_file) and os.path.getmtime(self.index_file) >= os.path.getmtime(self.fasta_file):
+            with open(self.index_file, 'r') as infile:
+                for line in infile:
+                    name, length, offset, line_bases, line_width = line.rstrip("\n").split("\t")[:5]
+                    self.records[name] = (int(length), int(offset), int(line_bases), int(line_width))
+
+            return self
+
+        self.build()
+
+        try:
+            self.write()
+        except (IOError, OSError) as e:
+            logger.debug("Can't write index %s, keeping it in memory: %s", self.index_file, e)
+
+        return self
+
+    '''
+    Scan the fasta file for where each record's sequence starts
+    and how it's wrapped, every line but the last of a record
+    must be the same length
+    '''
+    def build(self):
+        logger.debug("Indexing %s", self.fasta_file)
+
+        self.records = OrderedDict()
+        name = None
+        offset = 0
+
+        with open(self.fasta_file, 'rb') as infile:
+            for line in infile:
+                if line.startswith('>'):
+                    if name is not None:
+                        self.add(name, length, start, line_bases, line_width)
+
+                    name = line[1:].split()[0] if line[1:].strip() else ''
+                    start = offset + len(line)
+                    length = 0
+                    line_bases = line_width = None
+                    short_line = False
+
+                elif name is not None:
+                    bases = len(line.rstrip("\r\n"))
+
+                    if short_line and bases:
+                        raise Exception("Can't index {}, record {} has uneven line lengths".format(self.fasta_file, name))
+
+                    if line_bases is None:
+                        line_bases, line_width = bases, len(line)
+                    elif bases != line_bases:
+                        short_line = True
+
+                    length += bases
+
+                offset += len(line)
+
+        if name is not None:
+            self.add(name, length, start, line_bases, line_width)
+
+        return self
+
+    def add(self, name, length, offset, line_bases, line_width):
+        self.records[name] = (length, offset, line_bases or 0, line_width or 0)
+
+    #
+    # Written under a temporary name and moved in to place
+    # so a reader never sees a partial index
+    #
+    def write(self):
+
+        tmp_file = "{}.{}.tmp".format(self.index_file, os.getpid())
+        with open(tmp_file, 'w') as outfile:
+            for name, (length, offset, line_bases, line_width) in self.records.items():
+                outfile.write("{}\t{}\t{}\t{}\t{}\n".format(name, length, offset, line_bases, line_width))
+
+        os.rename(tmp_file, self.index_file)
+
+    '''
+    Find a record by name, or by accession without the .version
+    '''
+    def find(self, name):
+
+        if name in self.records:
+            return name
+
+        accnum = name.split('.')[0]
+        for record in self.records:
+            if record.split('.')[0] == accnum:
+                return record
+
+        # A per replicon file only holds the one record
+        if len(self.records) == 1:
+            return self.records.keys()[0]
+
+        return None
+
+    '''
+    Read the bases start to end (0 based, end exclusive)
+    of a record, only the bytes holding them are read
+    '''
+    def fetch(self, name, start, end):
+
+        length, offset, line_bases, line_width = self.records[name]
+
+        # A record with no sequence has no line length either
+        end = min(end, length)
+        if start >= end:
+            return ''
+
+        first = self.byte_offset(offset, line_bases, line_width, start)
+        last = self.byte_offset(offset, line_bases, line_width, end - 1) + 1
+
+        with open(self.fasta_file, 'rb') as infile:
+            mapped = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                data = mapped[first:last]
+            finally:
+                mapped.close()
+
+        return data.replace("\n", "").replace("\r", "")
+
+    def byte_offset(self, offset, line_bases, line_width, position):
+        return offset + (position // line_bases) * line_width + position % line_bases
+
+'''
+Build and write the index for a fasta file, e.g. as it's
+written during an update so the first lookup doesn't have to
+'''
+def index_fasta(fasta_file):
+
+    index = fasta_index(fasta_file).build()
+    index.write()
+
+    return index
+
+'''
+Fetch the index for a fasta file, from memory if we've
+seen it recently and it hasn't changed since
+'''
+def load_index(fasta_file):
+
+    mtime = os.path.getmtime(fasta_file)
+
+    cached = index_cache.get(fasta_file)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    index = fasta_index(fasta_file).load()
+    index_cache.put(fasta_file, (mtime, index))
+
+    return index
+
+'''
+Find the .fna file for a replicon of a version
+'''
+def replicon_fasta(rep_accnum, version='current'):
+
+    version = Version.fetch(version)
+    accnum = rep_accnum.split('.')[0]
+
+    fasta_file = path_cache.get((version, accnum))
+    if fasta_file:
+        return fasta_file
+
+    found = query.replicon_paths([accnum], version=version)
+    if accnum not in found:
+        raise Exception("Replicon {} isn't in version {}".format(rep_accnum, version))
+
+    fasta_file = found[accnum].path + '.fna'
+    if not os.path.exists(fasta_file):
+        raise Exception("Replicon {} has no fna file, {}".format(rep_accnum, fasta_file))
+
+    path_cache.put((version, accnum), fasta_file)
+
+    return fasta_file
+
+'''
+Fetch the sequence of a replicon from start to end, 1 based
+and inclusive as in a genbank file.  Strand -1 gives the
+reverse complement.
+
+The window is clipped to the ends of the replicon, an
+exception is raised if it's entirely outside it.
+'''
+def get_sequence(rep_accnum, start, end, strand=1, version='current'):
+
+    start = int(start)
+    end = int(end)
+    if start > end:
+        raise Exception("Start {} is after end {}".format(start, end))
+
+    index = load_index(replicon_fasta(rep_accnum, version))
+
+    name = index.find(rep_accnum)
+    if name is None:
+        raise Exception("Can't find {} in {}".format(rep_accnum, index.fasta_file))
+
+    length = index.records[name][0]
+    if not length:
+        return ''
+
+    if start > length or end < 1:
+        raise Exception("{}..{} is outside {}, which is {} bp".format(start, end, rep_accnum, length))
+
+    seq = index.fetch(name, max(start, 1) - 1, min(end, length))
+
+    if int(strand) < 0:
+        seq = reverse_complement(seq)
+
+    return seq
+
+def reverse_complement(seq):
+    return seq.translate(complements)[::-1]
@@ -0,0 +1,423 @@
+'''
+A small read-only HTTP service answering MicrobeDB lookups as JSON
+
+Rather than every cluster job opening its own database connection
+to find a replicon's files, they can ask one long running service
+sharing a pool of connections:
+
+    GET  /versions                          every version
+    GET  /version/<version>                 one version (a number, current or latest)
+    GET  /genome/<assembly_accession>       a genome
+    GET  /genomes?taxon=&rank=&rep_type=    the genomes of a taxon and/or replicon type
+    GET  /replicon/<rep_accnum>             a replicon's files (see microbedb.query.file_record)
+    GET  /replicons?gpv_id=<id>&gpv_id=...  the replicons of genomes
+    GET  /taxonomy/<taxid>                  a lineage
+    GET  /stats                             cache statistics
+
+Every lookup but /versions and /taxonomy takes a ?version= (default
+current).  Many lookups can be made at once by POSTing a JSON object
+to /genomes ({"accessions": [...]}), /replicons ({"accessions": [...]}
+or {"gpv_ids": [...]}) or /taxonomy ({"taxids": [...]}), again with
+an optional "version".
+
+Answers are cached in memory by version number, per accession for
+the lookups so bulk requests share the cache with single ones, and
+accessions that aren't found are cached too.  Only the current and
+older versions are cached, a version newer than the current one is
+still being built and its answers can change.  The version table is
+re-read at most every version_ttl seconds and the whole cache is
+dropped when it changes, e.g. when Version.set_current makes a new
+version live or a version is removed.
+'''
+
+import time
+import json
+import logging
+import threading
+from urlparse import urlparse, parse_qs
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+from microbedb.cache import lru_cache
+import microbedb.query as query
+from microbedb.models.taxonomy import valid_ranks
+
+logger = logging.getLogger(__name__)
+
+# Marks a lookup that isn't cached, None is
+# cached for accessions that don't exist
+not_cached = object()
+
+class request_error(Exception):
+
+    def __init__(self, message, status=400):
+        Exception.__init__(self, message)
+        self.status = status
+
+class query_service():
+
+    def __init__(self, cache_size=100000, version_ttl=5.0):
+
+        self.cache = lru_cache(maxsize=cache_size)
+        self.version_ttl = version_ttl
+        self.lock = threading.Lock()
+        self.versions = []
+        self.version_state = None
+        self.checked = 0
+        self.invalidations = 0
+
+    '''
+    Re-read the version table if it hasn't been in version_ttl
+    seconds, dropping the cache if the versions have changed
+    '''
+    def refresh_versions(self, force=False):
+
+        with self.lock:
+            if not force and time.time() - self.checked < self.version_ttl:
+                return
+
+            versions = query.versions()
+            state = tuple((v.version_id, bool(v.is_current)) for v in versions)
+
+            if self.version_state is not None and state != self.version_state:
+                logger.info("MicrobeDB versions changed, dropping %s cached answers", len(self.cache))
+                self.cache.clear()
+                self.invalidations += 1
+
+            self.versions = versions
+            self.version_state = state
+            self.checked = time.time()
+
+    '''
+    Turn a version number, current or latest in to a version_id
+    '''
+    def resolve_version(self, version='current'):
+
+        self.refresh_versions()
+        versions = self.versions
+
+        if version == 'current':
+            current = [v.version_id for v in versions if v.is_current]
+            if not current:
+                raise request_error("There is no current version", 404)
+            return current[0]
+
+        if version == 'latest':
+            if not versions:
+                raise request_error("There are no versions", 404)
+            return versions[-1].version_id
+
+        try:
+            version = int(version)
+        except (TypeError, ValueError):
+            raise request_error("Unknown version {}".format(version))
+
+        if version not in [v.version_id for v in versions]:
+            raise request_error("Version {} doesn't exist".format(version), 404)
+
+        return version
+
+    #
+    # Answers from a version still being built (newer than the
+    # current one) change as the update goes, and taxonomy rows can
+    # be added at any time, so only those that can't change are cached
+    #
+    def cacheable(self, version, value):
+
+        if version is None:
+            return value is not None
+
+        current = [v.version_id for v in self.versions if v.is_current]
+
+        return bool(current) and version <= current[0]
+
+    def version(self, version='current'):
+        version = self.resolve_version(version)
+
+        return [record_dict(v) for v in self.versions if v.version_id == version][0]
+
+    def all_versions(self):
+        self.refresh_versions()
+
+        return [record_dict(v) for v in self.versions]
+
+    '''
+    Look up many keys of one kind in a version, from the cache where
+    we can and with one batched query for the rest
+    '''
+    def cached_lookup(self, kind, version, keys, fetch):
+
+        found = dict()
+        missing = []
+        for key in keys:
+            value = self.cache.get((version, kind, key), not_cached)
+            if value is not_cached:
+                missing.append(key)
+            else:
+                found[key] = value
+
+        if missing:
+            fetched = fetch(missing)
+            for key in missing:
+                value = record_dict(fetched.get(key))
+                if self.cacheable(version, value):
+                    self.cache.put((version, kind, key), value)
+                found[key] = value
+
+        return found
+
+    def genomes_by_accession(self, accessions, version='current'):
+        version = self.resolve_version(version)
+
+        return version, self.cached_lookup('genome', version, accessions,
+                                           lambda missing: query.genomes_by_accession(missing, version=version))
+
+    def replicons_by_accession(self, accessions, version='current'):
+        version = self.resolve_version(version)
+
+        return version, self.cached_lookup('replicon', version, accessions,
+                                           lambda missing: query.replicon_paths(missing, version=version))
+
+    def replicons_for_genomes(self, gpv_ids, version='current'):
+        version = self.resolve_version(version)
+        gpv_ids = [int_param(g, 'gpv_id') for g in gpv_ids]
+
+        def fetch(missing):
+            replicons = query.replicons_for_genomes(missing, version=version)
+            # A genome without replicons is a valid answer
+            return dict((g, replicons.get(g, [])) for g in missing)
+
+        return version, self.cached_lookup('genome_replicons', version, gpv_ids, fetch)
+
+    def lineages(self, taxids):
+        self.refresh_versions()
+        taxids = [int_param(t, 'taxid') for t in taxids]
+
+        return self.cached_lookup('taxonomy', None, taxids, query.lineages)
+
+    '''
+    The genomes of a taxon and/or replicon type, cached
+    as a whole as these are rarely asked for
+    '''
+    def genomes(self, version='current', taxon=None, rank=None, rep_type=None):
+        version = self.resolve_version(version)
+
+        if taxon is None and not rep_type:
+            raise request_error("Give a taxon and/or rep_type")
+
+        if rank and rank not in valid_ranks:
+            raise request_error("Unknown taxonomic rank {}, expected one of {}".format(rank, ", ".join(valid_ranks)))
+
+        key = (version, 'genomes', (taxon, rank, rep_type))
+        value = self.cache.get(key, not_cached)
+
+        if value is not_cached:
+            try:
+                value = [record_dict(gp) for gp in query.genomes(version=version, taxon=taxon, rank=rank, rep_type=rep_type)]
+            except ValueError:
+                raise request_error("A taxon without a rank must be a taxid")
+
+            if self.cacheable(version, value):
+                self.cache.put(key, value)
+
+        return version, value
+
+    def stats(self):
+        return {'cached': len(self.cache),
+                'cache_size': self.cache.maxsize,
+                'hits': self.cache.hits,
+                'misses': self.cache.misses,
+                'invalidations': self.invalidations}
+
+'''
+A record as a JSON friendly dict, with the path
+for a replicon's files
+'''
+def record_dict(record):
+
+    if record is None:
+        return None
+
+    if isinstance(record, list):
+        return [record_dict(r) for r in record]
+
+    values = dict(record._asdict())
+    if isinstance(record, query.file_record):
+        values['path'] = record.path
+
+    return values
+
+def int_param(value, name):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise request_error("{} must be a number, not {}".format(name, value))
+
+class query_handler(BaseHTTPRequestHandler):
+
+    server_version = 'MicrobeDB'
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = [p for p in url.path.split('/') if p]
+        params = dict((k, v[-1]) for k, v in parse_qs(url.query).items())
+        params['gpv_ids'] = parse_qs(url.query).get('gpv_id', [])
+
+        self.respond(lambda: self.route_get(parts, params))
+
+    def do_POST(self):
+        parts = [p for p in urlparse(self.path).path.split('/') if p]
+
+        self.respond(lambda: self.route_post(parts, self.read_body()))
+
+    def route_get(self, parts, params):
+        service = self.server.service
+        version = params.get('version', 'current')
+
+        if parts == ['versions']:
+            return service.all_versions()
+
+        if parts == ['stats']:
+            return service.stats()
+
+        if len(parts) == 2 and parts[0] == 'version':
+            return service.version(parts[1])
+
+        if len(parts) == 2 and parts[0] == 'genome':
+            return single(service.genomes_by_accession([parts[1]], version), parts[1])
+
+        if parts == ['genomes']:
+            version, genomes = service.genomes(version, params.get('taxon'), params.get('rank'), params.get('rep_type'))
+            return {'version': version, 'genomes': genomes}
+
+        if len(parts) == 2 and parts[0] == 'replicon':
+            return single(service.replicons_by_accession([parts[1]], version), parts[1])
+
+        if parts == ['replicons'] and params['gpv_ids']:
+            version, replicons = service.replicons_for_genomes(params['gpv_ids'], version)
+            return {'version': version, 'replicons': replicons}
+
+        if len(parts) == 2 and parts[0] == 'taxonomy':
+            lineage = service.lineages([parts[1]]).values()[0]
+            if lineage is None:
+                raise request_error("Taxid {} not found".format(parts[1]), 404)
+            return lineage
+
+        raise request_error("Unknown request {}".format(self.path), 404)
+
+    def route_post(self, parts, body):
+        service = self.server.service
+        version = body.get('version', 'current')
+
+        if parts == ['genomes']:
+            version, genomes = service.genomes_by_accession(body_list(body, 'accessions'), version)
+            return {'version': version, 'genomes': genomes}
+
+        if parts == ['replicons'] and 'gpv_ids' in body:
+            version, replicons = service.replicons_for_genomes(body_list(body, 'gpv_ids'), version)
+            return {'version': version, 'replicons': replicons}
+
+        if parts == ['replicons']:
+            version, replicons = service.replicons_by_accession(body_list(body, 'accessions'), version)
+            return {'version': version, 'replicons': replicons}
+
+        if parts == ['taxonomy']:
+            return {'taxonomy': service.lineages(body_list(body, 'taxids'))}
+
+        raise request_error("Unknown request {}".format(self.path), 404)
+
+    def read_body(self):
+
+        length = int(self.headers.getheader('content-length') or 0)
+        if length > self.server.max_body:
+            raise request_error("Request body too large", 413)
+
+        try:
+            body = json.loads(self.rfile.read(length) or '{}')
+        except ValueError:
+            raise request_error("The request body isn't valid JSON")
+
+        if not isinstance(body, dict):
+            raise request_error("The request body must be a JSON object")
+
+        return body
+
+    '''
+    Answer a request with the JSON of whatever call returns,
+    or of the error it raises
+    '''
+    def respond(self, call):
+
+        try:
+            status, answer = 200, call()
+        except request_error as e:
+            status, answer = e.status, {'error': str(e)}
+        except Exception as e:
+            logger.exception("Error answering %s", self.path)
+            status, answer = 500, {'error': str(e)}
+
+        data = json.dumps(answer, default=str)
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    # Requests go to our logger rather than stderr
+    def log_message(self, format, *args):
+        logger.debug("%s %s", self.address_string(), format % args)
+
+#
+# Answer for a single accession, 404 if it wasn't found
+#
+def single(answer, key):
+    version, found = answer
+
+    if found.get(key) is None:
+        raise request_error("{} not found in version {}".format(key, version), 404)
+
+    return found[key]
+
+def body_list(body, name):
+
+    values = body.get(name)
+    if not isinstance(values, list):
+        raise request_error("Give a list of {}".format(name))
+
+    for value in values:
+        if isinstance(value, bool) or not isinstance(value, (basestring, int, long)):
+            raise request_error("{} should be strings or numbers, not {}".format(name, json.dumps(value)))
+
+    return values
+
+class query_server(ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    # Bulk requests of more than a few hundred
+    # thousand accessions should be split up
+    max_body = 16 * 1024 * 1024
+
+    def __init__(self, address, service):
+        HTTPServer.__init__(self, address, query_handler)
+        self.service = service
+
+'''
+Serve lookups on host:port until interrupted
+'''
+def serve(host='127.0.0.1', port=8080, cache_size=100000, version_ttl=5.0):
+    service = query_service(cache_size=cache_size, version_ttl=version_ttl)
+    service.refresh_versions(force=True)
+
+    server = query_server((host, port), service)
+    logger.info("Serving MicrobeDB lookups on %s:%s", *server.server_address[:2])
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+    return service
@@ -0,0 +1,176 @@
+'''
+Library to share a MicrobeDB update between several processes
+
+One process seeds the work table (SyncWork) with NCBI's species
+directories for the version being built, then any number of
+workers, on any number of nodes sharing the database, claim
+batches of directories and process them with ncbi_fetcher.
+The workers don't touch the version's protein index, it's
+built in one process once all the work is finished.
+
+While a worker holds leases a background thread renews them
+(the heartbeat), if the worker dies the leases run out and the
+directories are picked up by another worker.  Genomes a dead
+worker had partially ingested are resumed from their ingest
+state (see GenomeProject_Ingest).
+'''
+
+import time
+import logging
+import threading
+import microbedb.config_singleton
+from .models import *
+from .models.syncwork import worker_name
+from .ncbi import ncbi_fetcher
+from .protein_index import build_index
+
+class shard_worker():
+
+    def __init__(self, version='latest', batch_size=None, lease_seconds=None, max_attempts=None):
+
+        self.cfg = microbedb.config_singleton.getConfig()
+        self.logger = logging.getLogger(__name__)
+
+        self.version = Version.fetch(version)
+        self.batch_size = int(batch_size or self.cfg.get('work_batch_size', 5))
+        self.lease_seconds = int(lease_seconds or self.cfg.get('work_lease_seconds', 600))
+        self.max_attempts = int(max_attempts or self.cfg.get('work_max_attempts', 3))
+
+        self.name = worker_name()
+        self.stopping = threading.Event()
+        self.processed = 0
+        self.failed = 0
+
+    def __str__(self):
+        return "shard_worker(): {}, version: {}".format(self.name, self.version)
+
+    '''
+    Put NCBI's species directories in the work table
+    for the version, returns the number added
+    '''
+    def seed(self):
+
+        fetcher = ncbi_fetcher()
+        genome_names = fetcher.ftp.nlst()
+
+        return SyncWork.seed(genome_names, version=self.version)
+
+    '''
+    Claim and process batches of directories until all the work is
+    finished, while other workers hold leases we wait around in case
+    they die and their work needs picking up.  Returns the number of
+    directories processed.
+    '''
+    def run(self):
+
+        self.logger.info("Starting sync worker {}, version {}".format(self.name, self.version))
+
+        # The protein index is one SQLite file, workers on other
+        # nodes can't share it so it's built by finish()
+        fetcher = ncbi_fetcher(index_inline=False)
+        Taxonomy.warm_cache()
+
+        heartbeat = threading.Thread(target=self.heartbeat, name="heartbeat")
+        heartbeat.daemon = True
+        heartbeat.start()
+
+        try:
+            while True:
+                batch = SyncWork.claim(self.name, batch_size=self.batch_size, version=self.version,
+                                       lease_seconds=self.lease_seconds, max_attempts=self.max_attempts)
+
+                if not batch:
+                    if not SyncWork.summary(self.version)['leased']:
+                        break
+
+                    remove_session()
+                    time.sleep(min(self.lease_seconds / 3 + 1, 60))
+                    continue
+
+                # Only the ids, the rows belong to this
+                # thread's session
+                for work_id, genome_name in [(work.work_id, work.genome_name) for work in batch]:
+                    self.process(fetcher, work_id, genome_name)
+
+        finally:
+            self.stopping.set()
+            heartbeat.join()
+
+        self.logger.info("Sync worker {} finished, processed: {}, failed: {}, work: {}".format(self.name, self.processed, self.failed, SyncWork.summary(self.version)))
+
+        return self.processed
+
+    #
+    # Process one directory we hold the lease on and
+    # release it
+    #
+    def process(self, fetcher, work_id, genome_name):
+
+        self.logger.info("Worker {} processing {}".format(self.name, genome_name))
+
+        try:
+            if not fetcher.check_and_reconnect():
+                raise Exception("Lost connection to the ftp server")
+
+            # Failed genomes are logged and skipped by the fetcher, the
+            # directory is retried (up to max_attempts) to pick them up
+            failed = fetcher.process_directory(genome_name)
+            if failed:
+                raise Exception("{} genomes failed in {}".format(failed, genome_name))
+
+        except Exception as e:
+            self.logger.exception("Error processing directory {}".format(genome_name))
+            self.failed += 1
+
+            # Our session may be in a bad state, start over
+            remove_session()
+            SyncWork.fail(work_id, self.name, e, max_attempts=self.max_attempts)
+            return
+
+        if SyncWork.release(work_id, self.name):
+            self.processed += 1
+
+    #
+    # Keep our leases alive while we work, a third of the way
+    # through the lease so a slow renewal or two doesn't lose them
+    #
+    def heartbeat(self):
+
+        interval = max(1, self.lease_seconds / 3)
+
+        while not self.stopping.wait(interval):
+            try:
+                rows = SyncWork.renew(self.name, lease_seconds=self.lease_seconds)
+                self.logger.debug("Worker {} renewed {} leases".format(self.name, rows))
+
+            except Exception as e:
+                self.logger.exception("Error renewing leases for {}".format(self.name))
+
+        remove_session()
+
+    '''
+    Wait for all the work for the version to be finished (done or
+    failed), returns the counts of work by state
+    '''
+    def wait(self, poll_seconds=30):
+
+        while True:
+            counts = SyncWork.summary(self.version)
+            self.logger.info("Work for version {}: {}".format(self.version, counts))
+
+            if not counts['pending'] and not counts['leased']:
+                return counts
+
+            # Leases whose workers died and have no attempts left
+            # won't be claimed again, so expire them here
+            SyncWork.expire(self.version, self.max_attempts)
+
+            remove_session()
+            time.sleep(poll_seconds)
+
+    '''
+    Build the version's protein index from the genomes the
+    workers loaded, returns the number of proteins indexed
+    '''
+    def build_protein_index(self):
+        return build_index(self.version)
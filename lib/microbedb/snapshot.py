@@ -0,0 +1,140 @@
+'''
+Library to export a version of MicrobeDB to a read-only
+SQLite snapshot
+
+A snapshot holds the version, genomeproject, genomeproject_meta,
+genomeproject_checksum, replicon and taxonomy rows for a single
+version, indexed the same way as the main database.  It's written
+in to the version's dl_directory so compute nodes can query it
+locally (see microbedb.models.open_snapshot) rather than going
+back to the central database.
+'''
+
+import os
+import logging
+from sqlalchemy import create_engine, select, union, Index, MetaData
+import microbedb.config_singleton
+from .models import *
+from .models import Base, stream_rows
+
+logger = logging.getLogger(__name__)
+
+snapshot_filename = 'microbedb_snapshot.sqlite'
+
+# Tables to copy, in order, and the indexes to build once they're loaded
+snapshot_tables = ['version', 'taxonomy', 'genomeproject', 'genomeproject_meta', 'genomeproject_checksum', 'replicon']
+
+snapshot_indexes = [('genomeproject', 'assembly_index', ['assembly_accession', 'asm_name', 'version_id'], True),
+                    ('genomeproject', 'gp_versions', ['version_id'], False),
+                    ('genomeproject', 'gp_taxid', ['taxid'], False),
+                    ('genomeproject', 'gp_species_taxid', ['species_taxid'], False),
+                    ('genomeproject_checksum', 'gpcs_gpv_id', ['gpv_id'], False),
+                    ('replicon', 'rep_version', ['version_id'], False),
+                    ('replicon', 'rep_gpv_id', ['gpv_id'], False),
+                    ('replicon', 'rep_accnum', ['rep_accnum'], False),
+                    ('replicon', 'version_and_rep_type', ['version_id', 'rep_type'], False)]
+
+'''
+The default location of the snapshot for a version, None
+if the version can't be found
+'''
+def snapshot_path(version='current'):
+    path = Version.fetch_path(version)
+
+    if not path:
+        return None
+
+    return os.path.join(path, snapshot_filename)
+
+'''
+Export a version of MicrobeDB to a SQLite snapshot file, by default
+in the version's dl_directory.  Rows are streamed from the database in
+batches of batch_size so the whole version is never held in memory.
+
+The snapshot is built under a temporary name and moved in to place
+once complete, so readers never see a partial file.
+
+Returns the path to the snapshot
+'''
+def export_snapshot(version='current', path=None, batch_size=5000):
+    version = Version.fetch(version)
+
+    if not path:
+        path = snapshot_path(version)
+
+    if not path:
+        raise Exception("Can't find a path for version {}".format(version))
+
+    logger.info("Exporting MicrobeDB version {} to snapshot {}".format(version, path))
+
+    tmp_path = path + '.tmp'
+    if os.path.exists(tmp_path):
+        os.unlink(tmp_path)
+
+    target = create_engine('sqlite:///' + tmp_path)
+
+    # The snapshot's schema (and its indexes) is built on a copy
+    # of the tables, so nothing is added to the shared metadata
+    metadata = MetaData()
+    tables = [Base.metadata.tables[t].tometadata(metadata) for t in snapshot_tables]
+    metadata.create_all(target)
+
+    try:
+        with target.begin() as target_conn:
+            # Speed up the bulk load, the file is thrown away if we fail
+            target_conn.execute("PRAGMA synchronous=OFF")
+
+            for table in tables:
+                count = 0
+
+                for rows in stream_rows(snapshot_query(table, version), batch_size):
+                    target_conn.execute(table.insert(), [dict(row) for row in rows])
+                    count += len(rows)
+
+                logger.debug("Copied {} rows from {}".format(count, table.name))
+
+            # The snapshot only holds this version, so from the
+            # point of view of anyone reading it this is the current one
+            version_table = metadata.tables['version']
+            target_conn.execute(version_table.update().values(is_current=True))
+
+        # Index after loading, it's much quicker than
+        # maintaining the indexes row by row
+        for table_name, index_name, columns, unique in snapshot_indexes:
+            table = metadata.tables[table_name]
+            Index(index_name, *[table.c[c] for c in columns], unique=unique).create(target)
+
+        target.execute("ANALYZE")
+        target.execute("VACUUM")
+        target.dispose()
+
+        os.rename(tmp_path, path)
+
+    except Exception as e:
+        logger.exception("Error exporting snapshot for version {}".format(version))
+        target.dispose()
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise e
+
+    logger.info("Snapshot for version {} written to {}".format(version, path))
+
+    return path
+
+#
+# The rows of a table that belong in the snapshot for a version
+#
+def snapshot_query(table, version):
+    tables = Base.metadata.tables
+    gp = tables['genomeproject']
+
+    if table.name == 'taxonomy':
+        taxids = union(select([gp.c.taxid]).where(gp.c.version_id == version),
+                       select([gp.c.species_taxid]).where(gp.c.version_id == version))
+        return select([table]).where(table.c.taxon_id.in_(taxids))
+
+    elif table.name == 'genomeproject_meta':
+        gpv_ids = select([gp.c.gpv_id]).where(gp.c.version_id == version)
+        return select([table]).where(table.c.gpv_id.in_(gpv_ids))
+
+    return select([table]).where(table.c.version_id == version)
@@ -0,0 +1,240 @@
+'''
+Library to account for the SQL a MicrobeDB run issues
+
+When enabled, SQLAlchemy engine events time every statement
+sent to the database and tally them by statement, by the line
+of MicrobeDB code that caused them (the call site) and by the
+genome being processed at the time.  At the end of a run the
+slowest and most frequent statements can be reported, which
+makes it easy to spot a change that turns one query per genome
+in to one per replicon (N+1 queries).
+
+Finding the call site walks the stack for every statement, so
+this is for measuring runs, not to leave on all the time.
+'''
+
+import os
+import json
+import time
+import logging
+import threading
+import traceback
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# Call sites are in the MicrobeDB library or scripts, but not this file
+package_dir = os.path.dirname(os.path.abspath(__file__))
+install_dir = os.path.dirname(os.path.dirname(package_dir))
+site_dirs = [package_dir, os.path.join(install_dir, 'bin')]
+skip_files = [os.path.join(package_dir, 'sqlstats.py')]
+
+class statement_stats():
+
+    def __init__(self):
+        self.count = 0
+        self.rows = 0
+        self.seconds = 0.0
+        self.max = 0.0
+
+    def add(self, seconds, rows=1):
+        self.count += 1
+        self.rows += rows
+        self.seconds += seconds
+        self.max = max(self.max, seconds)
+
+    def summary(self):
+        return {'count': self.count,
+                'statements': self.rows,
+                'seconds': round(self.seconds, 6),
+                'max': round(self.max, 6),
+                'mean': round(self.seconds / self.count, 6) if self.count else 0.0}
+
+class query_accounting():
+
+    def __init__(self):
+
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.enabled = False
+
+        # Listeners are removed by identity, keep hold of the bound methods
+        self.listeners = [('before_cursor_execute', self.before_cursor_execute),
+                          ('after_cursor_execute', self.after_cursor_execute)]
+        self.reset()
+
+    def reset(self):
+
+        with self.lock:
+            self.total = statement_stats()
+            self.statements = dict()
+            self.call_sites = dict()
+            self.genomes = dict()
+
+    '''
+    Start accounting for the statements of every engine
+    '''
+    def enable(self):
+
+        if self.enabled:
+            return
+
+        for name, fn in self.listeners:
+            event.listen(Engine, name, fn)
+        self.enabled = True
+
+        logger.info("SQL query accounting enabled")
+
+    def disable(self):
+
+        if not self.enabled:
+            return
+
+        for name, fn in self.listeners:
+            event.remove(Engine, name, fn)
+        self.enabled = False
+
+    '''
+    Set the genome statements from the calling thread are
+    counted against, None to stop counting them per genome
+    '''
+    def set_genome(self, genome):
+        self.local.genome = genome
+
+    # The start time is kept on the statement's execution context, so
+    # a statement that fails (and never gets an after_cursor_execute)
+    # leaves nothing behind on its connection.  Statements without a
+    # context are the dialect's own, run when connecting, and aren't counted
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._query_start = time.time()
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        start = getattr(context, '_query_start', None)
+        if start is None:
+            return
+
+        seconds = time.time() - start
+
+        # executemany sends many statements in one round trip
+        rows = len(parameters) if executemany and parameters else 1
+
+        site = call_site()
+        genome = getattr(self.local, 'genome', None)
+
+        with self.lock:
+            self.total.add(seconds, rows)
+
+            for table, key in [(self.statements, statement), (self.call_sites, site), (self.genomes, genome)]:
+                if key is None:
+                    continue
+
+                if key not in table:
+                    table[key] = statement_stats()
+
+                table[key].add(seconds, rows)
+
+    '''
+    Summarize what's been recorded, the top statements by total
+    time, slowest single execution and count, the top call sites
+    and genomes by count, with the totals
+    '''
+    def report(self, top=10):
+
+        with self.lock:
+            genomes = len(self.genomes)
+            report = {'round_trips': self.total.count,
+                      'statements': self.total.rows,
+                      'seconds': round(self.total.seconds, 6),
+                      'genomes': genomes,
+                      'round_trips_per_genome': round(float(self.total.count) / genomes, 2) if genomes else None,
+                      'slowest_total': top_n(self.statements, 'statement', top, lambda s: s.seconds),
+                      'slowest_single': top_n(self.statements, 'statement', top, lambda s: s.max),
+                      'most_frequent': top_n(self.statements, 'statement', top, lambda s: s.count),
+                      'call_sites': top_n(self.call_sites, 'call_site', top, lambda s: s.count),
+                      'busiest_genomes': top_n(self.genomes, 'genome', top, lambda s: s.count)}
+
+        return report
+
+    '''
+    Write the report as JSON and log the headline numbers
+    '''
+    def write_report(self, filename, top=10):
+
+        report = self.report(top)
+
+        with open(filename, 'w') as outfile:
+            json.dump(report, outfile, indent=1)
+
+        self.log_report(report)
+        logger.info("Wrote SQL query accounting to {}".format(filename))
+
+        return report
+
+    def log_report(self, report):
+
+        logger.info("SQL: {round_trips} round trips, {statements} statements, {seconds}s, {genomes} genomes, {round_trips_per_genome} round trips per genome".format(**report))
+
+        for entry in report['most_frequent']:
+            logger.info("SQL most frequent: {count} x {mean}s: {statement}".format(**entry))
+
+        for entry in report['slowest_total']:
+            logger.info("SQL slowest: {seconds}s over {count}: {statement}".format(**entry))
+
+        for entry in report['call_sites']:
+            logger.info("SQL call site: {count} round trips, {seconds}s: {call_site}".format(**entry))
+
+#
+# The n entries of a stats dict with the highest value of key,
+# as a list of dicts with the dict key under name
+#
+def top_n(stats, name, n, key):
+
+    ordered = sorted(stats.items(), key=lambda item: key(item[1]), reverse=True)[:n]
+
+    return [dict([(name, k)] + v.summary().items()) for k, v in ordered]
+
+#
+# The innermost frame of MicrobeDB code (lib or bin) on the stack,
+# as file:line function
+#
+def call_site():
+
+    for filename, lineno, function, text in reversed(traceback.extract_stack()):
+        filename = os.path.abspath(filename)
+
+        if filename in skip_files or not any(filename.startswith(d) for d in site_dirs):
+            continue
+
+        return "{}:{} {}".format(os.path.basename(filename), lineno, function)
+
+    return None
+
+accounting = query_accounting()
+
+'''
+Fetch the query accounting shared by the whole process
+'''
+def getQueryAccounting():
+    return accounting
+
+#
+# Count the statements issued in a block against a genome, e.g.
+#
+#   with sql_genome(assembly['assembly_accession']):
+#       ...
+#
+class sql_genome():
+
+    def __init__(self, genome):
+        self.genome = genome
+
+    def __enter__(self):
+        self.previous = getattr(accounting.local, 'genome', None)
+        accounting.set_genome(self.genome)
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        accounting.set_genome(self.previous)
+        return False
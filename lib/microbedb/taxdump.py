@@ -0,0 +1,190 @@
+'''
+Library to read NCBI's taxonomy dump (taxdump) files
+
+Rather than going to NCBI's eutils for every taxid, the
+nodes.dmp and names.dmp files from a local copy of
+ftp://ftp.ncbi.nih.gov/pub/taxonomy/taxdump.tar.gz can be
+loaded in to memory and lineages looked up with no network
+round trips.
+
+The tree is kept as parent pointers in compact arrays indexed
+by taxid, one for the parent taxid and one for an index in
+to the list of rank names.
+'''
+
+import os
+import logging
+from array import array
+import microbedb.config_singleton
+
+logger = logging.getLogger(__name__)
+
+class taxdump_loader():
+
+    def __init__(self, path):
+
+        self.logger = logging.getLogger(__name__)
+        self.path = path
+
+        self.parents = array('i')
+        self.rank_idx = array('B')
+        self.ranks = []
+        self.names = dict()
+        self.synonyms = dict()
+        self.merged = dict()
+
+        self.load_nodes(os.path.join(path, 'nodes.dmp'))
+        self.load_names(os.path.join(path, 'names.dmp'))
+
+        merged_file = os.path.join(path, 'merged.dmp')
+        if os.path.exists(merged_file):
+            self.load_merged(merged_file)
+
+    def __str__(self):
+        return "taxdump_loader(): {}".format(self.path)
+
+    '''
+    Load the parent pointers and ranks from nodes.dmp
+    '''
+    def load_nodes(self, filename):
+        self.logger.info("Loading taxdump nodes from {}".format(filename))
+
+        rank_lookup = dict()
+        parents = self.parents
+        rank_idx = self.rank_idx
+
+        with open(filename, 'r') as infile:
+            for line in infile:
+                taxid, parent, rank, rest = line.split("\t|\t", 3)
+                taxid = int(taxid)
+
+                # Grow the arrays as needed, doubling to keep
+                # the number of resizes down
+                if taxid >= len(parents):
+                    grow = max(taxid + 1, len(parents) * 2) - len(parents)
+                    parents.extend(array('i', [0]) * grow)
+                    rank_idx.extend(array('B', [0]) * grow)
+
+                if rank not in rank_lookup:
+                    rank_lookup[rank] = len(self.ranks)
+                    self.ranks.append(rank)
+
+                parents[taxid] = int(parent)
+                rank_idx[taxid] = rank_lookup[rank]
+
+        self.logger.debug("Loaded nodes, largest taxid {}, {} ranks".format(len(parents) - 1, len(self.ranks)))
+
+    '''
+    Load the scientific names and synonyms from names.dmp
+    '''
+    def load_names(self, filename):
+        self.logger.info("Loading taxdump names from {}".format(filename))
+
+        names = self.names
+        synonyms = self.synonyms
+
+        with open(filename, 'r') as infile:
+            for line in infile:
+                taxid, name, unique_name, name_class = line.split("\t|\t")
+                name_class = name_class.rstrip("\t|\n")
+
+                if name_class == 'scientific name':
+                    names[int(taxid)] = name
+                elif name_class == 'equivalent name' or name_class == 'synonym':
+                    synonyms.setdefault(int(taxid), []).append((name_class, name))
+
+    '''
+    Load the mapping of old, merged, taxids to their new taxid
+    '''
+    def load_merged(self, filename):
+        self.logger.info("Loading taxdump merged taxids from {}".format(filename))
+
+        with open(filename, 'r') as infile:
+            for line in infile:
+                old_taxid, new_taxid = line.split("\t|\t")
+                self.merged[int(old_taxid)] = int(new_taxid.rstrip("\t|\n"))
+
+    '''
+    Does the dump know about this taxid
+    '''
+    def has_taxid(self, taxid):
+        taxid = self.merged.get(int(taxid), int(taxid))
+
+        return taxid < len(self.parents) and taxid in self.names
+
+    '''
+    Build the lineage dict for a taxid the same way as
+    Taxonomy.ncbi_fetch does from eutils, None if the
+    taxid isn't in the dump
+    '''
+    def lineage(self, taxid, valid_ranks):
+        taxid = int(taxid)
+        taxid = self.merged.get(taxid, taxid)
+
+        if not self.has_taxid(taxid):
+            return None
+
+        lineage = dict()
+        parents = self.parents
+
+        # Walk up the tree to the root, it points to itself
+        node = parents[taxid]
+        while node > 1:
+            rank = self.ranks[self.rank_idx[node]]
+            if rank in valid_ranks and node in self.names:
+                lineage[rank] = self.names[node]
+
+            if parents[node] == node:
+                break
+            node = parents[node]
+
+        if taxid in self.synonyms:
+            equivalent = [name for name_class, name in self.synonyms[taxid] if name_class == 'equivalent name']
+            synonym = [name for name_class, name in self.synonyms[taxid] if name_class == 'synonym']
+            lineage['synonyms'] = '; '.join(equivalent + synonym)
+
+        # And the taxon itself
+        rank = self.ranks[self.rank_idx[taxid]]
+        if rank == 'no rank':
+            lineage['other'] = self.names[taxid]
+        else:
+            lineage[rank] = self.names[taxid]
+
+        return lineage
+
+loader = None
+
+'''
+Fetch the taxdump for the path given in the config file (taxdump_dir),
+it's loaded once and shared.  None if no taxdump is configured.
+'''
+def fetch_taxdump():
+    global loader
+
+    if loader:
+        return loader
+
+    cfg = microbedb.config_singleton.getConfig()
+
+    path = cfg.get('taxdump_dir', None)
+    if not path:
+        return None
+
+    if not os.path.exists(os.path.join(path, 'nodes.dmp')):
+        logger.error("taxdump_dir {} doesn't contain a nodes.dmp, not using it".format(path))
+        return None
+
+    loader = taxdump_loader(path)
+
+    return loader
+
+'''
+Use the taxdump in the given directory rather than
+the one in the config file
+'''
+def init_taxdump(path):
+    global loader
+
+    loader = taxdump_loader(path)
+
+    return loader
@@ -0,0 +1,133 @@
+'''
+Library to compare two versions of MicrobeDB
+
+Works out which genome assemblies were added, removed,
+re-annotated (the files NCBI gave us changed) or cloned
+(unchanged, carried over from the older version) between
+two versions.  Genomes are matched on (assembly_accession,
+asm_name) and their files compared by checksum, all with
+set based queries in the database rather than walking the
+GenomeProjects in Python.
+'''
+
+import logging
+from sqlalchemy import select, and_, union
+from .models import *
+from .models import Base, stream_rows
+
+logger = logging.getLogger(__name__)
+
+'''
+Compare two versions of MicrobeDB, old_version and new_version
+can be version numbers or current/latest.
+
+Returns a dict with the versions compared, a count for each type of
+change and lists of the genomes for each:
+
+    added       - only in the new version
+    removed     - only in the old version
+    reannotated - in both, but with changed, added or removed files
+    cloned      - in both with identical files
+
+Each genome is a dict of assembly_accession, asm_name, old_gpv_id
+and new_gpv_id (None for the version it isn't in).
+'''
+def diff_versions(old_version='current', new_version='latest', batch_size=10000):
+    global logger
+
+    old_version = Version.fetch(old_version)
+    new_version = Version.fetch(new_version)
+
+    logger.info("Comparing MicrobeDB versions {} and {}".format(old_version, new_version))
+
+    tables = Base.metadata.tables
+    gp = tables['genomeproject']
+    gpcs = tables['genomeproject_checksum']
+
+    old_gp = gp.alias('old_gp')
+    new_gp = gp.alias('new_gp')
+    same_assembly = and_(old_gp.c.assembly_accession == new_gp.c.assembly_accession,
+                         old_gp.c.asm_name == new_gp.c.asm_name,
+                         old_gp.c.version_id == old_version)
+
+    report = {'old_version': old_version,
+              'new_version': new_version,
+              'added': [],
+              'removed': [],
+              'reannotated': [],
+              'cloned': []}
+
+    # Genomes only in the new version
+    query = select([new_gp.c.assembly_accession, new_gp.c.asm_name, new_gp.c.gpv_id]) \
+        .select_from(new_gp.outerjoin(old_gp, same_assembly)) \
+        .where(and_(new_gp.c.version_id == new_version, old_gp.c.gpv_id == None)) \
+        .order_by(new_gp.c.assembly_accession, new_gp.c.asm_name)
+
+    for rows in stream_rows(query, batch_size):
+        for row in rows:
+            report['added'].append(diff_entry(row[0], row[1], None, row[2]))
+
+    # Genomes only in the old version
+    new_same_assembly = and_(old_gp.c.assembly_accession == new_gp.c.assembly_accession,
+                             old_gp.c.asm_name == new_gp.c.asm_name,
+                             new_gp.c.version_id == new_version)
+    query = select([old_gp.c.assembly_accession, old_gp.c.asm_name, old_gp.c.gpv_id]) \
+        .select_from(old_gp.outerjoin(new_gp, new_same_assembly)) \
+        .where(and_(old_gp.c.version_id == old_version, new_gp.c.gpv_id == None)) \
+        .order_by(old_gp.c.assembly_accession, old_gp.c.asm_name)
+
+    for rows in stream_rows(query, batch_size):
+        for row in rows:
+            report['removed'].append(diff_entry(row[0], row[1], row[2], None))
+
+    # The genomes in the new version with a file whose checksum
+    # doesn't have an identical match in the old version, and the
+    # other way around for files that have gone away
+    changed = set()
+    old_cs = gpcs.alias('old_cs')
+    new_cs = gpcs.alias('new_cs')
+
+    new_files = select([new_cs.c.gpv_id]) \
+        .select_from(new_cs.outerjoin(old_cs, and_(old_cs.c.version_id == old_version,
+                                                   old_cs.c.filename == new_cs.c.filename,
+                                                   old_cs.c.checksum == new_cs.c.checksum))) \
+        .where(and_(new_cs.c.version_id == new_version, old_cs.c.filename == None))
+
+    old_files = select([new_gp.c.gpv_id]) \
+        .select_from(old_cs.join(old_gp, old_gp.c.gpv_id == old_cs.c.gpv_id)
+                     .join(new_gp, new_same_assembly)
+                     .outerjoin(new_cs, and_(new_cs.c.version_id == new_version,
+                                             new_cs.c.filename == old_cs.c.filename))) \
+        .where(and_(old_cs.c.version_id == old_version, new_cs.c.filename == None))
+
+    for rows in stream_rows(union(new_files, old_files), batch_size):
+        for row in rows:
+            changed.add(row[0])
+
+    # Finally the genomes in both, split by whether their files changed
+    query = select([new_gp.c.assembly_accession, new_gp.c.asm_name, old_gp.c.gpv_id, new_gp.c.gpv_id]) \
+        .select_from(new_gp.join(old_gp, same_assembly)) \
+        .where(new_gp.c.version_id == new_version) \
+        .order_by(new_gp.c.assembly_accession, new_gp.c.asm_name)
+
+    for rows in stream_rows(query, batch_size):
+        for row in rows:
+            entry = diff_entry(row[0], row[1], row[2], row[3])
+
+            if row[3] in changed:
+                report['reannotated'].append(entry)
+            else:
+                report['cloned'].append(entry)
+
+    report['counts'] = dict((change, len(report[change])) for change in ['added', 'removed', 'reannotated', 'cloned'])
+
+    logger.info("Versions {} to {}: {}".format(old_version, new_version, report['counts']))
+
+    return report
+
+def diff_entry(assembly_accession, asm_name, old_gpv_id, new_gpv_id):
+
+    return {'assembly_accession': assembly_accession,
+            'asm_name': asm_name,
+            'old_gpv_id': old_gpv_id,
+            'new_gpv_id': new_gpv_id}